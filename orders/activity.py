@@ -0,0 +1,108 @@
+"""
+会话活动与未读数
+
+询单/订单上的 message_count / last_message_at / last_activity_at 在新消息写入时由
+record_message() 用一条 UPDATE 递增维护（signals.py），删除消息时按消息表重算（refresh_activity）；
+rebuild_summaries 命令可全量重建与校验。
+
+每个用户在每个会话的已读位置存于 ThreadReadState（已读消息数 + 最后一条已读消息 id）：
+
+- 打开详情页、或在详情页收到实时推送的新消息时标记为已读（mark_read）；
+- 自己发送的消息计入已读；
+- 列表与仪表板的未读数 = message_count - read_count，由按 (用户, 会话) 唯一索引取一行的关联子查询得到，
+  不对消息表做聚合；「最新动态」排序使用 (last_activity_at, id) 索引。
+"""
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Inquiry, Message, Order, ThreadReadState
+from .numbering import supports_upsert
+
+THREADS = {
+    'inquiry': Inquiry,
+    'order': Order,
+}
+
+# 列表排序：?sort=activity 按最近活动，否则按创建时间
+SORT_FIELDS = {
+    'activity': 'last_activity_at',
+}
+
+# 已读位置：一条语句完成「首次则建行、否则更新」，已是最新时不写入
+_MARK_READ = (
+    "INSERT INTO {table} (user_id, {kind}_id, last_read_message_id, read_count, updated_at) "
+    "SELECT %s, t.id, COALESCE((SELECT m.id FROM {messages} m WHERE m.{kind}_id = t.id "
+    "ORDER BY m.created_at DESC, m.id DESC LIMIT 1), 0), t.message_count, %s "
+    "FROM {thread} t WHERE t.id = %s "
+    "ON CONFLICT (user_id, {kind}_id) WHERE {kind}_id IS NOT NULL DO UPDATE SET "
+    "last_read_message_id = excluded.last_read_message_id, read_count = excluded.read_count, "
+    "updated_at = excluded.updated_at "
+    "WHERE {table}.read_count <> excluded.read_count "
+    "OR {table}.last_read_message_id <> excluded.last_read_message_id"
+)
+
+
+def message_thread(message):
+    """消息所属会话：(kind, id)"""
+    return ('inquiry', message.inquiry_id) if message.inquiry_id else ('order', message.order_id)
+
+
+def record_message(message):
+    """新消息写入后：会话消息数 +1，更新最新消息与最近活动时间；发送人的已读位置移到最新"""
+    kind, pk = message_thread(message)
+    if pk is None:
+        return
+    at = Value(message.created_at, output_field=models.DateTimeField())
+    THREADS[kind].objects.filter(pk=pk).update(
+        message_count=F('message_count') + 1,
+        last_message_at=Greatest(Coalesce(F('last_message_at'), at), at),
+        last_activity_at=Greatest(F('last_activity_at'), at),
+    )
+    mark_read(message.sender_id, kind, pk)
+
+
+def mark_read(user_id, kind, pk):
+    """把用户在会话中的已读位置移到最新消息"""
+    if supports_upsert():
+        sql = _MARK_READ.format(table=ThreadReadState._meta.db_table, kind=kind,
+                                messages=Message._meta.db_table, thread=THREADS[kind]._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_id, timezone.now(), pk])
+        return
+    # 其它数据库：先更新，没有记录时再建
+    count = THREADS[kind].objects.filter(pk=pk).values_list('message_count', flat=True).first()
+    if count is None:
+        return
+    last_id = (Message.objects.filter(**{kind: pk}).order_by('-created_at', '-id')
+               .values_list('id', flat=True).first()) or 0
+    values = {'read_count': count, 'last_read_message_id': last_id}
+    states = ThreadReadState.objects.filter(user_id=user_id, **{kind + '_id': pk})
+    if not states.update(updated_at=timezone.now(), **values):
+        try:
+            with transaction.atomic():
+                ThreadReadState.objects.create(user_id=user_id, **{kind + '_id': pk}, **values)
+        except IntegrityError:
+            states.update(updated_at=timezone.now(), **values)
+
+
+def with_unread(queryset, kind, user_id):
+    """附加 unread_count：会话消息数 - 当前用户已读数（从未打开过的会话全部计为未读）"""
+    read = ThreadReadState.objects.filter(user_id=user_id, **{kind: OuterRef('pk')}).values('read_count')[:1]
+    return queryset.annotate(unread_count=Greatest(
+        F('message_count') - Coalesce(Subquery(read), Value(0)), Value(0),
+        output_field=models.IntegerField()))
+
+
+def sort_field(request):
+    """列表排序字段：(sort 参数, 游标字段)"""
+    sort = request.GET.get('sort') or ''
+    if sort not in SORT_FIELDS:
+        return '', 'created_at'
+    return sort, SORT_FIELDS[sort]
+
+
+def recent(queryset, kind, user_id, limit):
+    """仪表板：最近有动态的询单/订单（按 (last_activity_at, id) 索引倒序），附带未读数"""
+    return with_unread(queryset, kind, user_id).order_by('-last_activity_at', '-id')[:limit]
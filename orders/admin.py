@@ -3,13 +3,17 @@ import os
 from django.contrib import admin
 from django.utils import timezone
 from django.utils.html import format_html
+from django.utils.translation import gettext as _
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.contrib.admin import sites
 from django.contrib.admin.actions import delete_selected
+from django.core.files.storage import default_storage
 from .models import (Company, Contact, Inquiry, InquiryItem, InquiryAttachment,
-                     Order, OrderItem, OrderAttachment)
+                     Order, OrderItem, OrderAttachment, Notification)
+from .attachments import prefetch_thread_file_urls
+from .exports import export_response
 
 
 # ==================== 联系人表单（用于管理后台） ====================
@@ -231,6 +235,30 @@ class ContactAdmin(admin.ModelAdmin):
     reset_password.short_description = '🔑 重置选中用户的密码'
 
 
+# ==================== 金额区间筛选 ====================
+class AmountRangeFilter(admin.SimpleListFilter):
+    """按存储的总金额筛选（total_amount 为汇总字段，无需逐行计算）"""
+    title = '总金额'
+    parameter_name = 'amount'
+    RANGES = [
+        ('0-1000', '< $1,000', 0, 1000),
+        ('1000-10000', '$1,000 - $10,000', 1000, 10000),
+        ('10000-100000', '$10,000 - $100,000', 10000, 100000),
+        ('100000-', '≥ $100,000', 100000, None),
+    ]
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, label, _, _ in self.RANGES]
+
+    def queryset(self, request, queryset):
+        for key, _, low, high in self.RANGES:
+            if self.value() == key:
+                queryset = queryset.filter(total_amount__gte=low)
+                if high is not None:
+                    queryset = queryset.filter(total_amount__lt=high)
+        return queryset
+
+
 # ==================== 询单明细内联 ====================
 class InquiryItemInline(admin.TabularInline):
     model = InquiryItem
@@ -263,10 +291,12 @@ class InquiryAttachmentInline(admin.TabularInline):
 @admin.register(Inquiry)
 class InquiryAdmin(admin.ModelAdmin):
     list_display = ['inquiry_number', 'get_company', 'contact', 'status', 
-                    'attachment_count', 'created_at']
+                    'item_count', 'attachment_count', 'message_count', 'total_amount', 'last_activity_at', 'created_at']
+    list_select_related = ['contact__company']
     search_fields = ['inquiry_number', 'contact__company__company_name', 'contact__name']
-    list_filter = ['status', 'created_at']
+    list_filter = ['status', AmountRangeFilter, 'created_at']
     inlines = [InquiryItemInline, InquiryAttachmentInline]
+    actions = ['export_csv', 'export_xlsx']
     
     fieldsets = (
         ('询单信息', {
@@ -289,11 +319,20 @@ class InquiryAdmin(admin.ModelAdmin):
     get_company.short_description = '公司'
     
     def attachment_count(self, obj):
-        count = obj.attachments.count()
+        count = obj.attachment_count
         if count > 0:
             return format_html('<span style="color: green;">{} 个附件</span>', count)
         return '-'
     attachment_count.short_description = '附件'
+    attachment_count.admin_order_field = 'attachment_count'
+    
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        # 私有 bucket 下一次签发内联附件的全部 URL
+        if getattr(default_storage, 'signs_urls', False):
+            obj = self.get_object(request, object_id)
+            if obj is not None:
+                prefetch_thread_file_urls(obj)
+        return super().change_view(request, object_id, form_url, extra_context)
     
     def save_model(self, request, obj, form, change):
         if obj.status == 'quoted' and not obj.quoted_at:
@@ -303,12 +342,23 @@ class InquiryAdmin(admin.ModelAdmin):
     
     def save_formset(self, request, form, formset, change):
         instances = formset.save(commit=False)
+        # commit=False 时被勾选删除的行不会自动删除；逐条 delete() 以刷新汇总字段
+        for obj in formset.deleted_objects:
+            obj.delete()
         for instance in instances:
             if isinstance(instance, InquiryAttachment) and not instance.uploaded_by:
                 instance.uploaded_by = request.user
             instance.save()
         formset.save_m2m()
 
+    @admin.action(description='导出所选询单（CSV，含明细）')
+    def export_csv(self, request, queryset):
+        return export_response('inquiry', queryset, 'csv')
+
+    @admin.action(description='导出所选询单（Excel，含明细）')
+    def export_xlsx(self, request, queryset):
+        return export_response('inquiry', queryset, 'xlsx')
+
 
 # ==================== 订单明细内联 ====================
 class OrderItemInline(admin.TabularInline):
@@ -342,10 +392,12 @@ class OrderAttachmentInline(admin.TabularInline):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'get_company', 'contact', 'status', 'payment_status', 
-                    'attachment_count', 'delivery_date', 'created_at', 'total_amount']
+                    'attachment_count', 'message_count', 'delivery_date', 'last_activity_at', 'created_at', 'total_amount']
+    list_select_related = ['contact__company']
     search_fields = ['order_number', 'contact__company__company_name', 'contact__name']
-    list_filter = ['status', 'payment_status', 'created_at']
+    list_filter = ['status', 'payment_status', AmountRangeFilter, 'created_at']
     inlines = [OrderItemInline, OrderAttachmentInline]
+    actions = ['export_csv', 'export_xlsx']
     
     fieldsets = (
         ('订单基本信息', {
@@ -367,11 +419,20 @@ class OrderAdmin(admin.ModelAdmin):
     get_company.short_description = '公司'
     
     def attachment_count(self, obj):
-        count = obj.attachments.count()
+        count = obj.attachment_count
         if count > 0:
             return format_html('<span style="color: green;">{} 个附件</span>', count)
         return '-'
     attachment_count.short_description = '附件'
+    attachment_count.admin_order_field = 'attachment_count'
+    
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        # 私有 bucket 下一次签发内联附件的全部 URL
+        if getattr(default_storage, 'signs_urls', False):
+            obj = self.get_object(request, object_id)
+            if obj is not None:
+                prefetch_thread_file_urls(obj)
+        return super().change_view(request, object_id, form_url, extra_context)
     
     def save_model(self, request, obj, form, change):
         if obj.status == 'confirmed' and not obj.confirmed_at:
@@ -381,12 +442,43 @@ class OrderAdmin(admin.ModelAdmin):
     
     def save_formset(self, request, form, formset, change):
         instances = formset.save(commit=False)
+        # commit=False 时被勾选删除的行不会自动删除；逐条 delete() 以刷新汇总字段
+        for obj in formset.deleted_objects:
+            obj.delete()
         for instance in instances:
             if isinstance(instance, OrderAttachment) and not instance.uploaded_by:
                 instance.uploaded_by = request.user
             instance.save()
         formset.save_m2m()
 
+    @admin.action(description='导出所选订单（CSV，含明细）')
+    def export_csv(self, request, queryset):
+        return export_response('order', queryset, 'csv')
+
+    @admin.action(description='导出所选订单（Excel，含明细）')
+    def export_xlsx(self, request, queryset):
+        return export_response('order', queryset, 'xlsx')
+
+
+# ==================== 邮件通知 ====================
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ['email', 'event', 'text', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'event', 'created_at']
+    search_fields = ['email', 'text']
+    readonly_fields = [f.name for f in Notification._meta.fields]
+    actions = ['retry']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='重新发送所选的失败通知')
+    def retry(self, request, queryset):
+        count = queryset.filter(status='failed').update(
+            status='pending', attempts=0, available_at=timezone.now(), claim_token='', claimed_until=None)
+        self.message_user(request, _('已重新加入发送队列：%(count)s 条') % {'count': count}, messages.SUCCESS)
+
+
 # ==================== User Admin Customization ====================
 # ==================== User Admin Customization ====================
 class UserAdmin(DjangoUserAdmin):
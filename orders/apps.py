@@ -6,6 +6,7 @@ class OrdersConfig(AppConfig):
     name = 'orders'
 
     def ready(self):
+        from . import signals  # noqa: F401  注册信号处理
         # Configure Admin Site Header here to ensure it runs
         from django.contrib import admin
         import os
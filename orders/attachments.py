@@ -0,0 +1,131 @@
+"""
+附件批量上传
+
+一个请求中的所有文件（询单附件、订单附件、消息附件、明细图纸）先并发推送到存储，
+全部成功后再在事务中写入数据库记录；任何一步失败都会删除本批次已上传的文件。
+
+用法::
+
+    batch = AttachmentUploadBatch()
+    refs = [batch.add(InquiryAttachment, 'file', f) for f in request.FILES.getlist('attachments')]
+    with batch, transaction.atomic():
+        ...
+        InquiryAttachment.objects.bulk_create([
+            InquiryAttachment(inquiry=inquiry, **ref.field_values()) for ref in refs
+        ])
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import prefetch_related_objects
+
+from trade_project.storage_backends import digest_from_key
+
+logger = logging.getLogger(__name__)
+
+
+class UploadRef:
+    """单个待上传文件；上传完成后 name 为存储中的实际路径"""
+
+    def __init__(self, field, file):
+        self.field = field
+        self.file = file
+        self.original_name = getattr(file, 'name', '') or ''
+        self.size = getattr(file, 'size', 0) or 0
+        self.name = None
+
+    def upload(self):
+        storage = self.field.storage
+        target = self.field.generate_filename(None, self.original_name)
+        self.name = storage.save(target, self.file, max_length=self.field.max_length)
+        return self.name
+
+    def field_values(self):
+        """附件模型（*Attachment）通用字段：文件路径、原始文件名、大小"""
+        return {
+            self.field.name: self.name,
+            'file_name': self.original_name,
+            'file_size': self.size,
+        }
+
+
+class AttachmentUploadBatch:
+    """并发上传一批文件；作为上下文管理器使用，异常退出时清理已上传文件"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or getattr(settings, 'ATTACHMENT_UPLOAD_WORKERS', 4)
+        self.refs = []
+
+    def add(self, model, field_name, file):
+        ref = UploadRef(model._meta.get_field(field_name), file)
+        self.refs.append(ref)
+        return ref
+
+    def upload_all(self):
+        if not self.refs:
+            return
+        workers = max(1, min(self.max_workers, len(self.refs)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(ref.upload) for ref in self.refs]
+            errors = []
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            self.cleanup()
+            raise errors[0]
+
+    def cleanup(self):
+        """删除本批次已成功上传的文件（尽力而为）
+
+        内容寻址的文件可能同时被其他记录引用，不在这里删除，留给孤儿文件清理处理。
+        """
+        for ref in self.refs:
+            if ref.name and not digest_from_key(ref.name):
+                try:
+                    ref.field.storage.delete(ref.name)
+                except Exception:
+                    logger.warning("cleanup of uploaded file %s failed", ref.name, exc_info=True)
+                ref.name = None
+
+    def __enter__(self):
+        self.upload_all()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cleanup()
+        else:
+            from .thumbnails import schedule_thumbnails
+            schedule_thumbnails([ref.name for ref in self.refs])
+        return False
+
+
+def prefetch_file_urls(names, storage=None):
+    """私有 bucket 下一次性签发一页文件的 URL，模板中的 .url 随后直接命中缓存"""
+    storage = storage or default_storage
+    if getattr(storage, 'signs_urls', False):
+        storage.prefetch_urls([name for name in names if name])
+
+
+def prefetch_thread_file_urls(obj, messages=None):
+    """询单/订单详情页：预取明细图纸、附件与消息附件的 URL（公开 bucket 下不查询）
+
+    messages 为当前显示的消息（已预取附件）；不传时取全部消息。
+    """
+    if not getattr(default_storage, 'signs_urls', False):
+        return
+    from .thumbnails import thumbnail_name
+    # 已由 load_thread 预取时不会再查询（管理后台等其它入口在这里补齐预取）
+    prefetch_related_objects([obj], 'items', 'attachments')
+    if messages is None:
+        prefetch_related_objects([obj], 'messages__attachments')
+        messages = obj.messages.all()
+    names = [item.drawing_file.name for item in obj.items.all() if item.drawing_file]
+    names += [att.file.name for att in obj.attachments.all()]
+    names += [att.file.name for msg in messages for att in msg.attachments.all()]
+    prefetch_file_urls(names + [thumbnail_name(name) for name in names])
@@ -0,0 +1,277 @@
+"""
+BOM（物料清单）批量导入
+
+支持三种输入：CSV 文件（UTF-8 / GBK）、XLSX 文件（第一个工作表）、从表格软件复制粘贴的制表符分隔文本。
+第一行如能识别为表头，按列名映射字段（中英文别名见 COLUMN_ALIASES）；否则按默认列顺序
+产品名称、材料名称、材料牌号、数量、单位、技术规格 读取。
+
+parse_bom() 一次校验全部行，返回 (明细数据列表, 错误列表)；错误带原表格行号，
+有任何错误时不导入，由调用方在同一事务内一次 bulk_create。
+XLSX 用标准库 zipfile + iterparse 读取，不依赖第三方库；超过 BOM_MAX_ROWS 的行不读取，
+解压后的 XML 大小受 XLSX_MAX_XML_SIZE 限制（防止压缩炸弹）。
+"""
+import csv
+import io
+import re
+import zipfile
+import zlib
+from decimal import Decimal, InvalidOperation
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.conf import settings
+from django.utils.translation import gettext as _
+
+from .models import InquiryItem
+
+FIELDS = ['product_name', 'material_name', 'material_grade', 'quantity', 'unit', 'specifications']
+REQUIRED = ['product_name', 'material_name', 'quantity']
+
+COLUMN_ALIASES = {
+    'product_name': ['产品名称', '产品', '品名', '名称', 'product', 'product name', 'part', 'part name', 'item',
+                     'description'],
+    'material_name': ['材料名称', '材料', '材质', 'material', 'material name'],
+    'material_grade': ['材料牌号', '牌号', 'grade', 'material grade'],
+    'quantity': ['数量', 'qty', 'quantity', "q'ty"],
+    'unit': ['单位', 'unit', 'uom'],
+    'specifications': ['技术规格', '规格', '规格型号', 'specification', 'specifications', 'spec', 'specs'],
+}
+_HEADER_LOOKUP = {alias.lower(): field for field, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+UNIT_ALIASES = {
+    'PCS': ['pcs', 'pc', 'piece', 'pieces', 'ea', 'each', '个', '件', '只', '支'],
+    'SET': ['set', 'sets', '套'],
+    'KG': ['kg', 'kgs', '公斤', '千克'],
+    'M': ['m', 'meter', 'meters', 'metre', '米'],
+    'PAIR': ['pair', 'pairs', '对'],
+}
+_UNIT_LOOKUP = {alias: unit for unit, aliases in UNIT_ALIASES.items() for alias in aliases}
+
+_MAX_LENGTHS = {name: InquiryItem._meta.get_field(name).max_length for name in FIELDS}
+_QUANTITY_FIELD = InquiryItem._meta.get_field('quantity')
+_QUANTITY_STEP = Decimal(1).scaleb(-_QUANTITY_FIELD.decimal_places)
+_QUANTITY_MAX = Decimal(10) ** (_QUANTITY_FIELD.max_digits - _QUANTITY_FIELD.decimal_places)
+
+
+class BomFormatError(ValueError):
+    pass
+
+
+# ==================== 读取 ====================
+def _decode(data):
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise BomFormatError(_('无法识别文件编码，请另存为 UTF-8 CSV'))
+
+
+def _take(rows, max_rows=None):
+    """最多读取 max_rows 个非空行（空行不计数），其余不再读取"""
+    taken, count = [], 0
+    for row in rows:
+        taken.append(row)
+        if max_rows and any(str(value).strip() for value in row):
+            count += 1
+            if count >= max_rows:
+                break
+    return taken
+
+
+def read_text(text, max_rows=None):
+    """CSV 或粘贴的制表符分隔文本 -> 行列表"""
+    sample = text[:4096]
+    delimiter = '\t' if '\t' in sample else ','
+    if delimiter == ',' and sample.count(';') > sample.count(','):
+        delimiter = ';'
+    return _take(csv.reader(io.StringIO(text), delimiter=delimiter), max_rows)
+
+
+def _column_index(ref):
+    index = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+def _xml_too_large(limit):
+    return BomFormatError(_('XLSX 内容过大（解压后超过 %(size)s MB），请拆分后导入') % {
+        'size': limit // (1024 * 1024)})
+
+
+class _LimitedReader:
+    """按解压后的字节数计数，超过 limit 时中止（zip 中声明的大小可以伪造，不能只看 file_size）"""
+
+    def __init__(self, fp, limit):
+        self.fp = fp
+        self.limit = limit
+        self.total = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fp.close()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.limit - self.total + 1
+        data = self.fp.read(size)
+        self.total += len(data)
+        if self.total > self.limit:
+            raise _xml_too_large(self.limit)
+        return data
+
+
+def _open_xml(archive, name):
+    limit = getattr(settings, 'XLSX_MAX_XML_SIZE', 50 * 1024 * 1024)
+    if archive.getinfo(name).file_size > limit:
+        raise _xml_too_large(limit)
+    return _LimitedReader(archive.open(name), limit)
+
+
+def _sheet_rows(fp, shared):
+    for _event, elem in iterparse(fp):
+        if not elem.tag.endswith('}row'):
+            continue
+        row = []
+        for cell in elem:
+            if not cell.tag.endswith('}c'):
+                continue
+            kind = cell.get('t')
+            if kind == 'inlineStr':
+                value = ''.join(t.text or '' for t in cell.iter() if t.tag.endswith('}t'))
+            else:
+                v = next((child.text for child in cell if child.tag.endswith('}v')), None)
+                if v is None:
+                    value = ''
+                elif kind == 's':
+                    value = shared[int(v)]
+                elif kind in ('str', 'e', 'b'):
+                    value = v
+                else:
+                    # 数字：整数显示为整数（1.0 -> 1）
+                    value = v[:-2] if v.endswith('.0') else v
+            ref = cell.get('r')
+            column = _column_index(ref) if ref else len(row)
+            row.extend([''] * (column - len(row)))
+            row.append(value)
+        elem.clear()
+        yield row
+
+
+def read_xlsx(data, max_rows=None):
+    """读取 XLSX 第一个工作表 -> 行列表（按单元格引用放到正确的列）
+
+    读到 max_rows 个非空行即停止；工作表与共享字符串 XML 解压后的大小受 XLSX_MAX_XML_SIZE 限制。
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise BomFormatError(_('不是有效的 XLSX 文件'))
+    names = set(archive.namelist())
+    sheets = sorted(n for n in names if re.fullmatch(r'xl/worksheets/sheet\d+\.xml', n))
+    if not sheets:
+        raise BomFormatError(_('XLSX 中没有工作表'))
+    sheet = 'xl/worksheets/sheet1.xml' if 'xl/worksheets/sheet1.xml' in names else sheets[0]
+
+    shared = []
+    try:
+        if 'xl/sharedStrings.xml' in names:
+            with _open_xml(archive, 'xl/sharedStrings.xml') as fp:
+                for _event, elem in iterparse(fp):
+                    if elem.tag.endswith('}si'):
+                        shared.append(''.join(t.text or '' for t in elem.iter() if t.tag.endswith('}t')))
+                        elem.clear()
+
+        with _open_xml(archive, sheet) as fp:
+            return _take(_sheet_rows(fp, shared), max_rows)
+    except (zipfile.BadZipFile, zlib.error, ParseError):
+        # 解压后的内容与 zip 头不符（CRC 错误）或 XML 损坏
+        raise BomFormatError(_('不是有效的 XLSX 文件'))
+
+
+def read_upload(uploaded, max_rows=None):
+    data = uploaded.read()
+    name = (uploaded.name or '').lower()
+    if name.endswith('.xlsx'):
+        return read_xlsx(data, max_rows)
+    if name.endswith(('.csv', '.tsv', '.txt')):
+        return read_text(_decode(data), max_rows)
+    raise BomFormatError(_('仅支持 CSV、XLSX 或 TXT 文件'))
+
+
+# ==================== 校验 ====================
+def _map_header(row):
+    """识别表头：返回 {字段: 列号}；不是表头时返回 None"""
+    mapping = {}
+    for index, cell in enumerate(row):
+        field = _HEADER_LOOKUP.get(str(cell).strip().lower())
+        if field and field not in mapping:
+            mapping[field] = index
+    return mapping if 'product_name' in mapping and 'quantity' in mapping else None
+
+
+def _quantity(value):
+    text = str(value).strip().replace(',', '').replace('，', '')
+    try:
+        quantity = Decimal(text)
+    except InvalidOperation:
+        return None
+    if not quantity.is_finite() or quantity <= 0 or quantity >= _QUANTITY_MAX:
+        return None
+    return quantity.quantize(_QUANTITY_STEP)
+
+
+def parse_rows(rows):
+    """校验全部行，返回 (明细数据列表, ["第 N 行：..."])"""
+    max_rows = getattr(settings, 'BOM_MAX_ROWS', 5000)
+    mapping = _map_header(rows[0]) if rows else None
+    start = 1 if mapping else 0
+    mapping = mapping or {field: index for index, field in enumerate(FIELDS)}
+
+    items, errors = [], []
+    for line, row in enumerate(rows[start:], start=start + 1):
+        values = {field: (str(row[index]).strip() if index < len(row) else '') for field, index in mapping.items()}
+        if not any(values.values()):
+            continue
+        if len(items) + len(errors) >= max_rows:
+            errors.append(_('超过最大行数 %(max)s，请拆分后导入') % {'max': max_rows})
+            break
+        problems = [_('缺少%(field)s') % {'field': InquiryItem._meta.get_field(f).verbose_name}
+                    for f in REQUIRED if not values.get(f)]
+        quantity = _quantity(values['quantity']) if values.get('quantity') else None
+        if values.get('quantity') and quantity is None:
+            problems.append(_('数量“%(value)s”无效') % {'value': values['quantity']})
+        for field, limit in _MAX_LENGTHS.items():
+            if limit and len(values.get(field, '')) > limit:
+                problems.append(_('%(field)s超过 %(limit)s 个字符') % {
+                    'field': InquiryItem._meta.get_field(field).verbose_name, 'limit': limit})
+        if problems:
+            errors.append(_('第 %(line)s 行：%(problems)s') % {'line': line, 'problems': '；'.join(problems)})
+            continue
+        unit = values.get('unit', '')
+        items.append({
+            'product_name': values['product_name'],
+            'material_name': values['material_name'],
+            'material_grade': values.get('material_grade', ''),
+            'quantity': quantity,
+            'unit': _UNIT_LOOKUP.get(unit.lower(), unit) or 'PCS',
+            'specifications': values.get('specifications', ''),
+        })
+    if not items and not errors:
+        errors.append(_('没有可导入的明细行'))
+    return items, errors
+
+
+def parse_bom(uploaded=None, text=''):
+    """从上传文件或粘贴文本解析 BOM"""
+    # 表头 + BOM_MAX_ROWS 行，再多读一行让 parse_rows 报告超出行数；其余行不读取
+    max_rows = getattr(settings, 'BOM_MAX_ROWS', 5000) + 2
+    try:
+        rows = read_upload(uploaded, max_rows) if uploaded else read_text(text, max_rows)
+    except BomFormatError as e:
+        return [], [str(e)]
+    return parse_rows(rows)
@@ -0,0 +1,82 @@
+"""
+详情页与 JSON 接口的条件请求（ETag / Last-Modified）
+
+状态由一条查询得到：询单/订单的 updated_at（明细、附件变更时同步更新，见 refresh_summaries）、
+最新消息时间与消息数（会话上的冗余字段，见 activity.py）及最新消息附件时间。ETag 另外包含用户、session 中的联系人信息版本
+（角色等）、当前语言与 CSRF cookie；状态不变时直接返回 304，不查询明细、消息，也不渲染模板。
+角色与联系人校验（@contact_required）在条件判断之前，无权访问的用户不会得到 304。
+
+有待显示的提示消息（messages 框架）时不做条件判断，以免 304 吞掉提示。
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import Max
+from django.utils.cache import patch_cache_control
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+
+from .middleware import get_contact_info
+
+
+def thread_state(model, pk, **scope):
+    """(updated_at, 最新消息时间, 消息数, 最新消息附件时间)；不存在或无权访问时为 None"""
+    return (model.objects.filter(pk=pk, **scope)
+            .annotate(last_attachment=Max('messages__attachments__uploaded_at'))
+            .values_list('updated_at', 'last_message_at', 'message_count', 'last_attachment')
+            .first())
+
+
+def conditional_detail(model, pk_kwarg, scope=None):
+    """详情视图的条件请求装饰器
+
+    scope(request, info) 返回额外的过滤条件（如买家只能访问自己的询单），None 表示不限。
+    放在 @login_required 与 @contact_required 之下（先校验登录、角色与联系人）。
+    """
+    def decorator(view_func):
+        def get_state(request, kwargs):
+            if not hasattr(request, '_conditional_state'):
+                info = get_contact_info(request)
+                state = None
+                if request.method in ('GET', 'HEAD') and info and not len(get_messages(request)):
+                    filters = scope(request, info) if scope else {}
+                    state = thread_state(model, kwargs[pk_kwarg], **filters)
+                request._conditional_state = (info, state)
+            return request._conditional_state
+
+        def etag(request, *args, **kwargs):
+            info, state = get_state(request, kwargs)
+            if state is None:
+                return None
+            parts = [model._meta.model_name, request.path, request.user.pk, info.get('version'),
+                     get_language(), request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+                     *(value.isoformat() if hasattr(value, 'isoformat') else value for value in state)]
+            return hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()[:32]
+
+        def last_modified(request, *args, **kwargs):
+            _, state = get_state(request, kwargs)
+            if state is None:
+                return None
+            return max(value for value in (state[0], state[1], state[3]) if value is not None)
+
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                # 只允许浏览器缓存，且每次使用前都要重新验证
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def own_contact(request, info):
+    return {'contact_id': info['id']}
+
+
+def own_user(request, info):
+    return {'contact__user': request.user}
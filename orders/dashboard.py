@@ -0,0 +1,69 @@
+"""
+仪表板统计
+
+询单/订单按状态的计数用一条查询得到（两张表各自 GROUP BY status，再 UNION ALL），
+结果按范围缓存：供应商看全局，买家看本公司。询单/订单新建、删除、状态或所属联系人变化时，
+由 signals.py 在事务提交后删除受影响范围的缓存；DASHBOARD_CACHE_TTL 只是兜底。
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Value
+
+from .models import Contact, Inquiry, Order
+
+GLOBAL_SCOPE = 'all'
+
+
+def cache_key(scope):
+    return f'dashboard:stats:{scope}'
+
+
+def company_scope(company_id):
+    return f'company:{company_id}'
+
+
+def _status_counts(model, kind, filters):
+    return (model.objects.filter(**filters).order_by()
+            .annotate(kind=Value(kind)).values('kind', 'status').annotate(n=Count('id')))
+
+
+def compute_stats(company_id=None):
+    """一条查询统计询单/订单各状态数量"""
+    filters = {'contact__company_id': company_id} if company_id is not None else {}
+    rows = _status_counts(Inquiry, 'inquiry', filters).union(
+        _status_counts(Order, 'order', filters), all=True)
+    stats = {
+        'inquiry': {status: 0 for status, _ in Inquiry.STATUS_CHOICES},
+        'order': {status: 0 for status, _ in Order.STATUS_CHOICES},
+    }
+    for row in rows:
+        stats[row['kind']][row['status']] = row['n']
+    return {
+        'inquiry_count': sum(stats['inquiry'].values()),
+        'order_count': sum(stats['order'].values()),
+        'pending_inquiries': stats['inquiry']['pending'],
+        'pending_orders': stats['order']['pending'],
+        'inquiry_status': stats['inquiry'],
+        'order_status': stats['order'],
+    }
+
+
+def dashboard_stats(company_id=None):
+    """读取（必要时计算并缓存）统计；company_id 为 None 时为全局统计"""
+    scope = GLOBAL_SCOPE if company_id is None else company_scope(company_id)
+    stats = cache.get(cache_key(scope))
+    if stats is None:
+        stats = compute_stats(company_id)
+        cache.set(cache_key(scope), stats, getattr(settings, 'DASHBOARD_CACHE_TTL', 300))
+    return stats
+
+
+def invalidate_stats(company_ids):
+    """事务提交后删除全局及指定公司的统计缓存"""
+    keys = [cache_key(GLOBAL_SCOPE)] + [cache_key(company_scope(pk)) for pk in set(company_ids) if pk]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def contact_company_ids(contact_ids):
+    return set(Contact.objects.filter(pk__in=set(contact_ids)).values_list('company_id', flat=True))
@@ -0,0 +1,33 @@
+from functools import wraps
+
+from django.contrib import messages
+from django.shortcuts import redirect
+from django.utils.translation import gettext as _
+
+from .middleware import get_contact, get_contact_info
+
+
+def contact_required(role=None):
+    """要求当前用户有联系人（可限定角色），否则提示并返回首页
+
+    角色校验只读 session 中的联系人信息；通过后 request.contact 为已加载的 Contact。
+    与 @login_required 一起使用，放在其下方。
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            info = get_contact_info(request)
+            if not info or (role and info['role'] != role):
+                if role == 'supplier':
+                    messages.error(request, _('您不是供应商账号。'))
+                else:
+                    messages.error(request, _('未找到联系人信息。'))
+                return redirect('home')
+            request.contact = get_contact(request)
+            if request.contact is None:
+                # session 信息过期（联系人已删除）
+                messages.error(request, _('未找到联系人信息。'))
+                return redirect('home')
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
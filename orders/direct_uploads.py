@@ -0,0 +1,256 @@
+"""
+浏览器直传
+
+上传文件不经过 Django：浏览器先申请上传会话，拿到每个文件的上传 URL 后直接 PUT 到存储，
+最后调用 finalize 接口，由服务端校验大小、扩展名与 SHA-256 后写入附件记录。
+
+1. POST /api/uploads/<inquiry|order>/<id>/sessions/
+   {"purpose": "attachment" | "message", "files": [{"name", "size", "sha256", "content_type"}]}
+   返回每个文件的 token 与 upload（method / url / headers）。
+2. 浏览器按 upload 逐个 PUT 文件内容。
+3. POST /api/uploads/finalize/  {"tokens": [...], "content": "消息内容（purpose=message 时）"}
+
+token 使用 Django signing 签名，记录用户、目标对象、存储 key 与声明的大小/摘要，
+有效期 DIRECT_UPLOAD_TTL 秒；finalize 成功后 token 摘要写入 UsedUploadToken，不能重复确认。
+内容寻址存储下文件一律先传到本次会话独有的暂存 key（uploads/），校验摘要后再移入 cas/，
+不会仅凭声明的摘要引用已有对象（否则知道摘要即可挂载他人的文件）；未确认的暂存对象可按 TTL 清理。
+存储不支持签发上传 URL 时（本地 FileSystemStorage），upload 指向本站的 PUT 接口，便于离线调试。
+"""
+import hashlib
+import os
+import re
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.files.base import File
+from django.db import IntegrityError, transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from trade_project.storage_backends import content_key, digest_from_key, file_digest
+
+from . import realtime
+from .models import (
+    ALLOWED_FILE_EXTENSIONS, MAX_FILE_SIZE, Inquiry, InquiryAttachment, Order, OrderAttachment,
+    Message, MessageAttachment, UsedUploadToken,
+)
+from .thumbnails import schedule_thumbnails
+
+TOKEN_SALT = 'orders.direct_uploads'
+MAX_FILES_PER_SESSION = 20
+STAGING_PREFIX = 'uploads'
+
+# 目标对象类型 -> (模型, purpose=attachment 时的附件模型, 附件外键名)
+TARGETS = {
+    'inquiry': (Inquiry, InquiryAttachment, 'inquiry'),
+    'order': (Order, OrderAttachment, 'order'),
+}
+
+
+def get_target(contact, target, object_id):
+    """按权限取目标询单/订单：买家只能访问自己的，供应商可访问全部"""
+    if target not in TARGETS or contact is None:
+        raise PermissionDenied
+    model = TARGETS[target][0]
+    qs = model.objects.all()
+    if contact.role != 'supplier':
+        qs = qs.filter(contact=contact)
+    obj = qs.filter(id=object_id).first()
+    if obj is None:
+        raise PermissionDenied
+    return obj
+
+
+def attachment_model(purpose, target):
+    if purpose == 'message':
+        return MessageAttachment
+    if purpose == 'attachment':
+        return TARGETS[target][1]
+    raise ValidationError(_('未知的上传用途'))
+
+
+def validate_declared(entry):
+    """校验浏览器声明的文件信息，返回 (name, size, sha256, content_type)"""
+    name = os.path.basename(str(entry.get('name') or ''))
+    try:
+        size = int(entry.get('size'))
+    except (TypeError, ValueError):
+        raise ValidationError(_('文件大小无效'))
+    sha256 = str(entry.get('sha256') or '').lower()
+    if not name:
+        raise ValidationError(_('缺少文件名'))
+    if os.path.splitext(name)[1].lower() not in ALLOWED_FILE_EXTENSIONS:
+        raise ValidationError(
+            _('不支持的文件格式。允许的格式：%(exts)s') % {'exts': ", ".join(ALLOWED_FILE_EXTENSIONS)})
+    if size <= 0 or size > MAX_FILE_SIZE:
+        raise ValidationError(_('文件大小不能超过 20MB'))
+    if not re.fullmatch(r'[0-9a-f]{64}', sha256):
+        raise ValidationError(_('文件摘要无效'))
+    content_type = str(entry.get('content_type') or '') or 'application/octet-stream'
+    return name, size, sha256, content_type
+
+
+def _storage_key(storage, field, name):
+    if getattr(storage, '_content_addressed', False):
+        # 正式 key 由 finalize 校验内容后确定，这里只给会话独有的暂存 key
+        return f'{STAGING_PREFIX}/{secrets.token_hex(16)}{os.path.splitext(name)[1].lower()}'
+    key = field.generate_filename(None, name)
+    if hasattr(storage, '_sanitize_key'):
+        key = storage._sanitize_key(key)
+    return storage.get_available_name(key, max_length=field.max_length)
+
+
+def create_session(request, target, obj, purpose, files):
+    """为每个文件签发 token 与上传地址"""
+    model = attachment_model(purpose, target)
+    field = model._meta.get_field('file')
+    storage = field.storage
+    if not files or len(files) > MAX_FILES_PER_SESSION:
+        raise ValidationError(_('每次最多上传 %(n)s 个文件') % {'n': MAX_FILES_PER_SESSION})
+    declared = [validate_declared(entry) for entry in files]
+
+    result = []
+    for name, size, sha256, content_type in declared:
+        key = _storage_key(storage, field, name)
+        headers = {'Content-Type': content_type}
+        if hasattr(storage, 'create_upload_url'):
+            key, url = storage.create_upload_url(key)
+            headers['x-upsert'] = 'false'
+        else:
+            url = None
+        payload = {
+            'u': request.user.id, 't': target, 'id': obj.id, 'p': purpose,
+            'k': key, 'n': name, 's': size, 'h': sha256, 'c': content_type,
+        }
+        token = signing.dumps(payload, salt=TOKEN_SALT, compress=True)
+        if url is None:
+            url = request.build_absolute_uri(reverse('upload_local_put', args=[token]))
+        upload = {'method': 'PUT', 'url': url, 'headers': headers}
+        result.append({'name': name, 'key': key, 'token': token, 'upload': upload})
+    return result
+
+
+def load_token(token, user=None):
+    """解析并校验 token；过期或被篡改时抛 ValidationError"""
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=getattr(settings, 'DIRECT_UPLOAD_TTL', 3600))
+    except signing.SignatureExpired:
+        raise ValidationError(_('上传会话已过期，请重新上传'))
+    except signing.BadSignature:
+        raise ValidationError(_('上传会话无效'))
+    if user is not None and payload['u'] != user.id:
+        raise PermissionDenied
+    return payload
+
+
+def save_local_upload(payload, stream):
+    """本地存储的直传接口：按 token 中的 key 写入，大小不超过声明值"""
+    storage = attachment_model(payload['p'], payload['t'])._meta.get_field('file').storage
+    try:
+        name = storage.save(payload['k'], File(_LimitedReader(stream, payload['s']), name=payload['n']))
+    except ValidationError:
+        if not digest_from_key(payload['k']) and storage.exists(payload['k']):
+            storage.delete(payload['k'])
+        raise
+    if name != payload['k']:
+        # 内容寻址 key 可能被其他记录引用，不能删除
+        if not digest_from_key(name):
+            storage.delete(name)
+        raise ValidationError(_('目标文件已存在，请重新上传'))
+    return name
+
+
+class _LimitedReader:
+    """最多读取 limit 字节，超出即报错，避免客户端写入超过声明大小的内容"""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size=-1):
+        chunk = self.stream.read(64 * 1024 if size is None or size < 0 else size)
+        self.remaining -= len(chunk)
+        if self.remaining < 0:
+            raise ValidationError(_('文件大小与声明不一致'))
+        return chunk
+
+
+def verify_upload(storage, payload):
+    """校验已上传对象的大小与 SHA-256；不一致时删除对象并抛 ValidationError"""
+    key = payload['k']
+    try:
+        size = storage.size(key)
+    except (FileNotFoundError, OSError):
+        raise ValidationError(_('文件 %(name)s 尚未上传') % {'name': payload['n']})
+    digest = None
+    if size <= MAX_FILE_SIZE:
+        with storage.open(key, 'rb') as f:
+            digest = file_digest(f)
+    if size == payload['s'] and digest == payload['h']:
+        return
+    # 内容与 key 不符的对象必须删除，否则会被后续同摘要文件“去重”引用；
+    # 内容寻址 key 下内容正确的对象可能被其他记录引用，保留
+    if digest_from_key(key) != digest:
+        storage.delete(key)
+    raise ValidationError(_('文件 %(name)s 校验失败，请重新上传') % {'name': payload['n']})
+
+
+def _promote(storage, payload):
+    """内容寻址存储：把校验通过的暂存对象移入 cas/；同内容对象已存在时删除暂存对象。返回正式 key"""
+    if not getattr(storage, '_content_addressed', False):
+        return payload['k']
+    key = content_key(payload['h'], payload['n'])
+    if not storage.move(payload['k'], key):
+        storage.delete(payload['k'])
+    return key
+
+
+def _consume(digests):
+    """登记本次确认的 token；已登记过（重放或并发重复提交）时抛 ValidationError"""
+    ttl = getattr(settings, 'DIRECT_UPLOAD_TTL', 3600)
+    # 超过有效期的 token 已无法通过签名校验，记录可以清理
+    UsedUploadToken.objects.filter(used_at__lt=timezone.now() - timedelta(seconds=ttl)).delete()
+    try:
+        with transaction.atomic():
+            UsedUploadToken.objects.bulk_create([UsedUploadToken(digest=d) for d in digests])
+    except IntegrityError:
+        raise ValidationError(_('上传会话已确认，请勿重复提交'))
+
+
+def finalize(request, contact, tokens, content=''):
+    """校验所有已上传文件并在一个事务中写入附件（及消息）记录；返回创建的附件列表"""
+    payloads = [load_token(token, request.user) for token in tokens or []]
+    if not payloads:
+        raise ValidationError(_('没有需要确认的文件'))
+    digests = [hashlib.sha256(str(token).encode('utf-8')).hexdigest() for token in tokens]
+    if len(set(digests)) != len(digests) or UsedUploadToken.objects.filter(digest__in=digests).exists():
+        raise ValidationError(_('上传会话已确认，请勿重复提交'))
+    targets = {(p['t'], p['id'], p['p']) for p in payloads}
+    if len(targets) != 1:
+        raise ValidationError(_('一次只能确认同一对象的上传'))
+    target, object_id, purpose = targets.pop()
+    obj = get_target(contact, target, object_id)
+    model = attachment_model(purpose, target)
+    storage = model._meta.get_field('file').storage
+    for payload in payloads:
+        verify_upload(storage, payload)
+
+    with transaction.atomic():
+        _consume(digests)
+        keys = [_promote(storage, p) for p in payloads]
+        if purpose == 'message':
+            parent = {'message': Message.objects.create(
+                **{TARGETS[target][2]: obj}, sender=request.user, content=content)}
+        else:
+            parent = {TARGETS[target][2]: obj, 'uploaded_by': request.user}
+        created = model.objects.bulk_create([
+            model(file=key, file_name=p['n'], file_size=p['s'], **parent) for key, p in zip(keys, payloads)
+        ])
+        schedule_thumbnails(keys)
+        if purpose == 'attachment':
+            realtime.attachments_created(target, created)
+    return created
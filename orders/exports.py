@@ -0,0 +1,309 @@
+"""
+询单/订单导出（CSV / XLSX，流式）
+
+每行一条明细，询单/订单字段在每行重复；没有明细的询单/订单输出一行，明细列为空。
+数据用 values_list(...).iterator(chunk_size=EXPORT_CHUNK_SIZE) 分块读取（PostgreSQL 上为服务端游标），
+边读边写入 StreamingHttpResponse：内存占用与导出行数无关，表头在查询执行前就已发出。
+
+XLSX 不依赖第三方库：用 zipfile 按块写出压缩的工作表 XML（内联字符串，无共享字符串表），
+每写完一批行就把已压缩的字节交给响应。
+
+以 = + - @（及制表符、回车）开头的文本单元格前加 '，打开时按文本显示，不会被当作公式执行
+（CSV/公式注入）；价格表导入时用 unescape_formula() 去掉。
+"""
+import csv
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Inquiry, Order
+from .search import matching
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# (列标题, values_list 字段)
+INQUIRY_COLUMNS = [
+    ('询单号', 'inquiry_number'),
+    ('状态', 'status'),
+    ('公司', 'contact__company__company_name'),
+    ('联系人', 'contact__name'),
+    ('创建时间', 'created_at'),
+    ('客户交货期要求', 'delivery_requirement'),
+    ('报工期', 'quoted_lead_time'),
+    ('报价时间', 'quoted_at'),
+    ('产品名称', 'items__product_name'),
+    ('材料名称', 'items__material_name'),
+    ('材料牌号', 'items__material_grade'),
+    ('数量', 'items__quantity'),
+    ('单位', 'items__unit'),
+    ('技术规格', 'items__specifications'),
+    ('报价单价(USD)', 'items__quoted_price'),
+]
+
+ORDER_COLUMNS = [
+    ('订单号', 'order_number'),
+    ('客户订单号', 'customer_order_number'),
+    ('订单状态', 'status'),
+    ('付款状态', 'payment_status'),
+    ('公司', 'contact__company__company_name'),
+    ('联系人', 'contact__name'),
+    ('创建时间', 'created_at'),
+    ('预计交货日期', 'delivery_date'),
+    ('实际发货日期', 'shipping_date'),
+    ('产品名称', 'items__product_name'),
+    ('材料名称', 'items__material_name'),
+    ('材料牌号', 'items__material_grade'),
+    ('数量', 'items__quantity'),
+    ('单位', 'items__unit'),
+    ('技术规格', 'items__specifications'),
+    ('单价(USD)', 'items__unit_price'),
+]
+
+EXPORTS = {
+    'inquiry': (Inquiry, INQUIRY_COLUMNS, {'status': Inquiry.STATUS_CHOICES}),
+    'order': (Order, ORDER_COLUMNS, {'status': Order.STATUS_CHOICES, 'payment_status': Order.PAYMENT_STATUS_CHOICES}),
+}
+
+
+# 电子表格会当作公式解析的前缀
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_formula(value):
+    """用户输入的文本以公式前缀开头时加 '"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def unescape_formula(value):
+    """去掉 escape_formula() 加上的 '（读取导出后再上传的表格）"""
+    if isinstance(value, str) and value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES):
+        return value[1:]
+    return value
+
+
+def _chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_rows(kind, queryset):
+    """逐行产出 (单元格值...)；状态转为显示名，时间转为本地时间"""
+    _, columns, choices = EXPORTS[kind]
+    fields = [field for _, field in columns]
+    # 选项显示名在此一次性求值，避免逐行翻译
+    displays = {fields.index(name): {k: str(v) for k, v in opts} for name, opts in choices.items()}
+    tz = timezone.get_current_timezone()
+    rows = (queryset.order_by('-created_at', '-id', 'items__id')
+            .values_list(*fields)
+            .iterator(chunk_size=_chunk_size()))
+    for row in rows:
+        row = list(row)
+        for index, labels in displays.items():
+            row[index] = labels.get(row[index], row[index])
+        for index, value in enumerate(row):
+            if isinstance(value, datetime) and value.tzinfo is not None:
+                row[index] = value.astimezone(tz).replace(tzinfo=None)
+        yield row
+
+
+def headers(kind):
+    return [title for title, _ in EXPORTS[kind][1]]
+
+
+# ==================== CSV ====================
+class _Echo:
+    """csv.writer 的写入目标：直接返回写入的字符串"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    return escape_formula(value)
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(_Echo())
+    # BOM：Excel 打开 UTF-8 CSV 时正确识别中文
+    yield '﻿' + writer.writerow(header)
+    batch = []
+    for row in rows:
+        batch.append(writer.writerow([_csv_value(v) for v in row]))
+        if len(batch) >= 500:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+# ==================== XLSX ====================
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # 样式 0：默认；1：日期时间；2：日期
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_TAIL = '</sheetData></worksheet>'
+
+# XML 1.0 不允许的控制字符
+_ILLEGAL_XML = dict.fromkeys(c for c in range(32) if c not in (9, 10, 13))
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def _workbook_xml(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+
+
+def _cell(value):
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        delta = value - _EXCEL_EPOCH
+        return f'<c s="1"><v>{delta.days + delta.seconds / 86400:.6f}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="2"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+    text = escape(escape_formula(str(value)).translate(_ILLEGAL_XML))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(values):
+    return '<row>' + ''.join(_cell(v) for v in values) + '</row>'
+
+
+class _Sink:
+    """zipfile 的写入目标（不可 seek）：收集压缩后的字节，由生成器取走"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_xlsx(header, rows, sheet_name='Sheet1'):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        archive.writestr('xl/workbook.xml', _workbook_xml(sheet_name))
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((SHEET_HEAD + _row(header)).encode())
+            yield sink.drain()
+            batch = []
+            for row in rows:
+                batch.append(_row(row))
+                if len(batch) >= 500:
+                    sheet.write(''.join(batch).encode())
+                    batch = []
+                    data = sink.drain()
+                    if data:
+                        yield data
+            sheet.write((''.join(batch) + SHEET_TAIL).encode())
+    yield sink.drain()
+
+
+# ==================== 响应 ====================
+def apply_list_filters(kind, queryset, request):
+    """与列表页相同的筛选：status 与全文检索 q"""
+    status = request.GET.get('status')
+    if status:
+        queryset = queryset.filter(status=status)
+    q = (request.GET.get('q') or '').strip()
+    if q:
+        # 导出全部匹配结果：不按相关度截断
+        queryset = queryset.filter(pk__in=matching(kind, q))
+    return queryset
+
+
+def export_response(kind, queryset, fmt='csv'):
+    if fmt not in CONTENT_TYPES:
+        fmt = 'csv'
+    header = headers(kind)
+    rows = export_rows(kind, queryset)
+    name = 'inquiries' if kind == 'inquiry' else 'orders'
+    if fmt == 'xlsx':
+        content = stream_xlsx(header, rows, sheet_name=name)
+    else:
+        content = stream_csv(header, rows)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    filename = f"{name}-{timezone.localtime():%Y%m%d-%H%M}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
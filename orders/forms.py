@@ -3,7 +3,8 @@ from django.contrib.auth.models import User
 from django.forms import inlineformset_factory
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from .models import Company, Contact, Inquiry, InquiryItem, Order, OrderItem, Message
+from .bom import parse_bom
+from .models import MAX_FILE_SIZE, Company, Contact, Inquiry, InquiryItem, Order, OrderItem, Message
 
 
 # ==================== Buyer 注册表单 ====================
@@ -164,6 +165,58 @@ InquiryItemFormSet = inlineformset_factory(
 )
 
 
+class BomImportForm(forms.Form):
+    """BOM 批量导入：上传 CSV/XLSX 或粘贴表格内容（二选一，均可留空）"""
+    bom_file = forms.FileField(
+        label=_('BOM 文件（CSV / XLSX）'),
+        required=False,
+        widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx,.txt'})
+    )
+    bom_text = forms.CharField(
+        label=_('或粘贴表格内容'),
+        required=False,
+        strip=False,
+        widget=forms.Textarea(attrs={
+            'class': 'form-control font-monospace',
+            'rows': 4,
+            'placeholder': _('从 Excel 复制：产品名称  材料名称  材料牌号  数量  单位  技术规格')
+        })
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        bom_file = cleaned_data.get('bom_file')
+        bom_text = cleaned_data.get('bom_text') or ''
+        items = []
+        if bom_file:
+            if bom_file.size > MAX_FILE_SIZE:
+                raise ValidationError(_('BOM 文件不能超过 20MB'))
+            items, errors = parse_bom(uploaded=bom_file)
+        elif bom_text.strip():
+            items, errors = parse_bom(text=bom_text)
+        else:
+            errors = []
+        if errors:
+            # 逐行列出全部错误，整份 BOM 不导入
+            raise ValidationError(errors)
+        cleaned_data['items'] = items
+        return cleaned_data
+
+
+class PriceSheetForm(forms.Form):
+    """批量报价：上传填好单价的价格表（CSV / XLSX）"""
+    sheet = forms.FileField(
+        label=_('价格表（CSV / XLSX）'),
+        widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.csv,.xlsx,.txt'})
+    )
+
+    def clean_sheet(self):
+        sheet = self.cleaned_data['sheet']
+        if sheet.size > MAX_FILE_SIZE:
+            raise ValidationError(_('价格表不能超过 20MB'))
+        return sheet
+
+
 # ==================== 订单表单 ====================
 class OrderForm(forms.ModelForm):
     class Meta:
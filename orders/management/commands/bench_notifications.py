@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from orders import notifications
+from orders.models import Notification
+from orders.smtp_sink import SmtpSink
+
+
+class Command(BaseCommand):
+    help = ("Load test: deliver queued notifications to a local SMTP sink, "
+            "one email per event on a new connection vs. digests over pooled connections")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=50, help='收件人数')
+        parser.add_argument('--events', type=int, default=5, help='每个收件人的通知数')
+        parser.add_argument('--connections', nargs='*', type=int, default=[1, 4], help='依次测试的 SMTP 连接数')
+        parser.add_argument('--latency', type=float, default=0.005, help='SMTP 接收端处理每封邮件的模拟耗时（秒）')
+
+    def enqueue(self, users, events):
+        Notification.objects.bulk_create([
+            Notification(recipient=user, email=user.email, event='message', text=f'bench event {i}', link='/')
+            for user in users for i in range(events)
+        ])
+
+    def per_event(self, users):
+        """对照：每条通知单独发一封邮件，每封新建一条 SMTP 连接（相当于在视图中直接发送）"""
+        pending = list(Notification.objects.filter(recipient__in=users, status='pending'))
+        began = time.perf_counter()
+        for notification in pending:
+            get_connection(fail_silently=False).send_messages([
+                EmailMessage(subject=notification.text, body=notification.text, to=[notification.email])])
+        Notification.objects.filter(pk__in=[n.pk for n in pending]).update(status='sent')
+        return len(pending), time.perf_counter() - began
+
+    def handle(self, *args, **options):
+        recipients, events = max(1, options['recipients']), max(1, options['events'])
+        stamp = time.time_ns()
+        User.objects.bulk_create([User(username=f'bench-notify-{stamp}-{i}', email=f'bench{i}@example.com')
+                                  for i in range(recipients)])
+        users = list(User.objects.filter(username__startswith=f'bench-notify-{stamp}-'))
+        sink = SmtpSink(delay=max(options['latency'], 0)).start()
+        smtp = override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                                 EMAIL_HOST=sink.host, EMAIL_PORT=sink.port, EMAIL_HOST_USER='',
+                                 EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False)
+        try:
+            with smtp:
+                self.enqueue(users, events)
+                received, connections = len(sink.messages), sink.connections
+                sent, elapsed = self.per_event(users)
+                self.stdout.write(
+                    f"per event      : {sent} emails in {elapsed:.2f}s ({sent / max(elapsed, 1e-9):.0f}/s), "
+                    f"{sink.connections - connections} connections, {len(sink.messages) - received} received")
+
+                for size in options['connections']:
+                    self.enqueue(users, events)
+                    received, connections = len(sink.messages), sink.connections
+                    total = notifications.DeliveryStats()
+                    with notifications.SmtpPool(size) as pool:
+                        while True:
+                            stats = notifications.deliver_due(pool, window=0)
+                            if not stats.events:
+                                break
+                            total.add(stats)
+                    self.stdout.write(
+                        f"digest, pool {size:2}: {total}, {sink.connections - connections} connections, "
+                        f"{len(sink.messages) - received} received")
+        finally:
+            sink.stop()
+            Notification.objects.filter(recipient__in=users).delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
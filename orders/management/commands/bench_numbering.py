@@ -0,0 +1,74 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+
+from orders import numbering
+from orders.models import Company, Contact, Inquiry, NumberCounter
+
+BENCH_PREFIX = 'BENCH'
+
+
+class Command(BaseCommand):
+    help = "Load test: concurrent inquiry creation with sequence-allocated numbers (per-row vs block pre-allocation)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='并发线程数')
+        parser.add_argument('--count', type=int, default=50, help='每个线程创建的询单数')
+        parser.add_argument('--blocks', nargs='*', type=int, default=[1, 20],
+                            help='依次测试的 NUMBER_BLOCK_SIZE')
+
+    def run(self, contact, threads, count):
+        start = threading.Barrier(threads + 1)
+        numbers, errors = [], []
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(count):
+                    number = numbering.allocate(BENCH_PREFIX)
+                    Inquiry.objects.create(inquiry_number=number, contact=contact)
+                    numbers.append(number)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        start.wait()
+        began = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - began, numbers, errors
+
+    def handle(self, *args, **options):
+        threads, count = max(1, options['threads']), max(1, options['count'])
+        user = User.objects.create(username=f'bench-numbering-{time.time_ns()}')
+        company = Company.objects.create(company_name=f'Bench Numbering {user.pk}', country='CN')
+        contact = Contact.objects.create(company=company, user=user, name='Bench', email=f'{user.username}@example.com')
+        try:
+            for block in options['blocks']:
+                numbering.reset_blocks()
+                with override_settings(NUMBER_BLOCK_SIZE=block):
+                    elapsed, numbers, errors = self.run(contact, threads, count)
+                duplicates = len(numbers) - len(set(numbers))
+                self.stdout.write(
+                    f"block {block:4}: {len(numbers)} inquiries in {elapsed:.2f}s "
+                    f"({len(numbers) / max(elapsed, 1e-9):.0f}/s), duplicates {duplicates}, errors {len(errors)}")
+                for error in errors[:3]:
+                    self.stdout.write(self.style.ERROR(f"  {error!r}"))
+        finally:
+            # 清理：临时询单、联系人及 BENCH 前缀的计数器
+            numbering.reset_blocks()
+            Inquiry.objects.filter(contact=contact).delete()
+            NumberCounter.objects.filter(prefix=BENCH_PREFIX).delete()
+            contact.delete()
+            company.delete()
+            user.delete()
+        self.stdout.write(self.style.SUCCESS(f"database: {settings.DATABASES['default']['ENGINE']}"))
@@ -0,0 +1,98 @@
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.test import RequestFactory
+
+from orders.models import Company, Contact, Inquiry, InquiryItem
+from orders.pagination import KeysetPage, RankedPage
+from orders.search import search_ids
+
+PRODUCTS = ['不锈钢法兰', '钛合金螺栓', '铝合金壳体', 'Carbon steel flange', 'Brass fitting', 'Copper busbar']
+MATERIALS = ['304', '316L', 'TC4', '6061-T6', 'Q235', 'H62']
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark: inquiry list search with icontains JOIN + DISTINCT vs the search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=20000,
+                            help='生成的临时询单数（事务内生成，结束后回滚）；0 表示使用现有数据')
+        parser.add_argument('--items', type=int, default=5, help='每个临时询单的明细数')
+        parser.add_argument('--repeat', type=int, default=5, help='每个检索词的重复次数')
+        parser.add_argument('--queries', nargs='*', default=['法兰', 'flange', '钛合金螺栓 517', 'busbar 42', 'TC4', '不存在的产品'],
+                            help='检索词')
+
+    def seed(self, count, items):
+        user = User.objects.create(username=f'bench-search-{time.time_ns()}')
+        company = Company.objects.create(company_name=f'Bench Search {user.pk}', country='CN')
+        contact = Contact.objects.create(company=company, user=user, name='Bench', email=f'{user.username}@example.com')
+        rng = random.Random(0)
+        for start in range(0, count, 500):
+            inquiries = Inquiry.objects.bulk_create([
+                Inquiry(inquiry_number=f'BENCH-{user.pk}-{i}', contact=contact)
+                for i in range(start, min(start + 500, count))
+            ])
+            # bulk_create 明细时同时刷新汇总字段与检索文档
+            InquiryItem.objects.bulk_create([
+                InquiryItem(
+                    inquiry=inquiry,
+                    product_name=f'{rng.choice(PRODUCTS)} {rng.randint(1, 999)}',
+                    material_name=rng.choice(MATERIALS),
+                    quantity=Decimal(rng.randint(1, 100)),
+                )
+                for inquiry in inquiries for _ in range(items)
+            ])
+
+    def timed(self, fn, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = fn()
+        return (time.perf_counter() - start) / repeat * 1000, result
+
+    def run(self, queries, repeat):
+        factory = RequestFactory()
+        base = Inquiry.objects.select_related('contact__company')
+        total_before = total_after = 0.0
+        for q in queries:
+            request = factory.get('/', {'q': q})
+
+            # 旧实现：询单号/产品名称 icontains，JOIN 明细后 DISTINCT，再取第一页
+            def before():
+                qs = base.filter(Q(inquiry_number__icontains=q) | Q(items__product_name__icontains=q)).distinct()
+                return KeysetPage(qs, request).object_list
+
+            # 新实现：检索索引返回按相关度排序的 id，再取第一页
+            def after():
+                return RankedPage(base, search_ids('inquiry', q, scope=base), request).object_list
+
+            before_ms, before_rows = self.timed(before, repeat)
+            after_ms, after_rows = self.timed(after, repeat)
+            total_before += before_ms
+            total_after += after_ms
+            self.stdout.write(f"{q!r:24} icontains {before_ms:8.2f} ms ({len(before_rows)} rows)   "
+                              f"index {after_ms:8.2f} ms ({len(after_rows)} rows)")
+        self.stdout.write(self.style.SUCCESS(f"speedup x{total_before / max(total_after, 1e-9):.2f}"))
+
+    def handle(self, *args, **options):
+        repeat = max(1, options['repeat'])
+        if not options['seed']:
+            self.run(options['queries'], repeat)
+            return
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                self.seed(options['seed'], options['items'])
+                self.stdout.write(f"seeded {options['seed']} inquiries in {time.perf_counter() - start:.1f}s")
+                self.run(options['queries'], repeat)
+                raise _Rollback
+        except _Rollback:
+            pass
@@ -0,0 +1,53 @@
+import logging
+import time
+import httpx
+from urllib.parse import quote
+from django.core.management.base import BaseCommand
+from django.core.files.base import ContentFile
+from trade_project.storage_backends import SupabaseStorage, close_http_client
+from trade_project.storage_standin import StorageStandinServer
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark: uploads/sec with a per-call httpx.Client vs the pooled SupabaseStorage client"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, default=200, help='每种模式上传的文件数')
+        parser.add_argument('--size', type=int, default=64 * 1024, help='单个文件字节数')
+        parser.add_argument('--handshake-ms', type=float, default=20.0,
+                            help='替身服务器在每个新连接上模拟的握手耗时（毫秒）')
+
+    def handle(self, *args, **options):
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        uploads = options['uploads']
+        payload = b'x' * options['size']
+        server = StorageStandinServer(handshake_delay=options['handshake_ms'] / 1000.0).start()
+        try:
+            storage = SupabaseStorage(url=server.base_url, key='bench', bucket='bench')
+
+            # 旧实现：每次上传新建一个 httpx.Client
+            conns_before = server.connections
+            start = time.perf_counter()
+            for i in range(uploads):
+                url = f"{server.base_url}/storage/v1/object/bench/{quote(f'before/{i}.bin')}?upsert=true"
+                with httpx.Client(timeout=30) as client:
+                    resp = client.post(url, headers={'x-upsert': 'true'}, content=payload)
+                    resp.raise_for_status()
+            before = time.perf_counter() - start
+            before_conns = server.connections - conns_before
+
+            # 新实现：进程级共享连接池
+            close_http_client()
+            conns_before = server.connections
+            start = time.perf_counter()
+            for i in range(uploads):
+                storage._save(f'after/{i}.bin', ContentFile(payload))
+            after = time.perf_counter() - start
+            after_conns = server.connections - conns_before
+        finally:
+            close_http_client()
+            server.stop()
+
+        self.stdout.write(f"per-call client : {uploads / before:8.1f} uploads/s  ({before_conns} connections)")
+        self.stdout.write(f"pooled client   : {uploads / after:8.1f} uploads/s  ({after_conns} connections)")
+        self.stdout.write(self.style.SUCCESS(f"speedup x{before / after:.2f}"))
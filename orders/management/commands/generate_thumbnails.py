@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from orders.models import InquiryItem, InquiryAttachment, OrderItem, OrderAttachment, MessageAttachment
+from orders.thumbnails import ensure_thumbnail, supports_thumbnail
+
+
+class Command(BaseCommand):
+    help = "Generate missing thumbnails for drawings and attachments (existing thumbnails are skipped)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='并发线程数')
+
+    def handle(self, *args, **options):
+        sources = [
+            (InquiryItem, 'drawing_file'),
+            (OrderItem, 'drawing_file'),
+            (InquiryAttachment, 'file'),
+            (OrderAttachment, 'file'),
+            (MessageAttachment, 'file'),
+        ]
+        names = set()
+        for model, field in sources:
+            qs = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            names.update(n for n in qs.values_list(field, flat=True).iterator() if supports_thumbnail(n))
+
+        created = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = {pool.submit(ensure_thumbnail, name): name for name in sorted(names)}
+            for future, name in futures.items():
+                try:
+                    if future.result():
+                        created += 1
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f"[err] {name}: {e}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(names)} files checked, {created} thumbnails available, {failed} failed."))
@@ -1,30 +1,159 @@
+import hashlib
+import json
+import logging
+import mimetypes
 import os
-from django.core.management.base import BaseCommand
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.apps import apps
 from django.conf import settings
-from supabase import create_client
-from orders.models import InquiryItem, OrderAttachment
+from django.core.files.base import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from trade_project.storage_backends import SupabaseStorage
+
+
+def file_md5(path, chunk_size=1024 * 1024):
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
 
 class Command(BaseCommand):
+    help = ("Upload local MEDIA_ROOT files referenced by any FileField to Supabase Storage "
+            "(parallel, resumable, skips objects that already match)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='并发上传线程数')
+        parser.add_argument('--manifest', default=None,
+                            help='进度清单路径（默认 MEDIA_ROOT/.supabase_migration.jsonl），用于断点续传')
+        parser.add_argument('--dry-run', action='store_true', help='只列出需要上传的文件，不实际上传')
+        parser.add_argument('--no-verify', action='store_true',
+                            help='远端大小一致即视为已迁移，不再比较 MD5/ETag')
+
+    # ---------- 发现文件 ----------
+    def discover(self):
+        """遍历所有模型的 FileField，返回去重后的相对路径列表"""
+        paths = set()
+        for model in apps.get_models():
+            file_fields = [f.name for f in model._meta.get_fields() if isinstance(f, models.FileField)]
+            for field_name in file_fields:
+                qs = (model._default_manager.exclude(**{field_name: ''})
+                      .exclude(**{f'{field_name}__isnull': True})
+                      .values_list(field_name, flat=True))
+                for name in qs.iterator(chunk_size=2000):
+                    paths.add(name)
+                self.stdout.write(f"[scan] {model._meta.label}.{field_name}")
+        return sorted(paths)
+
+    # ---------- 进度清单 ----------
+    def load_manifest(self, path):
+        done = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    done[entry['path']] = entry
+        return done
+
     def handle(self, *args, **options):
-        url = os.environ.get('SUPABASE_URL')
-        key = os.environ.get('SUPABASE_SERVICE_KEY')
-        bucket = os.environ.get('SUPABASE_BUCKET', 'media')
-        client = create_client(url, key)
-        count = 0
-        for item in InquiryItem.objects.exclude(drawing_file=''):
-            path = str(item.drawing_file)
-            local_path = os.path.join(settings.MEDIA_ROOT, path)
-            if os.path.exists(local_path):
-                with open(local_path, 'rb') as f:
-                    data = f.read()
-                client.storage.from_(bucket).upload(path=path, file=data, file_options={"upsert": True})
-                count += 1
-        for att in OrderAttachment.objects.all():
-            path = str(att.file)
-            local_path = os.path.join(settings.MEDIA_ROOT, path)
-            if os.path.exists(local_path):
-                with open(local_path, 'rb') as f:
-                    data = f.read()
-                client.storage.from_(bucket).upload(path=path, file=data, file_options={"upsert": True})
-                count += 1
-        self.stdout.write(self.style.SUCCESS(f"Uploaded {count} files to Supabase bucket '{bucket}'."))
\ No newline at end of file
+        if not (os.environ.get('SUPABASE_URL') and os.environ.get('SUPABASE_SERVICE_KEY')):
+            raise CommandError('SUPABASE_URL / SUPABASE_SERVICE_KEY 未配置')
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        storage = SupabaseStorage()
+        media_root = str(settings.MEDIA_ROOT)
+        manifest_path = options['manifest'] or os.path.join(media_root, '.supabase_migration.jsonl')
+        verify = not options['no_verify']
+
+        done = self.load_manifest(manifest_path)
+        todo, missing, resumed = [], 0, 0
+        for path in self.discover():
+            local_path = os.path.join(media_root, path)
+            if not os.path.exists(local_path):
+                missing += 1
+                continue
+            stat = os.stat(local_path)
+            entry = done.get(path)
+            if entry and entry.get('size') == stat.st_size and entry.get('mtime') == int(stat.st_mtime):
+                resumed += 1
+                continue
+            todo.append((path, local_path, stat))
+
+        total_bytes = sum(stat.st_size for _, _, stat in todo)
+        self.stdout.write(f"{len(todo)} files ({total_bytes / 1024 / 1024:.1f} MB) to check, "
+                          f"{resumed} already in manifest, {missing} missing locally")
+        if options['dry_run']:
+            for path, _, stat in todo:
+                self.stdout.write(f"  {path} ({stat.st_size} B)")
+            return
+
+        lock = threading.Lock()
+        counters = {'uploaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+
+        def migrate(item):
+            path, local_path, stat = item
+            key = storage._sanitize_key(path)
+            md5 = None
+            try:
+                remote = storage._head(key)
+            except FileNotFoundError:
+                remote = None
+            if remote and remote['size'] == stat.st_size:
+                if not verify:
+                    return path, stat, 'skipped', None
+                md5 = file_md5(local_path)
+                etag = remote.get('etag') or ''
+                # 分片上传的 ETag 不是 MD5（形如 xxx-N），此时只比较大小
+                if etag == md5 or '-' in etag:
+                    return path, stat, 'skipped', md5
+            content_type = mimetypes.guess_type(local_path)[0] or 'application/octet-stream'
+            with open(local_path, 'rb') as f:
+                storage.upload_to_key(key, File(f, name=path), content_type=content_type)
+            return path, stat, 'uploaded', md5
+
+        start = time.perf_counter()
+        with open(manifest_path, 'a', encoding='utf-8') as manifest, \
+                ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = {pool.submit(migrate, item): item for item in todo}
+            for future in as_completed(futures):
+                path = futures[future][0]
+                try:
+                    path, stat, status, md5 = future.result()
+                except Exception as e:
+                    with lock:
+                        counters['failed'] += 1
+                    self.stdout.write(self.style.ERROR(f"[err] {path}: {e}"))
+                    continue
+                with lock:
+                    counters[status] += 1
+                    if status == 'uploaded':
+                        counters['bytes'] += stat.st_size
+                    manifest.write(json.dumps({
+                        'path': path, 'size': stat.st_size, 'mtime': int(stat.st_mtime),
+                        'md5': md5, 'status': status,
+                    }, ensure_ascii=False) + '\n')
+                    manifest.flush()
+                    processed = counters['uploaded'] + counters['skipped'] + counters['failed']
+                    if processed % 100 == 0:
+                        elapsed = time.perf_counter() - start
+                        self.stdout.write(f"[progress] {processed}/{len(todo)} "
+                                          f"{counters['bytes'] / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Uploaded {counters['uploaded']}, skipped {counters['skipped']} (already match), "
+            f"failed {counters['failed']} in {elapsed:.1f}s — "
+            f"{counters['uploaded'] / max(elapsed, 1e-6):.1f} files/s, "
+            f"{counters['bytes'] / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s "
+            f"to bucket '{storage._bucket}'."
+        ))
+        if counters['failed']:
+            raise CommandError(f"{counters['failed']} files failed; rerun to resume")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from orders.search import reindex_all
+
+
+class Command(BaseCommand):
+    help = "Rebuild the inquiry/order search documents"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['inquiry', 'order'], help='只重建询单或订单；默认全部')
+
+    def handle(self, *args, **options):
+        for kind in [options['kind']] if options['kind'] else ['inquiry', 'order']:
+            with transaction.atomic():
+                count = reindex_all(kind)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} {kind} search documents."))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+
+from orders.models import Inquiry, InquiryItem, InquiryAttachment, Order, OrderItem, OrderAttachment, Message
+from orders.summaries import inquiry_summary_values, order_summary_values, thread_activity_values
+
+
+class Command(BaseCommand):
+    help = ("Rebuild or verify the stored item_count / attachment_count / total_amount and "
+            "message_count / last_message_at / last_activity_at on inquiries and orders")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='只校验，不写入；存在不一致时返回非零退出码')
+        parser.add_argument('--batch-size', type=int, default=2000, help='每批处理的记录数')
+
+    def mismatches(self, model, values):
+        """数据库内比较存储值与重新计算的值，返回不一致的 id 列表"""
+        annotations = {f'calc_{name}': expr for name, expr in values.items()}
+        differs = Q()
+        for name in values:
+            if not model._meta.get_field(name).null:
+                differs |= ~Q(**{name: F(f'calc_{name}')})
+                continue
+            # 可为空的字段（last_message_at）：都为空算一致，一侧为空算不一致
+            # （对可空字段取反时 Django 会附带 IS NULL 条件，所以先限定两侧都不为空）
+            differs |= (Q(**{f'{name}__isnull': False, f'calc_{name}__isnull': False}) & ~Q(**{name: F(f'calc_{name}')})
+                        | Q(**{f'{name}__isnull': True, f'calc_{name}__isnull': False})
+                        | Q(**{f'{name}__isnull': False, f'calc_{name}__isnull': True}))
+        return list(model.objects.annotate(**annotations).filter(differs).values_list('id', flat=True))
+
+    def rebuild(self, model, batch_size):
+        ids = list(model.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                model.refresh_summaries(ids[i:i + batch_size])
+                model.refresh_activity(ids[i:i + batch_size])
+        return len(ids)
+
+    def handle(self, *args, **options):
+        targets = [
+            (Inquiry, {**inquiry_summary_values(InquiryItem, InquiryAttachment),
+                       **thread_activity_values(Message, 'inquiry')}),
+            (Order, {**order_summary_values(OrderItem, OrderAttachment),
+                     **thread_activity_values(Message, 'order')}),
+        ]
+        if options['verify']:
+            total = 0
+            for model, values in targets:
+                bad = self.mismatches(model, values)
+                total += len(bad)
+                label = model._meta.verbose_name
+                if bad:
+                    preview = ', '.join(str(pk) for pk in bad[:20])
+                    self.stdout.write(self.style.ERROR(f"{label}: {len(bad)} mismatched (id {preview}{' ...' if len(bad) > 20 else ''})"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"{label}: OK"))
+            if total:
+                raise CommandError(f"{total} rows out of date; run rebuild_summaries without --verify")
+            return
+
+        for model, _ in targets:
+            count = self.rebuild(model, max(1, options['batch_size']))
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} {model._meta.model_name} summaries."))
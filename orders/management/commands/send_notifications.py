@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders import notifications
+
+# 常驻运行时清理已发送通知的间隔（秒）
+PURGE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = "Deliver queued notifications as per-recipient digest emails over pooled SMTP connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='发送完当前到期的通知后退出（用于 cron）')
+        parser.add_argument('--interval', type=float, default=10, help='没有到期通知时的轮询间隔（秒）')
+        parser.add_argument('--batch-size', type=int, default=None, help='每批领取的收件人数（默认 NOTIFICATION_BATCH_SIZE）')
+        parser.add_argument('--window', type=int, default=None, help='摘要合并窗口（秒，默认 NOTIFICATION_DIGEST_WINDOW）')
+        parser.add_argument('--connections', type=int, default=None,
+                            help='SMTP 连接数（默认 NOTIFICATION_SMTP_CONNECTIONS）')
+
+    def report(self, label, stats):
+        count, age = notifications.backlog()
+        self.stdout.write(f"{label}: {stats}; backlog {count} (oldest {age:.0f}s)")
+
+    def handle(self, *args, **options):
+        retention = getattr(settings, 'NOTIFICATION_RETENTION_DAYS', 30)
+        total = notifications.DeliveryStats()
+        purged_at = 0.0
+        with notifications.SmtpPool(options['connections']) as pool:
+            try:
+                while True:
+                    if retention and time.monotonic() - purged_at > PURGE_INTERVAL:
+                        purged = notifications.purge_sent(retention)
+                        if purged:
+                            self.stdout.write(f"purged {purged} sent notifications older than {retention} days")
+                        purged_at = time.monotonic()
+                    stats = notifications.deliver_due(pool, options['batch_size'], options['window'])
+                    if stats.events:
+                        total.add(stats)
+                        self.report('batch', stats)
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(max(options['interval'], 0.1))
+            except KeyboardInterrupt:
+                pass
+            opened = pool.opened
+        self.report('total', total)
+        self.stdout.write(self.style.SUCCESS(f"{opened} SMTP connections opened."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from orders.smtp_sink import SmtpSink
+
+
+class Command(BaseCommand):
+    help = "Run a local SMTP sink that accepts and prints every email (set EMAIL_HOST/EMAIL_PORT to it, EMAIL_USE_TLS=false)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--body', action='store_true', help='同时打印邮件正文')
+
+    def handle(self, *args, **options):
+        def show(mail):
+            message = mail.message
+            self.stdout.write(f"{mail.mail_from} -> {', '.join(mail.recipients)}: {message['Subject']}")
+            if options['body']:
+                self.stdout.write(message.get_body(preferencelist=('plain',)).get_content())
+
+        sink = SmtpSink(options['host'], options['port'], on_message=show)
+        self.stdout.write(self.style.SUCCESS(f"SMTP sink listening on {options['host']}:{sink.port} (Ctrl+C to stop)"))
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"{len(sink.messages)} emails received over {sink.connections} connections.")
@@ -0,0 +1,100 @@
+"""
+请求级联系人解析
+
+ContactMiddleware 为每个请求提供：
+- request.contact：惰性加载的 Contact（select_related('company')，一次查询），没有联系人时为假值；
+- request.contact_info：联系人不变的部分（id / role / company_id / approval_status），
+  缓存在 session 中，导航栏、角色校验等只需要这些字段的地方不再查询数据库。
+
+session 中的信息带版本号：Contact 保存/删除时（signals.py）在缓存中为该用户写入新版本，
+其它请求发现版本不一致即重新加载；CONTACT_INFO_TTL 秒后也会重新加载，
+覆盖进程内缓存（未配置 REDIS_URL）无法跨进程失效的情况。
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .models import Contact
+
+SESSION_KEY = '_contact_info'
+
+
+def _version_key(user_id):
+    return f'contact:version:{user_id}'
+
+
+def _current_version(user_id):
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # 缓存被清空时生成新版本，session 中的旧信息随之失效
+        cache.add(_version_key(user_id), uuid.uuid4().hex, None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def invalidate_contact_info(user_id):
+    """联系人变更后调用：该用户所有 session 中缓存的联系人信息失效"""
+    if user_id:
+        cache.set(_version_key(user_id), uuid.uuid4().hex, None)
+
+
+def get_contact(request):
+    """当前用户的 Contact（含 company），没有时返回 None；每个请求最多查询一次"""
+    if not hasattr(request, '_cached_contact'):
+        user = request.user
+        request._cached_contact = (
+            Contact.objects.select_related('company').filter(user=user).first()
+            if user.is_authenticated else None
+        )
+    return request._cached_contact
+
+
+def remember_contact(request, contact):
+    """登录时已查到联系人，直接写入本请求与 session，省去下次请求的加载"""
+    request._cached_contact = contact
+    request.session[SESSION_KEY] = _info(contact, _current_version(contact.user_id))
+
+
+def _info(contact, version):
+    return {
+        'user_id': contact.user_id,
+        'id': contact.pk,
+        'role': contact.role,
+        'company_id': contact.company_id,
+        'approval_status': contact.approval_status,
+        'version': version,
+        'loaded_at': time.time(),
+    }
+
+
+def get_contact_info(request):
+    """联系人不变部分（dict）；未登录或没有联系人时为空 dict"""
+    user = request.user
+    if not user.is_authenticated:
+        return {}
+    version = _current_version(user.pk)
+    info = request.session.get(SESSION_KEY)
+    ttl = getattr(settings, 'CONTACT_INFO_TTL', 300)
+    if (not info or info.get('user_id') != user.pk or info.get('version') != version
+            or time.time() - info.get('loaded_at', 0) > ttl):
+        contact = get_contact(request)
+        info = _info(contact, version) if contact else {
+            'user_id': user.pk, 'id': None, 'version': version, 'loaded_at': time.time(),
+        }
+        request.session[SESSION_KEY] = info
+    return info if info.get('id') else {}
+
+
+class ContactMiddleware:
+    """需放在 AuthenticationMiddleware 之后"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.contact = SimpleLazyObject(lambda: get_contact(request))
+        request.contact_info = SimpleLazyObject(lambda: get_contact_info(request))
+        return self.get_response(request)
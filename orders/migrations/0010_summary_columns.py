@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 01:30
+
+from django.db import migrations, models
+
+from orders.summaries import inquiry_summary_values, order_summary_values
+
+
+def populate_summaries(apps, schema_editor):
+    Inquiry = apps.get_model('orders', 'Inquiry')
+    Order = apps.get_model('orders', 'Order')
+    Inquiry.objects.update(**inquiry_summary_values(
+        apps.get_model('orders', 'InquiryItem'), apps.get_model('orders', 'InquiryAttachment')))
+    Order.objects.update(**order_summary_values(
+        apps.get_model('orders', 'OrderItem'), apps.get_model('orders', 'OrderAttachment')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inquiry',
+            name='attachment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='附件数'),
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='明细数'),
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14, verbose_name='报价总金额(USD)'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='attachment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='附件数'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='明细数'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14, verbose_name='总金额(USD)'),
+        ),
+        migrations.RunPython(populate_summaries, migrations.RunPython.noop),
+    ]
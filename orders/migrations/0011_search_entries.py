@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 01:33
+
+from django.db import migrations, models
+
+from orders import search
+
+
+def populate_search(apps, schema_editor):
+    search.reindex_all('inquiry', apps=apps)
+    search.reindex_all('order', apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_summary_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('inquiry', '询单'), ('order', '订单')], max_length=20, verbose_name='类型')),
+                ('object_id', models.BigIntegerField(verbose_name='对象ID')),
+                ('document', models.TextField(verbose_name='检索文本')),
+            ],
+            options={
+                'verbose_name': '检索文档',
+                'verbose_name_plural': '检索文档',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='searchentry_kind_object_uniq')],
+            },
+        ),
+        # PostgreSQL：tsvector 生成列 + GIN / trigram 索引；SQLite：FTS5 影子表与同步触发器
+        migrations.RunPython(search.install_backend_index, search.remove_backend_index),
+        migrations.RunPython(populate_search, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_search_entries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=10, verbose_name='前缀')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='已分配到')),
+            ],
+            options={
+                'verbose_name': '单号计数器',
+                'verbose_name_plural': '单号计数器',
+                'constraints': [models.UniqueConstraint(fields=('prefix', 'day'), name='numbercounter_prefix_day_uniq')],
+            },
+        ),
+    ]
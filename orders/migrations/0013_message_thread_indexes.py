@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_number_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['inquiry', 'created_at', 'id'], name='message_inquiry_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['order', 'created_at', 'id'], name='message_order_created_idx'),
+        ),
+    ]
@@ -0,0 +1,132 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+from orders.summaries import thread_activity_values
+
+
+def seed_read_states(apps, model_name, kind):
+    """已有会话的参与者（所属联系人的账号与发过消息的用户）记为已读到当前消息，历史消息不显示为未读"""
+    Message = apps.get_model('orders', 'Message')
+    ThreadReadState = apps.get_model('orders', 'ThreadReadState')
+    counts = {}
+    participants = set()
+    threads = apps.get_model('orders', model_name).objects.filter(message_count__gt=0)
+    for pk, user_id, count in threads.values_list('id', 'contact__user_id', 'message_count').iterator():
+        counts[pk] = count
+        if user_id:
+            participants.add((pk, user_id))
+    messages = Message.objects.filter(**{f'{kind}__isnull': False})
+    participants.update(messages.values_list(kind, 'sender_id').distinct())
+    last_ids = dict(messages.values_list(kind).annotate(last_id=Max('id')).order_by())
+    ThreadReadState.objects.bulk_create([
+        ThreadReadState(user_id=user_id, read_count=counts[pk], last_read_message_id=last_ids[pk],
+                        **{f'{kind}_id': pk})
+        for pk, user_id in sorted(participants) if pk in counts
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+def populate_activity(apps, schema_editor):
+    Message = apps.get_model('orders', 'Message')
+    apps.get_model('orders', 'Inquiry').objects.update(**thread_activity_values(Message, 'inquiry'))
+    apps.get_model('orders', 'Order').objects.update(**thread_activity_values(Message, 'order'))
+    seed_read_states(apps, 'Inquiry', 'inquiry')
+    seed_read_states(apps, 'Order', 'order')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_message_thread_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.PositiveBigIntegerField(default=0, verbose_name='已读到的消息ID')),
+                ('read_count', models.PositiveIntegerField(default=0, verbose_name='已读消息数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '会话已读状态',
+                'verbose_name_plural': '会话已读状态',
+            },
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='最近活动时间'),
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='最新消息时间'),
+        ),
+        migrations.AddField(
+            model_name='inquiry',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='消息数'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='最近活动时间'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='最新消息时间'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='消息数'),
+        ),
+        migrations.AddIndex(
+            model_name='inquiry',
+            index=models.Index(fields=['last_activity_at', 'id'], name='inquiry_activity_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inquiry',
+            index=models.Index(fields=['status', 'last_activity_at', 'id'], name='inquiry_status_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['last_activity_at', 'id'], name='order_activity_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'last_activity_at', 'id'], name='order_status_activity_idx'),
+        ),
+        migrations.AddField(
+            model_name='threadreadstate',
+            name='inquiry',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='orders.inquiry', verbose_name='询单'),
+        ),
+        migrations.AddField(
+            model_name='threadreadstate',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='orders.order', verbose_name='订单'),
+        ),
+        migrations.AddField(
+            model_name='threadreadstate',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_reads', to=settings.AUTH_USER_MODEL, verbose_name='用户'),
+        ),
+        migrations.AddConstraint(
+            model_name='threadreadstate',
+            constraint=models.UniqueConstraint(condition=models.Q(('inquiry__isnull', False)), fields=('user', 'inquiry'), name='threadread_user_inquiry_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='threadreadstate',
+            constraint=models.UniqueConstraint(condition=models.Q(('order__isnull', False)), fields=('user', 'order'), name='threadread_user_order_uniq'),
+        ),
+        migrations.RunPython(populate_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0014_thread_activity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, verbose_name='收件邮箱')),
+                ('event', models.CharField(choices=[('order_status', '订单状态'), ('inquiry_quoted', '询单报价'), ('message', '新消息')], max_length=20, verbose_name='事件')),
+                ('text', models.CharField(max_length=500, verbose_name='内容')),
+                ('link', models.CharField(blank=True, max_length=200, verbose_name='链接')),
+                ('status', models.CharField(choices=[('pending', '待发送'), ('sent', '已发送'), ('failed', '发送失败')], default='pending', max_length=20, verbose_name='状态')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='发送次数')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='可发送时间')),
+                ('claim_token', models.CharField(blank=True, max_length=32, verbose_name='领取标记')),
+                ('claimed_until', models.DateTimeField(blank=True, null=True, verbose_name='领取有效期')),
+                ('last_error', models.TextField(blank=True, verbose_name='最近错误')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='发送时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL, verbose_name='收件人')),
+            ],
+            options={
+                'verbose_name': '邮件通知',
+                'verbose_name_plural': '邮件通知',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'available_at'], name='notification_due_idx'), models.Index(fields=['recipient', 'status'], name='notification_recipient_idx'), models.Index(fields=['claim_token'], name='notification_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0015_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsedUploadToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True, verbose_name='token 摘要')),
+                ('used_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='使用时间')),
+            ],
+            options={
+                'verbose_name': '已使用的直传会话',
+                'verbose_name_plural': '已使用的直传会话',
+            },
+        ),
+    ]
@@ -2,14 +2,23 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
+from django.utils import timezone
 import os
 
+from . import search
+from .summaries import (SummaryChildMixin, SummaryParentMixin, SummaryQuerySet, inquiry_summary_values,
+                        order_summary_values, thread_activity_values)
+
 
 # ==================== 文件验证函数 ====================
+ALLOWED_FILE_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.dwg', '.dxf', '.ppt', '.pptx', '.doc', '.docx']
+MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
+
+
 def validate_file_extension(value):
     """验证上传文件的扩展名"""
     ext = os.path.splitext(value.name)[1].lower()
-    valid_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.dwg', '.dxf', '.ppt', '.pptx', '.doc', '.docx']
+    valid_extensions = ALLOWED_FILE_EXTENSIONS
     if ext not in valid_extensions:
         raise ValidationError(
             _('不支持的文件格式。允许的格式：%(exts)s') % {
@@ -21,7 +30,7 @@ def validate_file_extension(value):
 def validate_file_size(value):
     """验证文件大小（限制为20MB）"""
     filesize = value.size
-    if filesize > 20 * 1024 * 1024:  # 20MB
+    if filesize > MAX_FILE_SIZE:
         raise ValidationError(_('文件大小不能超过 20MB'))
 
 
@@ -105,7 +114,7 @@ class Contact(models.Model):
 
 
 # ==================== 询单表 ====================
-class Inquiry(models.Model):
+class Inquiry(SummaryParentMixin, models.Model):
     """询单表 - 由客户创建，供应商报价"""
     STATUS_CHOICES = [
         ('pending', _('待报价')),
@@ -130,6 +139,16 @@ class Inquiry(models.Model):
                                    related_name='quoted_inquiries', verbose_name=_('报价人'))
     supplier_notes = models.TextField(_('供应商备注'), blank=True)
     
+    # 汇总字段：明细/附件变更时自动维护（见 summaries.py），列表与后台直接读取、排序
+    item_count = models.PositiveIntegerField(_('明细数'), default=0, editable=False)
+    attachment_count = models.PositiveIntegerField(_('附件数'), default=0, editable=False)
+    total_amount = models.DecimalField(_('报价总金额(USD)'), max_digits=14, decimal_places=2, default=0, editable=False)
+    
+    # 会话活动：新消息写入时递增维护（见 activity.py），列表按最近活动排序、计算未读数
+    message_count = models.PositiveIntegerField(_('消息数'), default=0, editable=False)
+    last_message_at = models.DateTimeField(_('最新消息时间'), null=True, blank=True, editable=False)
+    last_activity_at = models.DateTimeField(_('最近活动时间'), default=timezone.now, editable=False)
+    
     created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
     updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
     
@@ -137,18 +156,43 @@ class Inquiry(models.Model):
         verbose_name = _('询单')
         verbose_name_plural = _('询单')
         ordering = ['-created_at']
+        indexes = [
+            # 列表游标分页：按 (created_at, id) 倒序翻页，可选按状态筛选
+            models.Index(fields=['created_at', 'id'], name='inquiry_created_id_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='inquiry_status_created_idx'),
+            # 按最近活动排序（同上，游标为 (last_activity_at, id)）
+            models.Index(fields=['last_activity_at', 'id'], name='inquiry_activity_id_idx'),
+            models.Index(fields=['status', 'last_activity_at', 'id'], name='inquiry_status_activity_idx'),
+        ]
     
     def __str__(self):
         return f"{self.inquiry_number} - {self.contact.company.company_name}"
     
-    def total_amount(self):
-        """计算询单总金额（报价后）"""
-        return sum(item.quoted_price * item.quantity for item in self.items.all() if item.quoted_price)
+    @classmethod
+    def refresh_summaries(cls, ids, touch=False):
+        """明细/附件变更后刷新派生数据：明细数、附件数、报价总金额与检索文档
+
+        touch=True 时同时更新 updated_at（明细/附件变更时），详情页的 ETag 随之变化。
+        """
+        values = inquiry_summary_values(InquiryItem, InquiryAttachment)
+        if touch:
+            values['updated_at'] = timezone.now()
+        cls.objects.filter(pk__in=ids).update(**values)
+        search.reindex('inquiry', ids)
+
+    @classmethod
+    def refresh_activity(cls, ids):
+        """按消息表重算消息数与最近活动时间（删除消息后、rebuild_summaries 时使用）"""
+        cls.objects.filter(pk__in=ids).update(**thread_activity_values(Message, 'inquiry'))
 
 
 # ==================== 询单明细表 ====================
-class InquiryItem(models.Model):
+class InquiryItem(SummaryChildMixin, models.Model):
     """询单明细表"""
+    summary_parent = 'inquiry'
+    summary_fields = {'inquiry', 'inquiry_id', 'quantity', 'quoted_price',
+                      'product_name', 'material_name', 'material_grade', 'specifications'}
+
     inquiry = models.ForeignKey(Inquiry, on_delete=models.CASCADE, related_name='items', verbose_name=_('询单'))
     
     # 客户填写的需求信息
@@ -174,6 +218,8 @@ class InquiryItem(models.Model):
     
     notes = models.TextField(_('备注'), blank=True)
     
+    objects = SummaryQuerySet.as_manager()
+    
     class Meta:
         verbose_name = _('询单明细')
         verbose_name_plural = _('询单明细')
@@ -189,8 +235,11 @@ class InquiryItem(models.Model):
 
 
 # ==================== 询单附件表（新增） ====================
-class InquiryAttachment(models.Model):
+class InquiryAttachment(SummaryChildMixin, models.Model):
     """询单附件表 - 支持多个文件上传"""
+    summary_parent = 'inquiry'
+    summary_fields = {'inquiry', 'inquiry_id'}
+
     inquiry = models.ForeignKey(Inquiry, on_delete=models.CASCADE, related_name='attachments', verbose_name=_('询单'))
     
     file = models.FileField(
@@ -205,6 +254,8 @@ class InquiryAttachment(models.Model):
     uploaded_at = models.DateTimeField(_('上传时间'), auto_now_add=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_('上传人'))
     
+    objects = SummaryQuerySet.as_manager()
+    
     class Meta:
         verbose_name = _('询单附件')
         verbose_name_plural = _('询单附件')
@@ -237,7 +288,7 @@ class InquiryAttachment(models.Model):
 
 
 # ==================== 订单表 ====================
-class Order(models.Model):
+class Order(SummaryParentMixin, models.Model):
     """订单表 - 由客户创建，供应商确认并更新状态"""
     STATUS_CHOICES = [
         ('pending', _('待确认')),
@@ -275,6 +326,16 @@ class Order(models.Model):
     customer_notes = models.TextField(_('客户备注'), blank=True)
     supplier_notes = models.TextField(_('供应商备注'), blank=True)
     
+    # 汇总字段：明细/附件变更时自动维护（见 summaries.py）
+    item_count = models.PositiveIntegerField(_('明细数'), default=0, editable=False)
+    attachment_count = models.PositiveIntegerField(_('附件数'), default=0, editable=False)
+    total_amount = models.DecimalField(_('总金额(USD)'), max_digits=14, decimal_places=2, default=0, editable=False)
+    
+    # 会话活动：新消息写入时递增维护（见 activity.py），列表按最近活动排序、计算未读数
+    message_count = models.PositiveIntegerField(_('消息数'), default=0, editable=False)
+    last_message_at = models.DateTimeField(_('最新消息时间'), null=True, blank=True, editable=False)
+    last_activity_at = models.DateTimeField(_('最近活动时间'), default=timezone.now, editable=False)
+    
     created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
     updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
     
@@ -282,18 +343,40 @@ class Order(models.Model):
         verbose_name = _('订单')
         verbose_name_plural = _('订单')
         ordering = ['-created_at']
+        indexes = [
+            # 列表游标分页：按 (created_at, id) 倒序翻页，可选按状态筛选
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+            models.Index(fields=['status', 'created_at', 'id'], name='order_status_created_idx'),
+            # 按最近活动排序（同上，游标为 (last_activity_at, id)）
+            models.Index(fields=['last_activity_at', 'id'], name='order_activity_id_idx'),
+            models.Index(fields=['status', 'last_activity_at', 'id'], name='order_status_activity_idx'),
+        ]
     
     def __str__(self):
         return f"{self.order_number} - {self.contact.company.company_name}"
     
-    def total_amount(self):
-        """计算订单总金额"""
-        return sum(item.subtotal() for item in self.items.all())
+    @classmethod
+    def refresh_summaries(cls, ids, touch=False):
+        """明细/附件变更后刷新派生数据：明细数、附件数、总金额与检索文档；touch 同上"""
+        values = order_summary_values(OrderItem, OrderAttachment)
+        if touch:
+            values['updated_at'] = timezone.now()
+        cls.objects.filter(pk__in=ids).update(**values)
+        search.reindex('order', ids)
+
+    @classmethod
+    def refresh_activity(cls, ids):
+        """同 Inquiry.refresh_activity"""
+        cls.objects.filter(pk__in=ids).update(**thread_activity_values(Message, 'order'))
 
 
 # ==================== 订单明细表 ====================
-class OrderItem(models.Model):
+class OrderItem(SummaryChildMixin, models.Model):
     """订单明细表"""
+    summary_parent = 'order'
+    summary_fields = {'order', 'order_id', 'quantity', 'unit_price',
+                      'product_name', 'material_name', 'material_grade', 'specifications'}
+
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', verbose_name=_('订单'))
     
     product_name = models.CharField(_('产品名称'), max_length=200)
@@ -317,6 +400,8 @@ class OrderItem(models.Model):
     
     notes = models.TextField(_('备注'), blank=True)
     
+    objects = SummaryQuerySet.as_manager()
+    
     class Meta:
         verbose_name = _('订单明细')
         verbose_name_plural = _('订单明细')
@@ -330,8 +415,11 @@ class OrderItem(models.Model):
 
 
 # ==================== 订单附件表（新增） ====================
-class OrderAttachment(models.Model):
+class OrderAttachment(SummaryChildMixin, models.Model):
     """订单附件表 - 支持多个文件上传"""
+    summary_parent = 'order'
+    summary_fields = {'order', 'order_id'}
+
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='attachments', verbose_name=_('订单'))
     
     file = models.FileField(
@@ -346,6 +434,8 @@ class OrderAttachment(models.Model):
     uploaded_at = models.DateTimeField(_('上传时间'), auto_now_add=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_('上传人'))
     
+    objects = SummaryQuerySet.as_manager()
+    
     class Meta:
         verbose_name = _('订单附件')
         verbose_name_plural = _('订单附件')
@@ -389,6 +479,11 @@ class Message(models.Model):
         verbose_name = _('沟通消息')
         verbose_name_plural = _('沟通消息')
         ordering = ['-created_at']
+        indexes = [
+            # 会话分页：按 (created_at, id) 倒序逐页读取，每页一次索引范围扫描
+            models.Index(fields=['inquiry', 'created_at', 'id'], name='message_inquiry_created_idx'),
+            models.Index(fields=['order', 'created_at', 'id'], name='message_order_created_idx'),
+        ]
 
     def __str__(self):
         target = self.inquiry and f"INQ:{self.inquiry.inquiry_number}" or (self.order and f"ORD:{self.order.order_number}" or '')
@@ -412,4 +507,134 @@ class MessageAttachment(models.Model):
             if not self.file_name:
                 self.file_name = os.path.basename(self.file.name)
             self.file_size = self.file.size
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+# ==================== 会话已读状态 ====================
+class ThreadReadState(models.Model):
+    """用户在询单/订单会话中的已读位置：未读数 = 会话消息数 - read_count（见 activity.py）"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='thread_reads', verbose_name=_('用户'))
+    inquiry = models.ForeignKey('Inquiry', on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='read_states', verbose_name=_('询单'))
+    order = models.ForeignKey('Order', on_delete=models.CASCADE, null=True, blank=True,
+                              related_name='read_states', verbose_name=_('订单'))
+    last_read_message_id = models.PositiveBigIntegerField(_('已读到的消息ID'), default=0)
+    read_count = models.PositiveIntegerField(_('已读消息数'), default=0)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('会话已读状态')
+        verbose_name_plural = _('会话已读状态')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'inquiry'], condition=models.Q(inquiry__isnull=False),
+                                    name='threadread_user_inquiry_uniq'),
+            models.UniqueConstraint(fields=['user', 'order'], condition=models.Q(order__isnull=False),
+                                    name='threadread_user_order_uniq'),
+        ]
+
+    def __str__(self):
+        target = f"INQ:{self.inquiry_id}" if self.inquiry_id else f"ORD:{self.order_id}"
+        return f"{self.user_id} @ {target}: {self.read_count}"
+
+
+# ==================== 全文检索文档 ====================
+class SearchEntry(models.Model):
+    """询单/订单的检索文档（影子表，由 search.py 维护）
+
+    PostgreSQL 上迁移会额外添加 tsvector 生成列与 trigram 索引；SQLite 上同步到 FTS5 表。
+    """
+    KIND_CHOICES = [
+        ('inquiry', _('询单')),
+        ('order', _('订单')),
+    ]
+
+    kind = models.CharField(_('类型'), max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField(_('对象ID'))
+    document = models.TextField(_('检索文本'))
+
+    class Meta:
+        verbose_name = _('检索文档')
+        verbose_name_plural = _('检索文档')
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='searchentry_kind_object_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id}"
+
+
+# ==================== 单号计数器 ====================
+class NumberCounter(models.Model):
+    """询单号/订单号计数器：每个前缀每天一行，由 numbering.py 原子递增"""
+    prefix = models.CharField(_('前缀'), max_length=10)
+    day = models.DateField(_('日期'))
+    value = models.PositiveBigIntegerField(_('已分配到'), default=0)
+
+    class Meta:
+        verbose_name = _('单号计数器')
+        verbose_name_plural = _('单号计数器')
+        constraints = [
+            models.UniqueConstraint(fields=['prefix', 'day'], name='numbercounter_prefix_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.prefix}-{self.day:%Y%m%d}: {self.value}"
+
+
+# ==================== 通知发件箱 ====================
+class Notification(models.Model):
+    """待发送的邮件通知：与业务数据在同一事务中写入，由 send_notifications 按收件人合并为摘要发送（见 notifications.py）"""
+    EVENT_CHOICES = [
+        ('order_status', _('订单状态')),
+        ('inquiry_quoted', _('询单报价')),
+        ('message', _('新消息')),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', _('待发送')),
+        ('sent', _('已发送')),
+        ('failed', _('发送失败')),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications', verbose_name=_('收件人'))
+    email = models.EmailField(_('收件邮箱'))
+    event = models.CharField(_('事件'), max_length=20, choices=EVENT_CHOICES)
+    text = models.CharField(_('内容'), max_length=500)
+    link = models.CharField(_('链接'), max_length=200, blank=True)
+
+    status = models.CharField(_('状态'), max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(_('发送次数'), default=0)
+    available_at = models.DateTimeField(_('可发送时间'), default=timezone.now)
+    claim_token = models.CharField(_('领取标记'), max_length=32, blank=True)
+    claimed_until = models.DateTimeField(_('领取有效期'), null=True, blank=True)
+    last_error = models.TextField(_('最近错误'), blank=True)
+    sent_at = models.DateTimeField(_('发送时间'), null=True, blank=True)
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('邮件通知')
+        verbose_name_plural = _('邮件通知')
+        ordering = ['-created_at']
+        indexes = [
+            # 发送进程按 (status, available_at) 找到到期的待发送通知，再按收件人领取
+            models.Index(fields=['status', 'available_at'], name='notification_due_idx'),
+            models.Index(fields=['recipient', 'status'], name='notification_recipient_idx'),
+            models.Index(fields=['claim_token'], name='notification_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.email}: {self.text}"
+
+
+# ==================== 已使用的直传会话 ====================
+class UsedUploadToken(models.Model):
+    """已确认过的直传 token（记录摘要），防止同一 token 重复 finalize；超过 DIRECT_UPLOAD_TTL 的记录可清理"""
+    digest = models.CharField(_('token 摘要'), max_length=64, unique=True)
+    used_at = models.DateTimeField(_('使用时间'), auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _('已使用的直传会话')
+        verbose_name_plural = _('已使用的直传会话')
+
+    def __str__(self):
+        return self.digest
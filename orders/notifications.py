@@ -0,0 +1,339 @@
+"""
+邮件通知：发件箱 + 批量摘要发送
+
+- 写入：订单状态变化（确认、发货、确认收款、完成）、询单报价与新消息时，
+  在同一事务中向 Notification 表为每个收件人写入一行，请求内不连接 SMTP；
+  事务回滚时通知随之撤销，提交后不会丢失。
+- 发送：send_notifications 命令（常驻，或由 cron 定时执行 --once）按批领取到期的收件人：
+  某收件人最早一条待发送通知已超过 NOTIFICATION_DIGEST_WINDOW 秒时，把该收件人的全部待发送通知
+  合并为一封摘要邮件。领取用带条件的 UPDATE 写入领取标记，多个发送进程不会重复领取；
+  进程中途退出时领取在 CLAIM_SECONDS 后过期，由其它进程重新发送（至少发送一次）。
+- SMTP：SmtpPool 中每个发送线程持有一条长连接，批次之间复用，不为每封邮件重新握手。
+- 发送失败的邮件按指数退避重试，达到 NOTIFICATION_MAX_ATTEMPTS 次后标记为发送失败。
+"""
+import logging
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Min, Q
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import Truncator
+from django.utils.translation import gettext as _, gettext_noop
+
+from .models import Contact, Inquiry, Notification, Order
+
+logger = logging.getLogger(__name__)
+
+# 领取后的有效期（秒）：超时未完成的领取视为放弃，可被重新领取
+CLAIM_SECONDS = 300
+
+# 失败重试的退避上限（秒）
+MAX_RETRY_DELAY = 3600
+
+# 连接已不可用：关闭后用新连接重发一次
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+# 单封邮件被拒（收件人、发件人、内容），smtplib 已 RSET，连接仍可继续使用
+_MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+# ==================== 写入发件箱 ====================
+def _notification(recipient, event, text, link):
+    user_id, email = recipient
+    return Notification(recipient_id=user_id, email=email, event=event,
+                        text=Truncator(text).chars(500), link=link)
+
+
+def _buyer(contact):
+    """买家联系人 (user_id, email)；未绑定账号或已停用时为 None"""
+    if not contact.user_id or not contact.is_active or not contact.email:
+        return None
+    return contact.user_id, contact.email
+
+
+def _suppliers(user_ids=None):
+    """供应商收件人 [(user_id, email)]：user_ids 为空时取全部已批准的供应商联系人"""
+    contacts = Contact.objects.filter(role='supplier', is_active=True, user__isnull=False).exclude(email='')
+    if user_ids is None:
+        contacts = contacts.filter(approval_status='approved')
+    else:
+        contacts = contacts.filter(user_id__in=user_ids)
+    return list(contacts.values_list('user_id', 'email'))
+
+
+def _links(kind, pk):
+    """(买家详情页, 供应商详情页)"""
+    kwargs = {f'{kind}_id': pk}
+    return reverse(f'{kind}_detail', kwargs=kwargs), reverse(f'supplier_{kind}_detail', kwargs=kwargs)
+
+
+# 供应商在订单详情页的操作 → 通知买家的内容
+ORDER_EVENTS = {
+    'confirm': gettext_noop('订单 %(number)s 已确认'),
+    'ship': gettext_noop('订单 %(number)s 已发货'),
+    'confirm_payment': gettext_noop('订单 %(number)s 已确认收款'),
+    'complete': gettext_noop('订单 %(number)s 已完成'),
+}
+
+
+def order_status(order, action):
+    """供应商变更订单状态后通知买家（在保存订单的事务内调用）；其它操作不通知"""
+    buyer = _buyer(order.contact)
+    if action in ORDER_EVENTS and buyer:
+        text = _(ORDER_EVENTS[action]) % {'number': order.order_number}
+        _notification(buyer, 'order_status', text, _links('order', order.pk)[0]).save()
+
+
+def inquiries_quoted(inquiries):
+    """询单报价后通知买家（在写入报价的事务内调用）；批量报价时一次写入"""
+    missing = {i.contact_id for i in inquiries if not type(i).contact.is_cached(i)}
+    contacts = {c.pk: c for c in Contact.objects.filter(pk__in=missing).only('user_id', 'email', 'is_active')}
+    notifications = []
+    for inquiry in inquiries:
+        buyer = _buyer(contacts.get(inquiry.contact_id) or inquiry.contact)
+        if buyer:
+            text = _('询单 %(number)s 已报价') % {'number': inquiry.inquiry_number}
+            notifications.append(_notification(buyer, 'inquiry_quoted', text, _links('inquiry', inquiry.pk)[0]))
+    Notification.objects.bulk_create(notifications)
+
+
+def new_message(message):
+    """新消息通知会话中的其他人（消息 post_save 时调用，与消息在同一事务中）
+
+    买家：询单/订单的联系人；供应商：负责销售（询单报价人，订单确认人或来源询单报价人），
+    尚无负责销售时买家的消息通知全部已批准的供应商。发送人自己不通知。
+    """
+    if message.inquiry_id:
+        kind, thread = 'inquiry', Inquiry.objects.select_related('contact').get(pk=message.inquiry_id)
+        number, responsible = thread.inquiry_number, thread.quoted_by_id
+    else:
+        kind, thread = 'order', Order.objects.select_related('contact', 'inquiry').get(pk=message.order_id)
+        number = thread.order_number
+        responsible = thread.confirmed_by_id or (thread.inquiry_id and thread.inquiry.quoted_by_id)
+    buyer_link, supplier_link = _links(kind, thread.pk)
+    sender = message.sender
+    name = sender.get_full_name() or sender.username
+    preview = Truncator(' '.join(message.content.split())).chars(100) or _('（附件）')
+    text = _('%(sender)s 在 %(number)s 中发来消息：%(preview)s') % {
+        'sender': name, 'number': number, 'preview': preview}
+
+    notifications = []
+    buyer = _buyer(thread.contact)
+    if buyer and buyer[0] != sender.pk:
+        notifications.append(_notification(buyer, 'message', text, buyer_link))
+    if responsible:
+        suppliers = _suppliers([responsible])
+    elif buyer and buyer[0] == sender.pk:
+        suppliers = _suppliers()
+    else:
+        suppliers = []
+    notifications.extend(_notification(s, 'message', text, supplier_link) for s in suppliers if s[0] != sender.pk)
+    Notification.objects.bulk_create(notifications)
+
+
+# ==================== 领取 ====================
+def _unclaimed(now):
+    return Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+
+
+def claim(limit, window, now=None):
+    """领取最多 limit 个到期收件人的全部待发送通知，返回按收件人、创建时间排序的通知列表
+
+    到期：收件人最早一条可发送的通知已等待 window 秒以上（合并窗口内陆续到来的通知一起发送）。
+    """
+    now = now or timezone.now()
+    due = (Notification.objects.filter(_unclaimed(now), status='pending', available_at__lte=now)
+           .values('recipient_id').annotate(first=Min('created_at'))
+           .filter(first__lte=now - timedelta(seconds=window))
+           .order_by('first').values_list('recipient_id', flat=True)[:limit])
+    recipients = list(due)
+    if not recipients:
+        return []
+    token = uuid.uuid4().hex
+    # 条件 UPDATE：同时运行的其它进程已领取的行不会被再次领取
+    (Notification.objects.filter(_unclaimed(now), recipient_id__in=recipients, status='pending', available_at__lte=now)
+     .update(claim_token=token, claimed_until=now + timedelta(seconds=CLAIM_SECONDS)))
+    return list(Notification.objects.filter(claim_token=token).order_by('recipient_id', 'created_at', 'id'))
+
+
+def digest_message(notifications):
+    """一个收件人的通知合并为一封邮件"""
+    site_url = getattr(settings, 'NOTIFICATION_SITE_URL', '').rstrip('/')
+    if len(notifications) == 1:
+        subject = notifications[0].text
+    else:
+        subject = _('您有 %(count)s 条询单/订单动态') % {'count': len(notifications)}
+    body = render_to_string('orders/emails/notification_digest.txt', {
+        'notifications': notifications,
+        'site_url': site_url,
+    })
+    return EmailMessage(subject=Truncator(' '.join(subject.split())).chars(150), body=body,
+                        to=[notifications[-1].email])
+
+
+# ==================== SMTP 连接池 ====================
+class SmtpPool:
+    """SMTP 连接池：size 个发送线程各持有一条长连接，批次之间复用；连接断开时重新建立"""
+
+    def __init__(self, size=None):
+        self.size = max(1, size or getattr(settings, 'NOTIFICATION_SMTP_CONNECTIONS', 2))
+        self.opened = 0
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='smtp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+                self.opened += 1
+        return connection
+
+    def _discard(self):
+        connection = self._local.__dict__.pop('connection', None)
+        if connection is not None:
+            with self._lock:
+                self._connections.remove(connection)
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _send(self, message):
+        """发送一封邮件：成功返回 None，失败返回错误信息"""
+        for attempt in range(2):
+            try:
+                self._connection().send_messages([message])
+                return None
+            except _MESSAGE_ERRORS as e:
+                return repr(e)
+            except _CONNECTION_ERRORS as e:
+                # 服务器关闭了空闲连接等：换一条新连接重发一次
+                self._discard()
+                if attempt:
+                    return repr(e)
+            except Exception as e:
+                self._discard()
+                return repr(e)
+
+    def send(self, messages):
+        """并发发送，返回与 messages 对应的错误列表（成功为 None）"""
+        return list(self._executor.map(self._send, messages))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+# ==================== 发送 ====================
+class DeliveryStats:
+    """发送统计：events 条通知合并为 digests 封邮件；max_lag 为最早一条通知从写入到发出的秒数"""
+
+    def __init__(self):
+        self.events = 0
+        self.digests = 0
+        self.sent = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self.max_lag = 0.0
+
+    def add(self, other):
+        self.events += other.events
+        self.digests += other.digests
+        self.sent += other.sent
+        self.failed += other.failed
+        self.elapsed += other.elapsed
+        self.max_lag = max(self.max_lag, other.max_lag)
+        return self
+
+    @property
+    def per_second(self):
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.events} events -> {self.digests} digests: sent {self.sent}, failed {self.failed} "
+                f"in {self.elapsed:.2f}s ({self.per_second:.1f} emails/s), max lag {self.max_lag:.0f}s")
+
+
+def _retry_delay(attempts):
+    return min(60 * 2 ** max(attempts - 1, 0), MAX_RETRY_DELAY)
+
+
+def deliver_due(pool, limit=None, window=None):
+    """领取一批到期通知，按收件人合并为摘要邮件发送并记录结果；没有到期通知时 events 为 0"""
+    limit = limit or getattr(settings, 'NOTIFICATION_BATCH_SIZE', 100)
+    window = getattr(settings, 'NOTIFICATION_DIGEST_WINDOW', 300) if window is None else window
+    max_attempts = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 5)
+    stats = DeliveryStats()
+    started = time.perf_counter()
+    notifications = claim(limit, window)
+    if not notifications:
+        return stats
+
+    groups = {}
+    for notification in notifications:
+        groups.setdefault(notification.recipient_id, []).append(notification)
+    groups = list(groups.values())
+    errors = pool.send([digest_message(group) for group in groups])
+
+    now = timezone.now()
+    sent_ids = [n.pk for group, error in zip(groups, errors) if error is None for n in group]
+    Notification.objects.filter(pk__in=sent_ids).update(
+        status='sent', sent_at=now, attempts=F('attempts') + 1, claim_token='', claimed_until=None, last_error='')
+    for group, error in zip(groups, errors):
+        if error is None:
+            continue
+        attempts = max(n.attempts for n in group) + 1
+        logger.warning("notification digest to %s failed (attempt %s): %s", group[-1].email, attempts, error)
+        Notification.objects.filter(pk__in=[n.pk for n in group]).update(
+            status='failed' if attempts >= max_attempts else 'pending', attempts=F('attempts') + 1,
+            available_at=now + timedelta(seconds=_retry_delay(attempts)),
+            claim_token='', claimed_until=None, last_error=error[:2000])
+
+    stats.events = len(notifications)
+    stats.digests = len(groups)
+    stats.failed = sum(error is not None for error in errors)
+    stats.sent = stats.digests - stats.failed
+    stats.elapsed = time.perf_counter() - started
+    stats.max_lag = (now - min(n.created_at for n in notifications)).total_seconds()
+    return stats
+
+
+def backlog(now=None):
+    """(待发送通知数, 最早一条已等待的秒数)"""
+    now = now or timezone.now()
+    pending = Notification.objects.filter(status='pending')
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    return pending.count(), (now - oldest).total_seconds() if oldest else 0.0
+
+
+def purge_sent(days):
+    """删除 days 天前已发送的通知，返回删除条数"""
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _counts = Notification.objects.filter(status='sent', sent_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,101 @@
+"""
+询单号/订单号分配
+
+单号格式：<前缀>-<YYYYmmdd><当天序号，至少 4 位>，例如 INQ-202610180001、ORD-202610180012。
+序号按前缀、按天（本地日期）从 1 开始，由 NumberCounter 表中的计数器分配：
+
+    INSERT ... ON CONFLICT (prefix, day) DO UPDATE SET value = value + n RETURNING value
+
+一条语句完成「当天首次则建行、否则递增并取回新值」，PostgreSQL 与 SQLite（3.35+）通用，
+并发请求不会拿到相同的序号，也不需要先查询再重试。
+（PostgreSQL 的 SEQUENCE 不能按天归零，按天建序列需要每天执行 DDL，因此两种数据库都用计数器表。）
+
+计数器行在语句执行期间加锁：请在询单/订单的创建事务之外分配单号，语句自动提交，
+锁只持有一条语句的时间。创建失败时该序号作废（单号可能不连续，但不会重复）。
+
+NUMBER_BLOCK_SIZE > 1 时，每个进程一次预留一段序号、在进程内依次发放，
+突发创建时每 N 个单号才访问一次数据库；多个进程交替发放，单号不再严格按时间排序。
+"""
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import NumberCounter
+
+INQUIRY_PREFIX = 'INQ'
+ORDER_PREFIX = 'ORD'
+SEQUENCE_DIGITS = 4
+
+_UPSERT = (
+    "INSERT INTO {table} (prefix, day, value) VALUES (%s, %s, %s) "
+    "ON CONFLICT (prefix, day) DO UPDATE SET value = {table}.value + excluded.value "
+    "RETURNING value"
+)
+
+# 进程内预留的序号段：{(前缀, 日期): [下一个, 最后一个]}
+_blocks = {}
+_blocks_lock = threading.Lock()
+
+
+def _block_size():
+    return max(1, getattr(settings, 'NUMBER_BLOCK_SIZE', 1))
+
+
+def supports_upsert():
+    """数据库是否支持 INSERT ... ON CONFLICT ... RETURNING（PostgreSQL、SQLite 3.35+）"""
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def reserve(prefix, day, count=1):
+    """在数据库中为 (前缀, 日期) 预留 count 个序号，返回其中最后一个"""
+    if supports_upsert():
+        with connection.cursor() as cursor:
+            cursor.execute(_UPSERT.format(table=NumberCounter._meta.db_table), [prefix, day, count])
+            return cursor.fetchone()[0]
+    # 其它数据库：行锁 + 递增
+    with transaction.atomic():
+        NumberCounter.objects.get_or_create(prefix=prefix, day=day)
+        counter = NumberCounter.objects.select_for_update().get(prefix=prefix, day=day)
+        NumberCounter.objects.filter(pk=counter.pk).update(value=F('value') + count)
+        return counter.value + count
+
+
+def format_number(prefix, day, sequence):
+    return f"{prefix}-{day:%Y%m%d}{sequence:0{SEQUENCE_DIGITS}d}"
+
+
+def allocate(prefix):
+    """分配一个当天的单号"""
+    day = timezone.localdate()
+    key = (prefix, day)
+    with _blocks_lock:
+        block = _blocks.get(key)
+        if block is None or block[0] > block[1]:
+            size = _block_size()
+            last = reserve(prefix, day, size)
+            # 丢弃前一天未用完的序号段
+            for stale in [k for k in _blocks if k[1] != day]:
+                del _blocks[stale]
+            block = _blocks[key] = [last - size + 1, last]
+        sequence = block[0]
+        block[0] += 1
+    return format_number(prefix, day, sequence)
+
+
+def next_inquiry_number():
+    return allocate(INQUIRY_PREFIX)
+
+
+def next_order_number():
+    return allocate(ORDER_PREFIX)
+
+
+def reset_blocks():
+    """清空进程内预留的序号段（测试或修改 NUMBER_BLOCK_SIZE 后使用）"""
+    with _blocks_lock:
+        _blocks.clear()
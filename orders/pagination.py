@@ -0,0 +1,132 @@
+"""
+列表分页（keyset / 游标分页）
+
+按 (created_at, id) 倒序翻页：下一页条件为 "(created_at, id) < 游标"，只读取一页 + 1 行，
+不使用 OFFSET，也不做 COUNT，页面耗时与表的总行数无关。
+游标编码进 URL（?after=... / ?before=...），数据增删时已打开的链接仍然稳定。
+order_field 可换成其它非空时间字段（如按最近活动的 last_activity_at），需有 (字段, id) 索引。
+
+用法::
+
+    page = KeysetPage(queryset, request, prefetch=('items', 'attachments'))
+    render(..., {'inquiries': page.object_list, 'page': page})
+
+检索结果按相关度排序，无法按 (created_at, id) 翻页，改用 RankedPage：
+在检索返回的有序 id 列表（最多 SEARCH_MAX_RESULTS 条）内按页码翻页。
+
+详情页的沟通消息同样按 (created_at, id) 倒序分页：页面只渲染最新一页，
+「加载更早的消息」带上 next_cursor 请求下一页（见 views.thread_history）。
+"""
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q, prefetch_related_objects
+
+
+def encode_cursor(obj, field='created_at'):
+    raw = f'{getattr(obj, field).isoformat()}|{obj.pk}'
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value):
+    """解析游标；格式不正确时返回 None（视为第一页）"""
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode('ascii')
+        created_at, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """一页数据：object_list / has_next / has_previous / next_query / previous_query"""
+
+    def __init__(self, queryset, request, per_page=None, prefetch=(), params=None, order_field='created_at'):
+        self.per_page = per_page or getattr(settings, 'LIST_PAGE_SIZE', 25)
+        self.request = request
+        self.order_field = field = order_field
+        # params 默认取 request.GET；传入 {} 时总是第一页
+        params = request.GET if params is None else params
+        after = decode_cursor(params.get('after') or '')
+        before = None if after else decode_cursor(params.get('before') or '')
+
+        if before:
+            value, pk = before
+            qs = queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value}, pk__gt=pk))
+            rows = list(qs.order_by(field, 'id')[:self.per_page + 1])
+            self.has_previous = len(rows) > self.per_page
+            self.has_next = True
+            rows = rows[:self.per_page][::-1]
+        else:
+            if after:
+                value, pk = after
+                queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value}, pk__lt=pk))
+            rows = list(queryset.order_by('-' + field, '-id')[:self.per_page + 1])
+            self.has_next = len(rows) > self.per_page
+            self.has_previous = bool(after)
+            rows = rows[:self.per_page]
+
+        if prefetch:
+            # 只为当前页的记录预取关联数据
+            prefetch_related_objects(rows, *prefetch)
+        self.object_list = rows
+
+    def _query(self, key, obj):
+        params = self.request.GET.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        params[key] = encode_cursor(obj, self.order_field)
+        return params.urlencode()
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1], self.order_field) if self.has_next and self.object_list else ''
+
+    @property
+    def next_query(self):
+        return self._query('after', self.object_list[-1]) if self.has_next and self.object_list else ''
+
+    @property
+    def previous_query(self):
+        return self._query('before', self.object_list[0]) if self.has_previous and self.object_list else ''
+
+
+class RankedPage:
+    """检索结果分页：接口与 KeysetPage 相同，按相关度顺序翻页（?page=N）"""
+
+    def __init__(self, queryset, ranked_ids, request, per_page=None):
+        self.per_page = per_page or getattr(settings, 'LIST_PAGE_SIZE', 25)
+        self.request = request
+        try:
+            self.number = max(1, int(request.GET.get('page') or 1))
+        except ValueError:
+            self.number = 1
+        start = (self.number - 1) * self.per_page
+        # 按相关度顺序分块，用当前列表的权限范围与筛选条件过滤，凑够本页 + 1 条即停止
+        ids = []
+        chunk = max(self.per_page * 2, 100)
+        for i in range(0, len(ranked_ids), chunk):
+            block = ranked_ids[i:i + chunk]
+            visible = set(queryset.filter(pk__in=block).values_list('pk', flat=True))
+            ids.extend(pk for pk in block if pk in visible)
+            if len(ids) > start + self.per_page:
+                break
+        page_ids = ids[start:start + self.per_page]
+        objects = queryset.in_bulk(page_ids)
+        self.object_list = [objects[pk] for pk in page_ids if pk in objects]
+        self.has_previous = self.number > 1
+        self.has_next = len(ids) > start + self.per_page
+
+    def _query(self, number):
+        params = self.request.GET.copy()
+        params['page'] = number
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query(self.number + 1) if self.has_next else ''
+
+    @property
+    def previous_query(self):
+        return self._query(self.number - 1) if self.has_previous else ''
@@ -0,0 +1,270 @@
+"""
+报价：单价校验与批量报价
+
+- clean_price()：按 InquiryItem.quoted_price 的精度（10 位、2 位小数、非负）校验单价，
+  详情页提交报价时先校验全部明细，再用一次 bulk_update 写回。
+- 价格表批量报价：一张表覆盖多份询单，按「询单号 + 行号」匹配明细
+  （行号为询单内明细按创建顺序的序号，与详情页、价格表模板一致）。
+  全部行先一次校验；再按 QUOTE_BATCH_SIZE 份询单为一批，每批一个事务，
+  询单与明细各一次 bulk_update。某份询单有任何一行不匹配时整份跳过，不做部分报价；
+  某一批失败只回滚该批，其余批次照常写入。结果汇总在 QuoteReport 中。
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from . import dashboard, notifications
+from .bom import BomFormatError, read_text, read_upload
+from .exports import CONTENT_TYPES, stream_csv, stream_xlsx, unescape_formula
+from .models import Inquiry, InquiryItem
+
+# 可以报价/改价的询单状态
+QUOTABLE_STATUSES = ('pending', 'quoted')
+
+_PRICE_FIELD = InquiryItem._meta.get_field('quoted_price').formfield(min_value=0, required=False)
+
+
+def clean_price(value):
+    """校验单价，返回 Decimal；不合法时抛出 ValidationError"""
+    price = _PRICE_FIELD.clean(str(value).strip().replace(',', ''))
+    if price is None:
+        raise ValidationError(_('请输入单价'))
+    return price
+
+
+def _error_text(error):
+    return '；'.join(error.messages)
+
+
+# ==================== 单份询单报价 ====================
+def collect_item_prices(items, data):
+    """从表单 item_<id>_price 读取单价：返回 ({明细: 单价}, [错误])；空值表示不修改"""
+    prices, errors = {}, []
+    for line, item in enumerate(items, start=1):
+        raw = (data.get(f'item_{item.id}_price') or '').strip()
+        if not raw:
+            continue
+        try:
+            prices[item] = clean_price(raw)
+        except ValidationError as e:
+            errors.append(_('第 %(line)s 行 %(product)s：%(error)s') % {
+                'line': line, 'product': item.product_name, 'error': _error_text(e)})
+    return prices, errors
+
+
+def save_item_prices(prices):
+    """只写回单价有变化的明细（一次 bulk_update，汇总字段随之刷新）"""
+    changed = []
+    for item, price in prices.items():
+        if item.quoted_price != price:
+            item.quoted_price = price
+            changed.append(item)
+    if changed:
+        InquiryItem.objects.bulk_update(changed, ['quoted_price'], batch_size=500)
+    return len(changed)
+
+
+# ==================== 价格表 ====================
+SHEET_COLUMNS = {
+    'inquiry_number': ['询单号', 'inquiry', 'inquiry number', 'inquiry no', 'inquiry no.', 'rfq', 'rfq no'],
+    'line': ['行号', '序号', 'line', 'line no', 'line no.', 'item no', '#'],
+    'price': ['报价单价(usd)', '报价单价', '单价', '单价(usd)', 'price', 'unit price', 'quoted price'],
+    'lead_time': ['报工期', '交货期', 'lead time'],
+    'product_name': ['产品名称', 'product', 'product name'],
+}
+_SHEET_LOOKUP = {alias: field for field, aliases in SHEET_COLUMNS.items() for alias in aliases}
+
+TEMPLATE_HEADER = ['询单号', '行号', '产品名称', '材料名称', '材料牌号', '数量', '单位', '报价单价(USD)', '报工期']
+
+
+def price_sheet_rows(queryset):
+    """价格表模板：每条明细一行，带行号与当前报价，可直接填写后上传"""
+    rows = (InquiryItem.objects.filter(inquiry__in=queryset)
+            .order_by('-inquiry__created_at', 'inquiry_id', 'id')
+            .values_list('inquiry_id', 'inquiry__inquiry_number', 'product_name', 'material_name',
+                         'material_grade', 'quantity', 'unit', 'quoted_price', 'inquiry__quoted_lead_time')
+            .iterator(chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)))
+    current, line = None, 0
+    for inquiry_id, *values in rows:
+        line = line + 1 if inquiry_id == current else 1
+        current = inquiry_id
+        yield [values[0], line, *values[1:]]
+
+
+def price_sheet_response(queryset, fmt='csv'):
+    if fmt not in CONTENT_TYPES:
+        fmt = 'csv'
+    rows = price_sheet_rows(queryset)
+    if fmt == 'xlsx':
+        content = stream_xlsx(TEMPLATE_HEADER, rows, sheet_name='quotes')
+    else:
+        content = stream_csv(TEMPLATE_HEADER, rows)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="price-sheet-{timezone.localtime():%Y%m%d-%H%M}.{fmt}"'
+    return response
+
+
+class QuoteReport:
+    """批量报价结果：quoted = [(询单号, 改价行数)]，skipped = [(询单号, 原因)]，errors = 行级错误"""
+
+    def __init__(self):
+        self.quoted = []
+        self.skipped = []
+        self.errors = []
+
+    @property
+    def line_count(self):
+        return sum(lines for _number, lines in self.quoted)
+
+
+def parse_price_sheet(rows, report):
+    """一次校验全部行：返回 {询单号: {'lines': {行号: (单价, 表格行号, 产品名称)}, 'lead_time': str}}
+
+    有无效行（单价、行号不合法或重复）的询单带 'invalid': True，应用时整份跳过。
+    """
+    header = rows[0] if rows else []
+    mapping = {}
+    for index, cell in enumerate(header):
+        field = _SHEET_LOOKUP.get(str(cell).strip().lower())
+        if field and field not in mapping:
+            mapping[field] = index
+    missing = [SHEET_COLUMNS[f][0] for f in ('inquiry_number', 'line', 'price') if f not in mapping]
+    if missing:
+        report.errors.append(_('第 1 行：缺少列 %(columns)s') % {'columns': '、'.join(missing)})
+        return {}
+
+    entries = {}
+    for row_number, row in enumerate(rows[1:], start=2):
+        # 价格表由本系统导出，以公式前缀开头的单元格带有 '
+        values = {field: (unescape_formula(str(row[index]).strip()) if index < len(row) else '')
+                  for field, index in mapping.items()}
+        number, line, raw_price = values['inquiry_number'], values['line'], values['price']
+        if not raw_price:
+            # 未填写单价的行不处理（模板中尚未报价的明细）
+            continue
+        problems = []
+        if not number:
+            problems.append(_('缺少询单号'))
+        try:
+            value = float(line)
+            if value < 1 or not value.is_integer():
+                raise ValueError
+            line = int(value)
+        except ValueError:
+            problems.append(_('行号“%(value)s”无效') % {'value': line})
+        try:
+            price = clean_price(raw_price)
+        except ValidationError as e:
+            problems.append(_('单价“%(value)s”无效：%(error)s') % {'value': raw_price, 'error': _error_text(e)})
+        if not problems:
+            entry = entries.setdefault(number, {'lines': {}, 'lead_time': ''})
+            if line in entry['lines']:
+                problems.append(_('与第 %(row)s 行重复') % {'row': entry['lines'][line][1]})
+            else:
+                entry['lines'][line] = (price, row_number, values.get('product_name', ''))
+                entry['lead_time'] = values.get('lead_time') or entry['lead_time']
+        if problems:
+            report.errors.append(_('第 %(row)s 行：%(problems)s') % {'row': row_number, 'problems': '；'.join(problems)})
+            if number:
+                # 有无效行的询单整份跳过，不做部分报价
+                entries.setdefault(number, {'lines': {}, 'lead_time': ''})['invalid'] = True
+    return entries
+
+
+def _apply_batch(numbers, entries, user):
+    """一批询单在一个事务内报价：返回 (已报价, 跳过, 行级错误)"""
+    now = timezone.now()
+    inquiries = {
+        inquiry.inquiry_number: inquiry
+        for inquiry in Inquiry.objects.select_for_update().filter(inquiry_number__in=numbers)
+    }
+    items = {}
+    for item in (InquiryItem.objects.filter(inquiry__in=list(inquiries.values()))
+                 .order_by('inquiry_id', 'id').only('id', 'inquiry_id', 'product_name', 'quoted_price')):
+        items.setdefault(item.inquiry_id, []).append(item)
+
+    quoted, changed_items, results, skipped, errors = [], [], [], [], []
+    for number in numbers:
+        inquiry = inquiries.get(number)
+        if inquiry is None:
+            skipped.append((number, _('询单不存在')))
+            continue
+        if inquiry.status not in QUOTABLE_STATUSES:
+            skipped.append((number, _('状态为“%(status)s”，不能报价') % {'status': inquiry.get_status_display()}))
+            continue
+        if inquiry.quoted_by_id and inquiry.quoted_by_id != user.id:
+            skipped.append((number, _('已由其他销售负责')))
+            continue
+        if entries[number].get('invalid'):
+            skipped.append((number, _('价格表中有无效的行')))
+            continue
+        lines = items.get(inquiry.id, [])
+        problems, changed = [], []
+        for line, (price, row_number, product_name) in sorted(entries[number]['lines'].items()):
+            if line > len(lines):
+                problems.append(_('第 %(row)s 行：询单只有 %(count)s 条明细') % {'row': row_number, 'count': len(lines)})
+                continue
+            item = lines[line - 1]
+            if product_name and product_name.casefold() != item.product_name.strip().casefold():
+                problems.append(_('第 %(row)s 行：产品名称与询单第 %(line)s 行“%(product)s”不一致') % {
+                    'row': row_number, 'line': line, 'product': item.product_name})
+                continue
+            if item.quoted_price != price:
+                item.quoted_price = price
+                changed.append(item)
+        if problems:
+            errors.extend(problems)
+            skipped.append((number, _('价格表中有不匹配的行')))
+            continue
+        inquiry.status = 'quoted'
+        inquiry.quoted_at = now
+        inquiry.quoted_by_id = inquiry.quoted_by_id or user.id
+        inquiry.quoted_lead_time = entries[number]['lead_time'] or inquiry.quoted_lead_time
+        inquiry.updated_at = now
+        quoted.append(inquiry)
+        changed_items.extend(changed)
+        results.append((number, len(changed)))
+
+    if changed_items:
+        InquiryItem.objects.bulk_update(changed_items, ['quoted_price'], batch_size=500)
+    if quoted:
+        Inquiry.objects.bulk_update(quoted, ['status', 'quoted_at', 'quoted_by', 'quoted_lead_time', 'updated_at'])
+        # bulk_update 不触发 post_save，状态变化需手动清除仪表板缓存
+        dashboard.invalidate_stats(dashboard.contact_company_ids({i.contact_id for i in quoted}))
+        notifications.inquiries_quoted(quoted)
+    return results, skipped, errors
+
+
+def apply_price_sheet(entries, user, report, batch_size=None):
+    """按批写入报价；每批一个事务，失败的批次整体回滚并记入 skipped"""
+    batch_size = batch_size or getattr(settings, 'QUOTE_BATCH_SIZE', 50)
+    numbers = sorted(entries)
+    for i in range(0, len(numbers), batch_size):
+        batch = numbers[i:i + batch_size]
+        try:
+            with transaction.atomic():
+                quoted, skipped, errors = _apply_batch(batch, entries, user)
+        except Exception as e:
+            report.skipped.extend((number, _('写入失败：%(error)s') % {'error': e}) for number in batch)
+            continue
+        report.quoted.extend(quoted)
+        report.skipped.extend(skipped)
+        report.errors.extend(errors)
+    return report
+
+
+def import_price_sheet(user, uploaded=None, text=''):
+    """解析并应用价格表，返回 QuoteReport"""
+    report = QuoteReport()
+    try:
+        rows = read_upload(uploaded) if uploaded else read_text(text)
+    except BomFormatError as e:
+        report.errors.append(str(e))
+        return report
+    entries = parse_price_sheet(rows, report)
+    if entries:
+        apply_price_sheet(entries, user, report)
+    return report
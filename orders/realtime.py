@@ -0,0 +1,363 @@
+"""
+询单/订单沟通消息的实时推送
+
+详情页不再整页刷新：新消息与附件以事件推送到页面，页面只追加新内容。
+
+- WebSocket：ws(s)://<host>/ws/threads/<inquiry|order>/<id>/?after=<消息id>
+  由 trade_project/asgi.py 分发到 websocket_application()（需以 ASGI 方式运行）。
+- SSE（回退）：GET /api/threads/<kind>/<id>/events/，断线重连时浏览器自动带上 Last-Event-ID。
+- 增量接口：GET /api/threads/<kind>/<id>/messages/?after=<消息id>，返回该 id 之后的消息（JSON）。
+
+长连接只在 ASGI 下提供（见 push_available）：WSGI 下每个连接都会占住一个工作进程，
+事件流接口返回 404，页面改为每隔 REALTIME_POLL_SECONDS 秒请求一次增量接口。
+
+事件在事务提交后经 broker 扇出：默认的 InProcessBroker 只在本进程内分发；
+多进程部署可通过 REALTIME_BROKER 指定实现了 subscribe(channel, callback) / publish(channel, event) 的类。
+连接每隔 REALTIME_RECHECK_SECONDS 秒还会查一次数据库补发遗漏的消息（同时作为心跳），
+因此即使发布者在其它进程，消息也只会延迟、不会丢失。
+
+事件格式：{"type": "message", "message": {...}} 或 {"type": "attachment", "attachment": {...}}
+"""
+import asyncio
+import json
+import re
+import threading
+from collections import defaultdict
+from functools import partial
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .activity import THREADS
+from .attachments import prefetch_file_urls
+from .models import Contact, Message
+from .thumbnails import thumbnail_name
+
+WS_PATH = re.compile(r'^/ws/threads/(?P<kind>inquiry|order)/(?P<pk>\d+)/$')
+
+
+def channel_name(kind, pk):
+    return f'thread:{kind}:{pk}'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def push_available(request):
+    """WebSocket/SSE 推送只在 ASGI 下提供；WSGI 下由页面短轮询增量接口"""
+    return isinstance(request, ASGIRequest)
+
+
+def live_options(request):
+    """详情页 thread_live_js 的配置：push 为 False 时按 poll_seconds 轮询增量接口"""
+    return {'push': push_available(request), 'poll_seconds': _setting('REALTIME_POLL_SECONDS', 5)}
+
+
+# ==================== Broker ====================
+class InProcessBroker:
+    """进程内扇出：publish 在调用线程中依次执行订阅回调（回调需线程安全且不阻塞）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, channel, callback):
+        """订阅频道，返回取消订阅的函数"""
+        with self._lock:
+            self._subscribers[channel].add(callback)
+        return partial(self._unsubscribe, channel, callback)
+
+    def _unsubscribe(self, channel, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(channel)
+            if callbacks:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self._subscribers[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        for callback in callbacks:
+            callback(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(_setting('REALTIME_BROKER', 'orders.realtime.InProcessBroker'))()
+    return _broker
+
+
+# ==================== 事件内容 ====================
+def _file_payload(fieldfile):
+    thumb = thumbnail_name(fieldfile.name)
+    return {
+        'url': fieldfile.url,
+        'thumbnail': fieldfile.storage.url(thumb) if thumb else '',
+    }
+
+
+def message_payload(msg):
+    return {
+        'id': msg.pk,
+        'sender': msg.sender.username,
+        'sender_id': msg.sender_id,
+        'content': msg.content,
+        'created_at': msg.created_at,
+        'created_display': timezone.localtime(msg.created_at).strftime('%Y-%m-%d %H:%M'),
+        'attachments': [
+            {'id': att.pk, 'name': att.file_name, 'size': att.file_size, **_file_payload(att.file)}
+            for att in msg.attachments.all()
+        ],
+    }
+
+
+def attachment_payload(attachment):
+    return {
+        'id': attachment.pk,
+        'name': attachment.file_name,
+        'size': attachment.file_size,
+        'description': attachment.description,
+        'uploaded_at': attachment.uploaded_at,
+        **_file_payload(attachment.file),
+    }
+
+
+def _prefetch_urls(messages):
+    names = [att.file.name for msg in messages for att in msg.attachments.all()]
+    prefetch_file_urls(names + [thumbnail_name(name) for name in names])
+
+
+def messages_since(kind, pk, after=0, limit=None):
+    """会话中 id 大于 after 的消息（按 id 升序）"""
+    limit = limit or _setting('REALTIME_CATCHUP_LIMIT', 100)
+    msgs = list(Message.objects.filter(**{kind: pk}, pk__gt=after)
+                .select_related('sender').prefetch_related('attachments').order_by('pk')[:limit])
+    _prefetch_urls(msgs)
+    return [message_payload(msg) for msg in msgs]
+
+
+def message_data(message_id):
+    """单条消息的事件内容；返回 (kind, 询单/订单 id, 内容)，消息不存在时返回 None"""
+    msg = Message.objects.select_related('sender').prefetch_related('attachments').filter(pk=message_id).first()
+    if msg is None:
+        return None
+    _prefetch_urls([msg])
+    kind, pk = ('inquiry', msg.inquiry_id) if msg.inquiry_id else ('order', msg.order_id)
+    return kind, pk, message_payload(msg)
+
+
+# ==================== 发布（事务提交后） ====================
+def publish_message(message_id):
+    data = message_data(message_id)
+    if data is not None:
+        kind, pk, payload = data
+        get_broker().publish(channel_name(kind, pk), {'type': 'message', 'message': payload})
+
+
+def publish_attachment(kind, attachment):
+    parent_id = getattr(attachment, kind + '_id')
+    get_broker().publish(channel_name(kind, parent_id), {'type': 'attachment', 'attachment': attachment_payload(attachment)})
+
+
+def message_created(message_id):
+    transaction.on_commit(partial(publish_message, message_id))
+
+
+def attachments_created(kind, attachments):
+    for attachment in attachments:
+        transaction.on_commit(partial(publish_attachment, kind, attachment))
+
+
+# ==================== 权限 ====================
+def thread_visible(kind, pk, contact_id, role):
+    """买家只能看自己的询单/订单，供应商可看全部（与详情页一致）"""
+    model = THREADS.get(kind)
+    if model is None or contact_id is None:
+        return False
+    qs = model.objects.filter(pk=pk)
+    if role != 'supplier':
+        qs = qs.filter(contact_id=contact_id)
+    return qs.exists()
+
+
+def _session_user(cookie_header):
+    cookies = SimpleCookie()
+    try:
+        cookies.load(cookie_header)
+    except Exception:
+        return None
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = get_user(SimpleNamespace(session=session))
+    return user if user.is_authenticated else None
+
+
+def _authorize(cookie_header, kind, pk):
+    close_old_connections()
+    try:
+        user = _session_user(cookie_header)
+        contact = user and Contact.objects.filter(user=user).values('id', 'role').first()
+        return bool(contact) and thread_visible(kind, pk, contact['id'], contact['role'])
+    finally:
+        close_old_connections()
+
+
+def _db(fn):
+    """异步上下文中执行数据库操作（执行前后清理过期连接）"""
+    def run(*args):
+        close_old_connections()
+        try:
+            return fn(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run)
+
+
+# ==================== 事件流 ====================
+class _Cursor:
+    """记录已发送的消息，避免推送与补发重复"""
+
+    def __init__(self, after):
+        self.last = after
+        self.sent = set()
+
+    def accept(self, event):
+        if event['type'] != 'message':
+            return True
+        msg_id = event['message']['id']
+        if msg_id in self.sent:
+            return False
+        self.sent.add(msg_id)
+        self.last = max(self.last, msg_id)
+        return True
+
+
+def _async_subscription(kind, pk):
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue(maxsize=_setting('REALTIME_QUEUE_SIZE', 100))
+
+    def deliver(event):
+        # 队列满时丢弃：客户端会在下一次数据库补发中拿到遗漏的消息
+        loop.call_soon_threadsafe(lambda: events.full() or events.put_nowait(event))
+
+    return events, get_broker().subscribe(channel_name(kind, pk), deliver)
+
+
+def sse_format(event):
+    data = json.dumps(event, cls=DjangoJSONEncoder, ensure_ascii=False)
+    event_id = f"id: {event['message']['id']}\n" if event['type'] == 'message' else ''
+    return f"{event_id}event: {event['type']}\ndata: {data}\n\n"
+
+
+async def sse_stream(kind, pk, after):
+    """ASGI：长连接事件流"""
+    recheck = _setting('REALTIME_RECHECK_SECONDS', 15)
+    cursor = _Cursor(after)
+    events, unsubscribe = _async_subscription(kind, pk)
+    try:
+        yield 'retry: 3000\n\n'
+        for payload in await _db(messages_since)(kind, pk, cursor.last):
+            if cursor.accept(event := {'type': 'message', 'message': payload}):
+                yield sse_format(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=recheck)
+            except asyncio.TimeoutError:
+                missed = await _db(messages_since)(kind, pk, cursor.last)
+                for payload in missed:
+                    if cursor.accept(event := {'type': 'message', 'message': payload}):
+                        yield sse_format(event)
+                if not missed:
+                    yield ': ping\n\n'
+                continue
+            if cursor.accept(event):
+                yield sse_format(event)
+    finally:
+        unsubscribe()
+
+
+# ==================== WebSocket（ASGI） ====================
+def _origin_allowed(headers):
+    """拒绝跨站 WebSocket：Origin 必须与 Host 相同或在 CSRF_TRUSTED_ORIGINS 中"""
+    origin = headers.get('origin')
+    if not origin:
+        return True
+    if origin in getattr(settings, 'CSRF_TRUSTED_ORIGINS', []):
+        return True
+    return urlsplit(origin).netloc == headers.get('host')
+
+
+async def websocket_application(scope, receive, send):
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    match = WS_PATH.match(scope['path'])
+    if not match:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    kind, pk = match['kind'], int(match['pk'])
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope.get('headers', [])}
+    if not _origin_allowed(headers) or not await sync_to_async(_authorize)(headers.get('cookie', ''), kind, pk):
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    try:
+        after = int(parse_qs(scope.get('query_string', b'').decode()).get('after', ['0'])[0])
+    except ValueError:
+        after = 0
+
+    async def send_event(event):
+        await send({'type': 'websocket.send', 'text': json.dumps(event, cls=DjangoJSONEncoder, ensure_ascii=False)})
+
+    recheck = _setting('REALTIME_RECHECK_SECONDS', 15)
+    cursor = _Cursor(after)
+    events, unsubscribe = _async_subscription(kind, pk)
+    await send({'type': 'websocket.accept'})
+    receiver = asyncio.ensure_future(receive())
+    try:
+        for payload in await _db(messages_since)(kind, pk, cursor.last):
+            if cursor.accept(event := {'type': 'message', 'message': payload}):
+                await send_event(event)
+        while True:
+            getter = asyncio.ensure_future(events.get())
+            done, _pending = await asyncio.wait({receiver, getter}, timeout=recheck,
+                                                return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+            if receiver in done:
+                if receiver.result()['type'] == 'websocket.disconnect':
+                    break
+                # 客户端发来的内容（心跳等）忽略
+                receiver = asyncio.ensure_future(receive())
+            if getter in done:
+                if cursor.accept(event := getter.result()):
+                    await send_event(event)
+            elif not done:
+                missed = await _db(messages_since)(kind, pk, cursor.last)
+                for payload in missed:
+                    if cursor.accept(event := {'type': 'message', 'message': payload}):
+                        await send_event(event)
+                if not missed:
+                    await send_event({'type': 'ping'})
+    finally:
+        unsubscribe()
+        receiver.cancel()
@@ -0,0 +1,216 @@
+"""
+询单/订单全文检索
+
+每个询单/订单在 SearchEntry 表中有一条检索文档：单号、客户订单号、公司名、联系人、备注，
+以及所有明细的产品名称、材料名称、牌号、技术规格。文档在询单/订单、明细或公司变更时
+于同一事务内增量重建（见 signals.py 与 Inquiry/Order.refresh_summaries）。
+
+- PostgreSQL：document 上有生成列 search_vector（to_tsvector('simple', ...)）及 GIN 索引，
+  另有 pg_trgm 的 GIN trigram 索引，ILIKE 子串匹配（含中文）同样走索引；
+  排序 = ts_rank + similarity。
+- SQLite：同步到 FTS5 影子表（trigram 分词器，支持中文子串），按 bm25 排序；
+  少于 3 个字符的词无法用 trigram 匹配，退化为 LIKE 条件。
+- 其它数据库或 FTS5 不可用时，退化为 document 上的 LIKE。
+
+结果限定在列表的权限范围与筛选条件内，最多返回 SEARCH_MAX_RESULTS 条，按相关度排序；
+导出使用不限条数的子查询（matching）。
+"""
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'orders_searchentry_fts'
+
+SQLITE_SETUP = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"document, content='orders_searchentry', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS orders_searchentry_ai AFTER INSERT ON orders_searchentry BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.id, new.document); END",
+    f"CREATE TRIGGER IF NOT EXISTS orders_searchentry_ad AFTER DELETE ON orders_searchentry BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.id, old.document); END",
+    f"CREATE TRIGGER IF NOT EXISTS orders_searchentry_au AFTER UPDATE ON orders_searchentry BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.id, old.document); "
+    f"INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.id, new.document); END",
+]
+
+SQLITE_TEARDOWN = [
+    "DROP TRIGGER IF EXISTS orders_searchentry_ai",
+    "DROP TRIGGER IF EXISTS orders_searchentry_ad",
+    "DROP TRIGGER IF EXISTS orders_searchentry_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE orders_searchentry ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('simple', document)) STORED",
+    "CREATE INDEX IF NOT EXISTS orders_searchentry_vector_idx ON orders_searchentry USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS orders_searchentry_trgm_idx ON orders_searchentry USING GIN (document gin_trgm_ops)",
+]
+
+POSTGRES_TEARDOWN = [
+    "DROP INDEX IF EXISTS orders_searchentry_trgm_idx",
+    "DROP INDEX IF EXISTS orders_searchentry_vector_idx",
+    "ALTER TABLE orders_searchentry DROP COLUMN IF EXISTS search_vector",
+]
+
+
+# ==================== 检索文档 ====================
+def _join(values):
+    return '\n'.join(str(v) for v in values if v)
+
+
+def inquiry_documents(ids, apps=global_apps):
+    Inquiry = apps.get_model('orders', 'Inquiry')
+    InquiryItem = apps.get_model('orders', 'InquiryItem')
+    docs = {
+        row[0]: list(row[1:]) for row in Inquiry.objects.filter(pk__in=ids).values_list(
+            'pk', 'inquiry_number', 'contact__company__company_name', 'contact__name',
+            'delivery_requirement', 'customer_notes', 'supplier_notes')
+    }
+    for row in InquiryItem.objects.filter(inquiry_id__in=docs).values_list(
+            'inquiry_id', 'product_name', 'material_name', 'material_grade', 'specifications'):
+        docs[row[0]].extend(row[1:])
+    return {pk: _join(parts) for pk, parts in docs.items()}
+
+
+def order_documents(ids, apps=global_apps):
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    docs = {
+        row[0]: list(row[1:]) for row in Order.objects.filter(pk__in=ids).values_list(
+            'pk', 'order_number', 'customer_order_number', 'contact__company__company_name', 'contact__name',
+            'customer_notes', 'supplier_notes')
+    }
+    for row in OrderItem.objects.filter(order_id__in=docs).values_list(
+            'order_id', 'product_name', 'material_name', 'material_grade', 'specifications'):
+        docs[row[0]].extend(row[1:])
+    return {pk: _join(parts) for pk, parts in docs.items()}
+
+
+DOCUMENT_BUILDERS = {
+    'inquiry': inquiry_documents,
+    'order': order_documents,
+}
+
+
+def reindex(kind, ids, apps=global_apps, batch_size=500):
+    """重建指定对象的检索文档；已删除的对象同时移除其文档。返回重建的文档数"""
+    ids = sorted({pk for pk in ids if pk is not None})
+    SearchEntry = apps.get_model('orders', 'SearchEntry')
+    count = 0
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        docs = DOCUMENT_BUILDERS[kind](batch, apps=apps)
+        with transaction.atomic(savepoint=False):
+            SearchEntry.objects.filter(kind=kind, object_id__in=batch).delete()
+            SearchEntry.objects.bulk_create([
+                SearchEntry(kind=kind, object_id=pk, document=doc) for pk, doc in docs.items()
+            ])
+        count += len(docs)
+    return count
+
+
+def reindex_all(kind, apps=global_apps):
+    model = apps.get_model('orders', 'Inquiry' if kind == 'inquiry' else 'Order')
+    return reindex(kind, model.objects.values_list('pk', flat=True), apps=apps)
+
+
+def remove(kind, ids):
+    SearchEntry = global_apps.get_model('orders', 'SearchEntry')
+    SearchEntry.objects.filter(kind=kind, object_id__in=ids).delete()
+
+
+# ==================== 数据库索引（迁移中调用） ====================
+def install_backend_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    statements = {'postgresql': POSTGRES_SETUP, 'sqlite': SQLITE_SETUP}.get(vendor, [])
+    for sql in statements:
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                schema_editor.execute(sql)
+        except Exception:
+            # FTS5/trigram 不可用（旧版 SQLite）时跳过，检索退化为 LIKE
+            if vendor != 'sqlite':
+                raise
+            break
+
+
+def remove_backend_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in {'postgresql': POSTGRES_TEARDOWN, 'sqlite': SQLITE_TEARDOWN}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+# ==================== 查询 ====================
+def _like_pattern(term):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _fts_available(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+    return cursor.fetchone() is not None
+
+
+def _match_sql(kind, terms):
+    """匹配条件：(FROM ... WHERE 子句, 参数, 相关度排序表达式, 排序参数)；没有相关度时排序为空"""
+    if connection.vendor == 'postgresql':
+        q = ' '.join(terms)
+        return ("FROM orders_searchentry e WHERE e.kind = %s "
+                "AND (e.search_vector @@ websearch_to_tsquery('simple', %s) OR e.document ILIKE %s)",
+                [kind, q, _like_pattern(q)],
+                "ts_rank(e.search_vector, websearch_to_tsquery('simple', %s)) + similarity(e.document, %s) DESC",
+                [q, q])
+    if connection.vendor == 'sqlite':
+        long_terms = [t for t in terms if len(t) >= 3]
+        if long_terms:
+            with connection.cursor() as cursor:
+                fts = _fts_available(cursor)
+            if fts:
+                # trigram 无法匹配少于 3 个字符的词，这些词用 LIKE 条件
+                short_terms = [t for t in terms if len(t) < 3]
+                like_sql = ''.join(" AND e.document LIKE %s ESCAPE '\\'" for _ in short_terms)
+                match = ' '.join('"%s"' % t.replace('"', '""') for t in long_terms)
+                return (f"FROM {FTS_TABLE} f JOIN orders_searchentry e ON e.id = f.rowid "
+                        f"WHERE {FTS_TABLE} MATCH %s AND e.kind = %s{like_sql}",
+                        [match, kind, *[_like_pattern(t) for t in short_terms]],
+                        f"bm25({FTS_TABLE})", [])
+    like_sql = ''.join(" AND e.document LIKE %s ESCAPE '\\'" for _ in terms)
+    return f"FROM orders_searchentry e WHERE e.kind = %s{like_sql}", [kind, *[_like_pattern(t) for t in terms]], '', []
+
+
+def _scoped(sql, params, scope):
+    """把列表的权限范围与筛选条件（询单/订单 queryset）作为子查询加入检索条件"""
+    if scope is None:
+        return sql, params
+    scope_sql, scope_params = scope.order_by().values('pk').query.sql_with_params()
+    return f"{sql} AND e.object_id IN ({scope_sql})", [*params, *scope_params]
+
+
+def search_ids(kind, q, scope=None, limit=None):
+    """检索询单/订单，返回按相关度排序的 id 列表
+
+    scope 为当前用户可见、已按状态等筛选的 queryset：条数上限在范围内计算，
+    不会因为其他公司的匹配结果占满上限而漏掉自己的询单/订单。
+    """
+    terms = q.split()
+    if not terms:
+        return []
+    limit = limit or getattr(settings, 'SEARCH_MAX_RESULTS', 500)
+    sql, params, rank, rank_params = _match_sql(kind, terms)
+    sql, params = _scoped(sql, params, scope)
+    order = f"{rank}, e.object_id DESC" if rank else "e.object_id DESC"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT e.object_id {sql} ORDER BY {order} LIMIT %s", [*params, *rank_params, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def matching(kind, q):
+    """全部匹配的 id 子查询（不排序、不限条数），用于 queryset.filter(pk__in=...)，如导出"""
+    terms = q.split()
+    if not terms:
+        return RawSQL("SELECT NULL WHERE 1 = 0", [])
+    sql, params, _rank, _rank_params = _match_sql(kind, terms)
+    return RawSQL(f"SELECT e.object_id {sql}", params)
@@ -0,0 +1,150 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import activity, dashboard, notifications, realtime, search
+from .middleware import invalidate_contact_info
+from .models import (Company, Contact, Inquiry, InquiryItem, InquiryAttachment, Order, OrderItem,
+                     OrderAttachment, Message, MessageAttachment)
+from .thumbnails import schedule_thumbnails
+
+
+# ==================== 缩略图 ====================
+# 逐条 save() 的入口（管理后台、付款凭证等）；批量上传由 AttachmentUploadBatch 负责
+@receiver(post_save, sender=InquiryAttachment)
+@receiver(post_save, sender=OrderAttachment)
+@receiver(post_save, sender=MessageAttachment)
+def attachment_thumbnail(sender, instance, **kwargs):
+    if instance.file:
+        schedule_thumbnails([instance.file.name])
+
+
+@receiver(post_save, sender=InquiryItem)
+@receiver(post_save, sender=OrderItem)
+def drawing_thumbnail(sender, instance, **kwargs):
+    if instance.drawing_file:
+        schedule_thumbnails([instance.drawing_file.name])
+
+
+# ==================== 检索文档 ====================
+# 明细变更由 Inquiry/Order.refresh_summaries 重建；这里处理询单/订单本身以及公司名、联系人姓名的变更
+@receiver(post_save, sender=Inquiry)
+def inquiry_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.reindex('inquiry', [instance.pk])
+
+
+@receiver(post_save, sender=Order)
+def order_search_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.reindex('order', [instance.pk])
+
+
+@receiver(post_delete, sender=Inquiry)
+def inquiry_search_remove(sender, instance, **kwargs):
+    search.remove('inquiry', [instance.pk])
+
+
+@receiver(post_delete, sender=Order)
+def order_search_remove(sender, instance, **kwargs):
+    search.remove('order', [instance.pk])
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Contact)
+def owner_search_documents(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+    owner = {'contact__company': instance} if sender is Company else {'contact': instance}
+    search.reindex('inquiry', Inquiry.objects.filter(**owner).values_list('pk', flat=True))
+    search.reindex('order', Order.objects.filter(**owner).values_list('pk', flat=True))
+
+
+# ==================== 仪表板统计缓存 ====================
+# 只在新建、删除、状态或所属联系人变化时失效；直接 QuerySet.update(status=...) 的地方需自行调用
+# dashboard.invalidate_stats
+def _dashboard_state(instance):
+    # 读 __dict__，避免 only()/defer() 加载的实例在这里触发额外查询
+    return instance.__dict__.get('status'), instance.__dict__.get('contact_id')
+
+
+@receiver(post_init, sender=Inquiry)
+@receiver(post_init, sender=Order)
+def remember_dashboard_state(sender, instance, **kwargs):
+    instance._dashboard_state = _dashboard_state(instance)
+
+
+@receiver(post_save, sender=Inquiry)
+@receiver(post_save, sender=Order)
+def dashboard_stats_on_save(sender, instance, created=False, **kwargs):
+    old_status, old_contact = instance._dashboard_state
+    state = _dashboard_state(instance)
+    instance._dashboard_state = state
+    if created or state != (old_status, old_contact):
+        dashboard.invalidate_stats(dashboard.contact_company_ids({old_contact, instance.contact_id}))
+
+
+@receiver(pre_delete, sender=Inquiry)
+@receiver(pre_delete, sender=Order)
+def remember_dashboard_company(sender, instance, **kwargs):
+    # 删除后无法再加载延迟字段，先记下所属公司
+    instance._dashboard_companies = dashboard.contact_company_ids({instance.contact_id})
+
+
+@receiver(post_delete, sender=Inquiry)
+@receiver(post_delete, sender=Order)
+def dashboard_stats_on_delete(sender, instance, **kwargs):
+    dashboard.invalidate_stats(getattr(instance, '_dashboard_companies', ()))
+
+
+# ==================== session 联系人信息 ====================
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def contact_info_version(sender, instance, **kwargs):
+    invalidate_contact_info(instance.user_id)
+
+
+# ==================== 会话活动 ====================
+# 新消息递增消息数与最近活动时间；删除消息时按消息表重算
+@receiver(post_save, sender=Inquiry)
+@receiver(post_save, sender=Order)
+def thread_created_activity(sender, instance, created=False, raw=False, **kwargs):
+    # 新建会话的最近活动时间即创建时间（默认值与 auto_now_add 分别取时间，相差几微秒）
+    if created and not raw and instance.last_activity_at != instance.created_at:
+        sender.objects.filter(pk=instance.pk).update(last_activity_at=instance.created_at)
+        instance.last_activity_at = instance.created_at
+
+
+@receiver(post_save, sender=Message)
+def message_activity(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        activity.record_message(instance)
+
+
+@receiver(post_save, sender=Message)
+def message_notification(sender, instance, created=False, raw=False, **kwargs):
+    # 与消息在同一事务中写入发件箱，由 send_notifications 合并发送
+    if created and not raw and (instance.inquiry_id or instance.order_id):
+        notifications.new_message(instance)
+
+
+@receiver(post_delete, sender=Message)
+def message_activity_on_delete(sender, instance, **kwargs):
+    kind, pk = activity.message_thread(instance)
+    if pk is not None:
+        activity.THREADS[kind].refresh_activity([pk])
+
+
+# ==================== 实时推送 ====================
+# 事务提交后推送：消息事件在提交时才组装内容，同一事务中批量写入的消息附件也包含在内。
+# bulk_create 的询单/订单附件不触发 post_save，由调用方调用 realtime.attachments_created
+@receiver(post_save, sender=Message)
+def message_push(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        realtime.message_created(instance.pk)
+
+
+@receiver(post_save, sender=InquiryAttachment)
+@receiver(post_save, sender=OrderAttachment)
+def attachment_push(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        realtime.attachments_created(sender.summary_parent, [instance])
@@ -0,0 +1,145 @@
+"""
+本地 SMTP 接收端（开发、测试与压测用）
+
+接受任何发件人/收件人的邮件，保存在内存中，不做投递。实现 SMTP 的最小子集
+（EHLO/HELO、MAIL、RCPT、DATA、RSET、NOOP、QUIT），不支持 STARTTLS 与认证，
+EMAIL_USE_TLS 需关闭。delay 可模拟服务器处理每封邮件的耗时。
+
+    with SmtpSink() as sink:
+        with override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=sink.port, ...):
+            ...
+        sink.messages  # [ReceivedMail]
+
+也可用 `python manage.py smtp_sink` 在前台运行，查看发出的邮件。
+"""
+import socketserver
+import threading
+import time
+from collections import namedtuple
+from email import message_from_bytes, policy
+
+ReceivedMail = namedtuple('ReceivedMail', 'mail_from recipients message')
+
+
+def _address(argument):
+    """'FROM:<a@b> SIZE=1' -> 'a@b'"""
+    value = argument.split(':', 1)[-1].strip()
+    if value.startswith('<'):
+        value = value[1:].split('>', 1)[0]
+    return value.split(' ', 1)[0]
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b'.\r\n', b'.\n'):
+                return b''.join(lines)
+            # 去掉透明转义的前导点
+            lines.append(line[1:] if line.startswith(b'..') else line)
+
+    def handle(self):
+        sink = self.server.sink
+        sink._opened()
+        self.reply('220 smtp-sink ready')
+        mail_from, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb, _, argument = command.partition(' ')
+            verb = verb.upper()
+            if verb == 'EHLO':
+                self.wfile.write(b'250-smtp-sink\r\n250-8BITMIME\r\n250 PIPELINING\r\n')
+            elif verb == 'HELO':
+                self.reply('250 smtp-sink')
+            elif verb == 'MAIL':
+                mail_from, recipients = _address(argument), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                if mail_from is None:
+                    self.reply('503 need MAIL first')
+                    continue
+                recipients.append(_address(argument))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply('503 need RCPT first')
+                    continue
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                data = self.read_data()
+                if sink.delay:
+                    time.sleep(sink.delay)
+                sink._received(ReceivedMail(mail_from, recipients, message_from_bytes(data, policy=policy.default)))
+                mail_from, recipients = None, []
+                self.reply('250 OK queued')
+            elif verb == 'RSET':
+                mail_from, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 command not implemented')
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink:
+    """在后台线程中运行的 SMTP 接收端；port=0 时由系统分配端口（见 .port）"""
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, on_message=None):
+        self.host = host
+        self.delay = delay
+        self.on_message = on_message
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _opened(self):
+        with self._lock:
+            self.connections += 1
+
+    def _received(self, mail):
+        with self._lock:
+            self.messages.append(mail)
+        if self.on_message:
+            self.on_message(mail)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def serve_forever(self):
+        """在当前线程运行（管理命令）"""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
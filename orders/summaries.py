@@ -0,0 +1,162 @@
+"""
+询单/订单汇总字段（item_count / attachment_count / total_amount）及会话活动字段
+（message_count / last_message_at / last_activity_at）
+
+汇总值由明细表与附件表计算，用一条带关联子查询的 UPDATE 写回父表。
+明细/附件的 save()、delete() 以及 QuerySet 的 bulk_create / bulk_update / update / delete
+都会在同一事务内刷新所属询单/订单（不经过 ORM 的写入见 SummaryQuerySet）；
+全量重建与校验使用 `python manage.py rebuild_summaries`。
+
+会话活动字段在新消息写入时递增更新（见 activity.py），删除消息或全量重建时用
+thread_activity_values() 按消息表重算。询单/订单自身的 save() 不写回这两组字段（SummaryParentMixin）。
+
+这里的函数只接收模型类作为参数，不导入 orders.models，数据迁移中也可以直接使用。
+"""
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+
+AMOUNT_FIELD = models.DecimalField(max_digits=14, decimal_places=2)
+
+
+def _aggregate(model, fk, aggregate, output_field, **filters):
+    """按父对象聚合的关联子查询；没有子记录时为 0"""
+    qs = (model._base_manager.filter(**{fk: OuterRef('pk')}, **filters)
+          .order_by().values(fk).annotate(value=aggregate).values('value'))
+    if isinstance(output_field, models.DecimalField):
+        # 金额按两位小数存储；先取整再写回，重建与校验得到的值完全一致
+        return Round(Coalesce(Subquery(qs, output_field=output_field), Value(Decimal('0')),
+                              output_field=output_field), 2, output_field=output_field)
+    return Coalesce(Subquery(qs, output_field=output_field), Value(0), output_field=output_field)
+
+
+def inquiry_summary_values(item_model, attachment_model):
+    """询单汇总：总金额只统计已报价的明细（报价单价 × 数量）"""
+    return {
+        'item_count': _aggregate(item_model, 'inquiry', Count('id'), models.IntegerField()),
+        'attachment_count': _aggregate(attachment_model, 'inquiry', Count('id'), models.IntegerField()),
+        'total_amount': _aggregate(
+            item_model, 'inquiry', Sum(F('quoted_price') * F('quantity'), output_field=AMOUNT_FIELD),
+            AMOUNT_FIELD, quoted_price__isnull=False,
+        ),
+    }
+
+
+def order_summary_values(item_model, attachment_model):
+    """订单汇总：总金额 = Σ 数量 × 单价"""
+    return {
+        'item_count': _aggregate(item_model, 'order', Count('id'), models.IntegerField()),
+        'attachment_count': _aggregate(attachment_model, 'order', Count('id'), models.IntegerField()),
+        'total_amount': _aggregate(
+            item_model, 'order', Sum(F('quantity') * F('unit_price'), output_field=AMOUNT_FIELD), AMOUNT_FIELD,
+        ),
+    }
+
+
+def _latest_message_at(message_model, fk):
+    return Subquery(message_model._base_manager.filter(**{fk: OuterRef('pk')})
+                    .order_by('-created_at').values('created_at')[:1])
+
+
+def thread_activity_values(message_model, fk):
+    """会话活动：消息数、最新消息时间；最近活动时间没有消息时为创建时间"""
+    return {
+        'message_count': _aggregate(message_model, fk, Count('id'), models.IntegerField()),
+        'last_message_at': _latest_message_at(message_model, fk),
+        'last_activity_at': Coalesce(_latest_message_at(message_model, fk), F('created_at')),
+    }
+
+
+def refresh_parent_summaries(model, parent_ids):
+    """刷新子模型（明细/附件）所属父对象的汇总字段"""
+    parent_ids = {pk for pk in parent_ids if pk is not None}
+    if parent_ids:
+        parent = model._meta.get_field(model.summary_parent).related_model
+        parent.refresh_summaries(parent_ids, touch=True)
+
+
+class SummaryQuerySet(models.QuerySet):
+    """明细/附件的 QuerySet：批量写入后在同一事务内刷新父对象汇总字段
+
+    只有经过本 QuerySet（objects 及 inquiry.items 等关联管理器）的写入会刷新。以下写入不会，
+    之后需对受影响的询单/订单调用 refresh_summaries()，或运行 `python manage.py rebuild_summaries`：
+    原生 SQL、_base_manager、数据迁移中的历史模型（没有自定义管理器）、直接修改父表的汇总字段。
+    """
+
+    def _parent_ids(self):
+        return set(self.values_list(self.model.summary_parent + '_id', flat=True))
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        attname = self.model.summary_parent + '_id'
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            refresh_parent_summaries(self.model, {getattr(obj, attname) for obj in objs})
+        return created
+
+    def update(self, **kwargs):
+        # bulk_update() 内部按批调用 update()，同样经过这里
+        parent = self.model.summary_parent
+        if not self.model.summary_fields.intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            parent_ids = self._parent_ids()
+            rows = super().update(**kwargs)
+            for key in (parent, parent + '_id'):
+                if key in kwargs:
+                    value = kwargs[key]
+                    parent_ids.add(getattr(value, 'pk', value))
+            refresh_parent_summaries(self.model, parent_ids)
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db, savepoint=False):
+            parent_ids = self._parent_ids()
+            result = super().delete()
+            refresh_parent_summaries(self.model, parent_ids)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class SummaryParentMixin:
+    """询单/订单：更新已有记录时不写回汇总与会话活动字段
+
+    这些字段只由 UPDATE 语句维护（refresh_summaries、activity.record_message），实例上的值是加载时读到的，
+    整行 save() 会用旧值覆盖期间并发写入的明细、附件与消息。显式传入 update_fields 时按调用方指定。
+    """
+    derived_fields = frozenset({'item_count', 'attachment_count', 'total_amount',
+                                'message_count', 'last_message_at', 'last_activity_at'})
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and not kwargs.get('force_insert') \
+                and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.derived_fields
+                                       and field.attname not in deferred]
+        super().save(*args, **kwargs)
+
+
+class SummaryChildMixin:
+    """明细/附件模型：单条 save()/delete() 后刷新父对象汇总字段
+
+    子类需定义 summary_parent（父外键名）与 summary_fields（影响汇总或检索文档的字段名）。
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            refresh_parent_summaries(type(self), {getattr(self, self.summary_parent + '_id')})
+
+    def delete(self, *args, **kwargs):
+        parent_id = getattr(self, self.summary_parent + '_id')
+        with transaction.atomic(savepoint=False):
+            result = super().delete(*args, **kwargs)
+            refresh_parent_summaries(type(self), {parent_id})
+        return result
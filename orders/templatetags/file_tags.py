@@ -0,0 +1,30 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from orders.thumbnails import thumbnail_name
+
+register = template.Library()
+
+
+@register.filter(name='thumbnail_url')
+def thumbnail_url(fieldfile):
+    """文件对应缩略图的 URL；不支持缩略图的类型返回空字符串"""
+    thumb = thumbnail_name(getattr(fieldfile, 'name', None))
+    if not thumb:
+        return ''
+    storage = getattr(fieldfile, 'storage', None) or default_storage
+    return storage.url(thumb)
+
+
+@register.simple_tag
+def file_thumbnail(fieldfile, css_class='img-thumbnail me-2'):
+    """懒加载的缩略图；缩略图尚未生成时加载失败会自动隐藏"""
+    url = thumbnail_url(fieldfile) if fieldfile else ''
+    if not url:
+        return ''
+    return format_html(
+        '<img src="{}" loading="lazy" decoding="async" class="{}" style="max-width:80px;max-height:80px;" '
+        'alt="" onerror="this.remove()">',
+        url, css_class,
+    )
@@ -1,3 +1,1568 @@
-from django.test import TestCase
+import csv
+import functools
+import hashlib
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+import httpx
+
+from django.apps import apps as django_apps
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from trade_project.storage_backends import (
+    AsyncSupabaseStorage, SupabaseStorage, aclose_http_client, close_http_client, content_key, get_http_client,
+)
+from trade_project.storage_standin import StorageStandinServer
+
+from . import activity, attachments, bom, dashboard, notifications, numbering, quotes, search, thumbnails
+from .admin import InquiryAdmin
+from .middleware import ContactMiddleware, get_contact_info
+from .exports import stream_xlsx
+from .forms import BomImportForm
+from .models import (Company, Contact, Inquiry, InquiryItem, InquiryAttachment, Order, OrderItem, OrderAttachment,
+                     Message, MessageAttachment, Notification, NumberCounter, ThreadReadState, UsedUploadToken)
+from .smtp_sink import SmtpSink
+
+
+class DetailPageQueryCountTests(TestCase):
+    """详情页的查询数不随消息、附件条数增长"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+        company = Company.objects.create(company_name='Buyer Co', country='CN')
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        contact = Contact.objects.create(company=company, user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-QC', contact=contact, quoted_by=self.supplier)
+        InquiryItem.objects.create(inquiry=self.inquiry, product_name='Flange', material_name='SS', quantity=1)
+        InquiryAttachment.objects.create(inquiry=self.inquiry, file=ContentFile(b'x', name='a.txt'), file_name='a.txt')
+        self.order = Order.objects.create(order_number='ORD-QC', contact=contact, inquiry=self.inquiry)
+        OrderItem.objects.create(order=self.order, product_name='Flange', material_name='SS', quantity=1, unit_price=1)
+        OrderAttachment.objects.create(order=self.order, file=ContentFile(b'x', name='b.txt'), file_name='b.txt')
+        self.add_messages(1)
+
+    def add_messages(self, count):
+        for i in range(count):
+            for target in ({'inquiry': self.inquiry}, {'order': self.order}):
+                msg = Message.objects.create(sender=self.buyer if i % 2 else self.supplier, content=f'msg {i}', **target)
+                MessageAttachment.objects.create(message=msg, file=ContentFile(b'x', name=f'm{i}.txt'),
+                                                 file_name=f'm{i}.txt')
+
+    def query_count(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assert_constant(self, user, url):
+        self.client.force_login(user)
+        self.query_count(url)  # 首次请求写入 session 中的联系人信息
+        baseline = self.query_count(url)
+        self.add_messages(20)
+        self.assertEqual(self.query_count(url), baseline)
+
+    def test_inquiry_detail(self):
+        self.assert_constant(self.buyer, reverse('inquiry_detail', args=[self.inquiry.id]))
+
+    def test_supplier_inquiry_detail(self):
+        self.assert_constant(self.supplier, reverse('supplier_inquiry_detail', args=[self.inquiry.id]))
+
+    def test_order_detail(self):
+        self.assert_constant(self.buyer, reverse('order_detail', args=[self.order.id]))
+
+    def test_supplier_order_detail(self):
+        self.assert_constant(self.supplier, reverse('supplier_order_detail', args=[self.order.id]))
+
+
+class NumberAllocatorLoadTests(TransactionTestCase):
+    """多线程并发创建询单：单号不重复、创建不失败"""
+
+    THREADS = 8
+    PER_THREAD = 25
+
+    def setUp(self):
+        numbering.reset_blocks()
+        self.addCleanup(numbering.reset_blocks)
+        company = Company.objects.create(company_name='Load Co', country='CN')
+        user = User.objects.create_user('load@example.com', 'load@example.com', 'pw')
+        self.contact = Contact.objects.create(company=company, user=user, name='Load', email='load@example.com')
+
+    def create_concurrently(self):
+        start = threading.Barrier(self.THREADS)
+        numbers, errors = [], []
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.PER_THREAD):
+                    number = numbering.next_inquiry_number()
+                    Inquiry.objects.create(inquiry_number=number, contact=self.contact)
+                    numbers.append(number)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        total = self.THREADS * self.PER_THREAD
+        self.assertEqual(len(set(numbers)), total)
+        self.assertEqual(Inquiry.objects.count(), total)
+        return numbers
+
+    def test_sequential_numbers(self):
+        numbers = self.create_concurrently()
+        prefix = numbering.format_number(numbering.INQUIRY_PREFIX, timezone.localdate(), 0)[:-numbering.SEQUENCE_DIGITS]
+        self.assertEqual(sorted(numbers), [f'{prefix}{i:04d}' for i in range(1, len(numbers) + 1)])
+
+    @override_settings(NUMBER_BLOCK_SIZE=10)
+    def test_preallocated_blocks(self):
+        numbers = self.create_concurrently()
+        self.assertEqual(NumberCounter.objects.get(prefix=numbering.INQUIRY_PREFIX).value, len(numbers))
+
+
+class NotificationDeliveryTests(TestCase):
+    """通知在业务事务内写入发件箱，由发送进程合并为摘要邮件经 SMTP 连接池发出"""
+
+    def setUp(self):
+        company = Company.objects.create(company_name='Buyer Co', country='CN')
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        contact = Contact.objects.create(company=company, user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-N', contact=contact)
+        self.item = InquiryItem.objects.create(inquiry=self.inquiry, product_name='Flange', material_name='SS',
+                                               quantity=1)
+        self.order = Order.objects.create(order_number='ORD-N', contact=contact, payment_status='paid',
+                                          confirmed_by=self.supplier)
+        self.sink = SmtpSink().start()
+        self.addCleanup(self.sink.stop)
+
+    def smtp(self, port=None):
+        return override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                                 EMAIL_HOST='127.0.0.1', EMAIL_PORT=port or self.sink.port, EMAIL_USE_TLS=False,
+                                 EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='', EMAIL_TIMEOUT=5)
+
+    def test_events_are_queued_not_sent(self):
+        self.client.force_login(self.supplier)
+        self.client.post(reverse('supplier_inquiry_detail', args=[self.inquiry.id]),
+                         {f'item_{self.item.id}_price': '12.50'})
+        self.client.post(reverse('supplier_order_detail', args=[self.order.id]), {'action': 'ship'})
+        self.client.post(reverse('supplier_order_detail', args=[self.order.id]), {'action': 'update_notes'})
+        Message.objects.create(inquiry=self.inquiry, sender=self.buyer, content='When can you ship?')
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(sorted(Notification.objects.values_list('email', 'event')), [
+            ('buyer@example.com', 'inquiry_quoted'),
+            ('buyer@example.com', 'order_status'),
+            ('supplier@example.com', 'message'),
+        ])
+
+    def test_digest_over_pooled_connections(self):
+        for i in range(3):
+            Message.objects.create(order=self.order, sender=self.supplier, content=f'update {i}')
+        Message.objects.create(order=self.order, sender=self.buyer, content='thanks')
+        with self.smtp(), notifications.SmtpPool(2) as pool:
+            self.assertEqual(notifications.deliver_due(pool, window=300).events, 0)
+            stats = notifications.deliver_due(pool, window=0)
+            self.assertEqual((stats.events, stats.digests, stats.sent, stats.failed), (4, 2, 2, 0))
+            Message.objects.create(order=self.order, sender=self.supplier, content='shipped')
+            self.assertEqual(notifications.deliver_due(pool, window=0).sent, 1)
+            opened = pool.opened
+        self.assertEqual([m.recipients for m in self.sink.messages].count(['buyer@example.com']), 2)
+        digest = next(m.message for m in self.sink.messages if '3' in m.message['Subject'])
+        self.assertEqual(digest['To'], 'buyer@example.com')
+        self.assertIn('update 2', digest.get_content())
+        self.assertIn(reverse('order_detail', args=[self.order.id]), digest.get_content())
+        # 批次之间复用连接
+        self.assertLessEqual(self.sink.connections, opened)
+        self.assertLessEqual(opened, 2)
+        self.assertFalse(Notification.objects.exclude(status='sent').exists())
+
+    def test_failed_delivery_is_retried_later(self):
+        Message.objects.create(inquiry=self.inquiry, sender=self.buyer, content='hello')
+        self.sink.stop()
+        with self.smtp(self.sink.port), notifications.SmtpPool(1) as pool:
+            stats = notifications.deliver_due(pool, window=0)
+            self.assertEqual((stats.sent, stats.failed), (0, 1))
+            self.assertEqual(notifications.deliver_due(pool, window=0).events, 0)
+        notification = Notification.objects.get()
+        self.assertEqual((notification.status, notification.attempts), ('pending', 1))
+        self.assertGreater(notification.available_at, timezone.now())
+        self.sink = SmtpSink().start()
+
+    def test_admin_retry(self):
+        Message.objects.create(inquiry=self.inquiry, sender=self.buyer, content='hello')
+        Notification.objects.update(status='failed', attempts=5)
+        admin_user = User.objects.create_superuser('admin@example.com', 'admin@example.com', 'pw')
+        self.client.force_login(admin_user)
+        response = self.client.post(reverse('admin:orders_notification_changelist'), {
+            'action': 'retry', '_selected_action': list(Notification.objects.values_list('pk', flat=True)),
+        }, follow=True)
+        self.assertEqual([str(m) for m in response.context['messages']], ['已重新加入发送队列：1 条'])
+        self.assertEqual(list(Notification.objects.values_list('status', 'attempts')), [('pending', 0)])
+
+
+@override_settings(SEARCH_MAX_RESULTS=5)
+class SearchScopeTests(TestCase):
+    """检索条数上限在当前用户的范围内计算：其他公司的大量匹配不会挤掉自己的结果
+
+    同一组用例在 SQLite（FTS5 trigram 与短词 LIKE）与 PostgreSQL（tsvector + trigram）上运行。
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        other = Contact.objects.create(company=Company.objects.create(company_name='Other Co', country='CN'),
+                                       name='Other', email='other@example.com', approval_status='approved')
+        # 自己的询单最早创建、文档最长，相关度与 id 都排在其他公司之后
+        self.mine = Inquiry.objects.create(inquiry_number='INQ-MINE', contact=contact,
+                                           customer_notes='long remark ' * 20)
+        InquiryItem.objects.create(inquiry=self.mine, product_name='Flange', material_name='SS', quantity=1)
+        self.order = Order.objects.create(order_number='ORD-MINE', contact=contact)
+        OrderItem.objects.create(order=self.order, product_name='Flange', material_name='SS', quantity=1, unit_price=1)
+        for i in range(12):
+            inquiry = Inquiry.objects.create(inquiry_number=f'INQ-OTHER-{i}', contact=other)
+            InquiryItem.objects.create(inquiry=inquiry, product_name='Flange', material_name='SS', quantity=1)
+            order = Order.objects.create(order_number=f'ORD-OTHER-{i}', contact=other)
+            OrderItem.objects.create(order=order, product_name='Flange', material_name='SS', quantity=1, unit_price=1)
+
+    def test_limit_applies_after_scope(self):
+        for q in ('Flange', 'SS', 'flange SS'):
+            self.assertEqual(len(search.search_ids('inquiry', q)), 5)
+            scope = Inquiry.objects.filter(contact__user=self.buyer)
+            self.assertEqual(search.search_ids('inquiry', q, scope=scope), [self.mine.pk])
+            scope = Order.objects.filter(contact__user=self.buyer)
+            self.assertEqual(search.search_ids('order', q, scope=scope), [self.order.pk])
+
+    def test_buyer_list_search(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('inquiry_list'), {'q': 'Flange'})
+        self.assertContains(response, 'INQ-MINE')
+        self.assertNotContains(response, 'INQ-OTHER')
+        response = self.client.get(reverse('order_list'), {'q': 'SS'})
+        self.assertContains(response, 'ORD-MINE')
+        self.assertNotContains(response, 'ORD-OTHER')
+
+
+class ExportTests(TestCase):
+    """导出：检索条件下导出全部匹配结果；以公式前缀开头的文本不会被当作公式"""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        for i in range(8):
+            inquiry = Inquiry.objects.create(inquiry_number=f'INQ-E{i}', contact=contact)
+            InquiryItem.objects.create(inquiry=inquiry, product_name='Flange', material_name='SS', quantity=1)
+            InquiryItem.objects.create(inquiry=inquiry, product_name='=HYPERLINK("http://x")', material_name='@SUM(A1)',
+                                       quantity=2)
+        self.client.force_login(self.buyer)
+
+    def export(self, fmt, **params):
+        response = self.client.get(reverse('inquiry_export'), {'format': fmt, **params})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    @override_settings(SEARCH_MAX_RESULTS=3)
+    def test_search_export_is_complete(self):
+        rows = list(csv.reader(io.StringIO(self.export('csv', q='Flange').decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 1 + 16)
+        self.assertEqual(len({row[0] for row in rows[1:]}), 8)
+
+    def test_formula_cells_are_escaped(self):
+        rows = list(csv.reader(io.StringIO(self.export('csv').decode('utf-8-sig'))))
+        products = {row[8] for row in rows[1:]}
+        self.assertEqual(products, {'Flange', '\'=HYPERLINK("http://x")'})
+        self.assertIn("'@SUM(A1)", {row[9] for row in rows[1:]})
+        with zipfile.ZipFile(io.BytesIO(self.export('xlsx'))) as archive:
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertIn("'=HYPERLINK(", sheet)
+        self.assertNotIn('>=HYPERLINK(', sheet)
+
+
+class BomImportTests(TestCase):
+    """BOM 导入：表头别名与单位归一；超出 BOM_MAX_ROWS 的行不读取；XLSX 解压大小受限"""
+
+    def xlsx(self, header, rows):
+        return b''.join(stream_xlsx(header, rows))
+
+    def test_csv_text(self):
+        text = ('Product,Material,Qty,UOM\n'
+                'Flange,SS304,10,pcs\n'
+                '\n'
+                'Elbow,CS,2.5,套\n'
+                'Tee,,x,kg\n')
+        items, errors = bom.parse_bom(text=text)
+        self.assertEqual([(i['product_name'], i['quantity'], i['unit']) for i in items],
+                         [('Flange', Decimal('10'), 'PCS'), ('Elbow', Decimal('2.5'), 'SET')])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('第 5 行'))
+
+    def test_xlsx_upload(self):
+        data = self.xlsx(['产品名称', '材料名称', '数量', '单位'], [['Flange', 'SS', 3, 'EA'], ['Valve', 'CS', 1, '']])
+        form = BomImportForm(files={'bom_file': SimpleUploadedFile('bom.xlsx', data)})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual([(i['product_name'], i['quantity'], i['unit']) for i in form.cleaned_data['items']],
+                         [('Flange', Decimal('3'), 'PCS'), ('Valve', Decimal('1'), 'PCS')])
+
+    @override_settings(BOM_MAX_ROWS=3)
+    def test_rows_beyond_limit_are_not_read(self):
+        rows = [[f'Part {i}', 'SS', 1] for i in range(50)]
+        data = self.xlsx(['产品名称', '材料名称', '数量'], rows)
+        self.assertEqual(len(bom.read_xlsx(data, max_rows=5)), 5)
+        items, errors = bom.parse_bom(uploaded=SimpleUploadedFile('bom.xlsx', data))
+        self.assertEqual(len(items), 3)
+        self.assertEqual(errors, ['超过最大行数 3，请拆分后导入'])
+        text = '\n'.join(','.join(map(str, row)) for row in rows)
+        self.assertEqual(len(bom.read_text(text, max_rows=5)), 5)
+
+    @override_settings(XLSX_MAX_XML_SIZE=4096)
+    def test_uncompressed_size_is_capped(self):
+        data = self.xlsx(['产品名称', '材料名称', '数量'], [['Flange ' * 20, 'SS', 1]] * 200)
+        self.assertLess(len(data), 4096)
+        with self.assertRaises(bom.BomFormatError):
+            bom.read_xlsx(data)
+        items, errors = bom.parse_bom(uploaded=SimpleUploadedFile('bom.xlsx', data))
+        self.assertEqual(items, [])
+        self.assertEqual(len(errors), 1)
+
+    @override_settings(XLSX_MAX_XML_SIZE=4096)
+    def test_declared_size_is_not_trusted(self):
+        data = self.xlsx(['产品名称', '材料名称', '数量'], [['Flange ' * 20, 'SS', 1]] * 200)
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        info = archive.getinfo('xl/worksheets/sheet1.xml')
+        # 伪造 zip 头中的解压后大小：仍按实际读出的字节数计数
+        info.file_size = 1 << 30
+        with self.assertRaises(bom.BomFormatError):
+            with bom._LimitedReader(archive.open(info), 4096) as fp:
+                while fp.read(1024):
+                    pass
+
+
+class PriceSheetImportTests(TestCase):
+    """价格表批量报价：下载模板填写后上传；有无效行的询单整份跳过"""
+
+    def setUp(self):
+        cache.clear()
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        self.inquiries = []
+        for i in range(2):
+            inquiry = Inquiry.objects.create(inquiry_number=f'INQ-P{i}', contact=contact)
+            InquiryItem.objects.create(inquiry=inquiry, product_name='Flange', material_name='SS', quantity=1)
+            InquiryItem.objects.create(inquiry=inquiry, product_name='-40 Elbow', material_name='CS', quantity=2)
+            self.inquiries.append(inquiry)
+        self.client.force_login(self.supplier)
+
+    def prices(self, inquiry):
+        return list(inquiry.items.order_by('id').values_list('quoted_price', flat=True))
+
+    def test_round_trip(self):
+        response = self.client.get(reverse('supplier_price_sheet'), {'format': 'csv'})
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 1 + 4)
+        for row in rows[1:]:
+            row[7] = '12.50' if row[1] == '1' else '8'
+            row[8] = '2 weeks'
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        sheet = SimpleUploadedFile('sheet.csv', buffer.getvalue().encode('utf-8-sig'), content_type='text/csv')
+        response = self.client.post(reverse('supplier_quote_import'), {'sheet': sheet})
+        self.assertEqual(response.status_code, 200)
+        report = response.context['report']
+        self.assertEqual((sorted(report.quoted), report.skipped, report.errors),
+                         ([('INQ-P0', 2), ('INQ-P1', 2)], [], []))
+        for inquiry in self.inquiries:
+            inquiry.refresh_from_db()
+            self.assertEqual((inquiry.status, inquiry.quoted_by, inquiry.quoted_lead_time),
+                             ('quoted', self.supplier, '2 weeks'))
+            self.assertEqual(self.prices(inquiry), [Decimal('12.50'), Decimal('8')])
+
+    def test_inquiry_with_invalid_row_is_skipped(self):
+        text = ('询单号,行号,报价单价(USD)\n'
+                'INQ-P0,1,10\n'
+                'INQ-P0,2,abc\n'
+                'INQ-P1,1,10\n'
+                'INQ-P1,x,5\n'
+                'INQ-P0,1,11\n')
+        report = quotes.import_price_sheet(self.supplier, text=text)
+        self.assertEqual(report.quoted, [])
+        self.assertEqual(sorted(number for number, _reason in report.skipped), ['INQ-P0', 'INQ-P1'])
+        self.assertEqual(len(report.errors), 3)
+        for inquiry in self.inquiries:
+            inquiry.refresh_from_db()
+            self.assertEqual(inquiry.status, 'pending')
+            self.assertEqual(self.prices(inquiry), [None, None])
+
+
+class ConditionalDetailTests(TestCase):
+    """详情页 304：数据变化后 ETag 随之变化；角色校验先于条件判断"""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-C', contact=contact, status='quoted')
+        self.url = reverse('inquiry_detail', args=[self.inquiry.id])
+
+    def etag(self, url):
+        self.client.get(url)  # 首次请求设置 CSRF cookie（ETag 包含该 cookie）
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        return response['ETag']
+
+    def test_order_from_inquiry_invalidates(self):
+        self.client.force_login(self.buyer)
+        etag = self.etag(self.url)
+        self.client.post(reverse('order_create'), {'inquiry_id': self.inquiry.id,
+                                                   'items[0][product_name]': 'Flange', 'items[0][quantity]': '1',
+                                                   'items[0][unit_price]': '1'}, follow=True)
+        self.assertEqual(Inquiry.objects.get(pk=self.inquiry.pk).status, 'ordered')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_new_message_and_item_invalidate(self):
+        self.client.force_login(self.buyer)
+        etag = self.etag(self.url)
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='hi')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.etag(self.url)
+        InquiryItem.objects.create(inquiry=self.inquiry, product_name='Flange', material_name='SS', quantity=1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_role_checked_before_not_modified(self):
+        self.client.force_login(self.buyer)
+        future = 'Fri, 01 Jan 2100 00:00:00 GMT'
+        response = self.client.get(reverse('supplier_inquiry_detail', args=[self.inquiry.id]),
+                                   HTTP_IF_MODIFIED_SINCE=future)
+        self.assertEqual(response.status_code, 302)
+        # 供应商访问买家详情页：不在范围内，不返回 304
+        self.client.force_login(self.supplier)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=future).status_code, 404)
+
+
+
+class ThreadPollingTests(TestCase):
+    """WSGI 下不提供长连接：事件流接口返回 404，详情页改为轮询增量接口"""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-L', contact=contact)
+        self.first = Message.objects.create(inquiry=self.inquiry, sender=self.buyer, content='first')
+        self.client.force_login(self.buyer)
+
+    @override_settings(REALTIME_POLL_SECONDS=7)
+    def test_detail_page_polls(self):
+        response = self.client.get(reverse('inquiry_detail', args=[self.inquiry.pk]))
+        self.assertContains(response, 'data-poll-seconds="7"')
+        self.assertContains(response, reverse('thread_messages', args=['inquiry', self.inquiry.pk]))
+        self.assertNotContains(response, 'data-events-url')
+        self.assertNotContains(response, 'data-ws-path')
+
+    def test_events_endpoint_is_asgi_only(self):
+        response = self.client.get(reverse('thread_events', args=['inquiry', self.inquiry.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.streaming)
+
+    def test_messages_after(self):
+        second = Message.objects.create(inquiry=self.inquiry, sender=self.buyer, content='second')
+        url = reverse('thread_messages', args=['inquiry', self.inquiry.pk])
+        data = self.client.get(url, {'after': self.first.pk}).json()
+        self.assertEqual(([m['id'] for m in data['messages']], data['last_id']), ([second.pk], second.pk))
+        data = self.client.get(url, {'after': second.pk}).json()
+        self.assertEqual((data['messages'], data['last_id']), ([], second.pk))
+
+
+@override_settings(LIST_PAGE_SIZE=4)
+class KeysetPaginationTests(TestCase):
+    """游标分页：逐页翻完不重复、不遗漏（created_at 相同时按 id）；翻页期间新增数据不影响已打开的游标"""
+
+    def setUp(self):
+        cache.clear()
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                              name='Buyer', email='buyer@example.com', approval_status='approved')
+        self.inquiries = [Inquiry.objects.create(inquiry_number=f'INQ-K{i}', contact=self.contact) for i in range(10)]
+        # 一半询单的创建时间相同，只能按 id 区分先后
+        same = timezone.now()
+        Inquiry.objects.filter(pk__in=[i.pk for i in self.inquiries[3:8]]).update(created_at=same,
+                                                                               last_activity_at=same)
+        self.client.force_login(self.supplier)
+
+    def expected(self, field='created_at'):
+        return list(Inquiry.objects.order_by('-' + field, '-id').values_list('pk', flat=True))
+
+    def page(self, query=''):
+        """query 为 next_query / previous_query 给出的查询字符串"""
+        return self.client.get(f"{reverse('supplier_inquiry_list')}?{query}").context['page']
+
+    def walk(self, query=''):
+        pages = []
+        while True:
+            page = self.page(query)
+            pages.append([i.pk for i in page.object_list])
+            if not page.next_query:
+                return pages, page
+            query = page.next_query
+
+    def test_pages_cover_every_row_once(self):
+        pages, last = self.walk()
+        self.assertEqual([len(p) for p in pages], [4, 4, 2])
+        self.assertEqual(sum(pages, []), self.expected())
+        previous = self.page(last.previous_query)
+        self.assertEqual([i.pk for i in previous.object_list], pages[1])
+
+    def test_sort_by_activity(self):
+        pages, _last = self.walk('sort=activity')
+        self.assertEqual(sum(pages, []), self.expected('last_activity_at'))
+
+    def test_cursor_is_stable_when_rows_are_added(self):
+        first = self.page()
+        Inquiry.objects.create(inquiry_number='INQ-KNEW', contact=self.contact)
+        second = self.page(first.next_query)
+        self.assertEqual([i.pk for i in second.object_list], self.expected()[5:9])
+
+    def test_invalid_cursor_is_first_page(self):
+        page = self.page('after=not-a-cursor')
+        self.assertEqual([i.pk for i in page.object_list], self.expected()[:4])
+        self.assertFalse(page.has_previous)
+
+
+@override_settings(MESSAGE_PAGE_SIZE=3)
+class MessageHistoryTests(TestCase):
+    """沟通消息分页：详情页只渲染最新一页，thread_history 按游标返回更早的消息，直到 next 为空"""
+
+    def setUp(self):
+        cache.clear()
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        self.contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                              user=self.buyer, name='Buyer', email='buyer@example.com',
+                                              approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-H1', contact=self.contact)
+        sent = [Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content=f'm{i}') for i in range(7)]
+        # 一半消息的发送时间相同，只能按 id 区分先后
+        Message.objects.filter(pk__in=[m.pk for m in sent[:4]]).update(created_at=timezone.now())
+        self.url = reverse('thread_history', args=['inquiry', self.inquiry.pk])
+
+    def history(self, cursor):
+        data = self.client.get(self.url, {'after': cursor}).json()
+        return [int(pk) for pk in re.findall(r'data-message-id="(\d+)"', data['html'])], data['next']
+
+    def test_pages_cover_every_message_once(self):
+        self.client.force_login(self.supplier)
+        thread = self.client.get(reverse('supplier_inquiry_detail', args=[self.inquiry.pk])).context['thread']
+        seen, cursor = [m.pk for m in thread.object_list], thread.next_cursor
+        self.assertEqual(len(seen), 3)
+        while cursor:
+            page, cursor = self.history(cursor)
+            seen.extend(page)
+        self.assertEqual(seen, list(self.inquiry.messages.order_by('-created_at', '-id').values_list('pk', flat=True)))
+
+    def test_cursor_is_stable_when_messages_arrive(self):
+        self.client.force_login(self.buyer)
+        thread = self.client.get(reverse('inquiry_detail', args=[self.inquiry.pk])).context['thread']
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='new')
+        page, _cursor = self.history(thread.next_cursor)
+        expected = list(self.inquiry.messages.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(page, expected[4:7])
+
+    def test_other_buyers_get_404(self):
+        other = User.objects.create_user('other@example.com', 'other@example.com', 'pw')
+        Contact.objects.create(company=Company.objects.create(company_name='Other Co', country='CN'), user=other,
+                               name='Other', email='other@example.com', approval_status='approved')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('thread_history', args=['thing', self.inquiry.pk])).status_code, 404)
+
+
+class UnreadCountTests(TestCase):
+    """未读数：message_count - 已读数；自己发送的消息计为已读，打开详情页或调用 thread_read 后清零"""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-U1', contact=contact)
+        self.other = Inquiry.objects.create(inquiry_number='INQ-U2', contact=contact)
+        self.order = Order.objects.create(order_number='ORD-U1', contact=contact)
+
+    def unread(self, user, kind='inquiry'):
+        model = activity.THREADS[kind]
+        return dict(activity.with_unread(model.objects.all(), kind, user.id).values_list('pk', 'unread_count'))
+
+    def test_migration_seeds_existing_threads(self):
+        """0014 数据迁移：已有会话的参与者不会看到历史消息全部未读"""
+        outsider = User.objects.create_user('outsider@example.com', 'outsider@example.com', 'pw')
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='a')
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='b')
+        last = Message.objects.create(order=self.order, sender=self.supplier, content='c')
+        ThreadReadState.objects.all().delete()
+        importlib.import_module('orders.migrations.0014_thread_activity').populate_activity(django_apps, None)
+        self.assertEqual(self.unread(self.buyer), {self.inquiry.pk: 0, self.other.pk: 0})
+        self.assertEqual(self.unread(self.supplier), {self.inquiry.pk: 0, self.other.pk: 0})
+        self.assertEqual(self.unread(outsider), {self.inquiry.pk: 2, self.other.pk: 0})
+        state = ThreadReadState.objects.get(user=self.buyer, order=self.order)
+        self.assertEqual((state.read_count, state.last_read_message_id), (1, last.pk))
+
+    def list_unread(self, url):
+        """列表页上的未读数，不对消息表做查询"""
+        with CaptureQueriesContext(connection) as queries:
+            html = self.client.get(url).content.decode()
+        self.assertFalse([q['sql'] for q in queries.captured_queries if 'orders_message' in q['sql']])
+        return re.findall(r'title="未读消息">(\d+)</span>', html)
+
+    def test_counts_and_sender_read(self):
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='a')
+        last = Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='b')
+        Message.objects.create(order=self.order, sender=self.buyer, content='c')
+        self.inquiry.refresh_from_db()
+        self.assertEqual((self.inquiry.message_count, self.inquiry.last_message_at, self.inquiry.last_activity_at),
+                         (2, last.created_at, last.created_at))
+        self.assertEqual(self.unread(self.buyer), {self.inquiry.pk: 2, self.other.pk: 0})
+        self.assertEqual(self.unread(self.supplier), {self.inquiry.pk: 0, self.other.pk: 0})
+        self.assertEqual(self.unread(self.buyer, 'order'), {self.order.pk: 0})
+        self.assertEqual(self.unread(self.supplier, 'order'), {self.order.pk: 1})
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.list_unread(reverse('inquiry_list')), ['2'])
+        self.assertEqual(self.list_unread(reverse('order_list')), [])
+        html = self.client.get(reverse('inquiry_list'), {'sort': 'activity'}).content.decode()
+        self.assertLess(html.index('INQ-U1'), html.index('INQ-U2'))
+
+    def test_detail_page_marks_read(self):
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='a')
+        self.client.force_login(self.buyer)
+        self.client.get(reverse('inquiry_detail', args=[self.inquiry.pk]))
+        self.assertEqual(self.unread(self.buyer)[self.inquiry.pk], 0)
+        self.assertEqual(self.list_unread(reverse('inquiry_list')), [])
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='b')
+        self.assertEqual(self.list_unread(reverse('buyer_dashboard')), ['1'])
+
+    def test_read_endpoint(self):
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='a')
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='b')
+        self.client.force_login(self.buyer)
+        response = self.client.post(reverse('thread_read', args=['inquiry', self.inquiry.pk]))
+        self.assertEqual(response.json(), {'success': True})
+        self.assertEqual(self.unread(self.buyer)[self.inquiry.pk], 0)
+        # 重复标记不新增行
+        self.client.post(reverse('thread_read', args=['inquiry', self.inquiry.pk]))
+        self.assertEqual(ThreadReadState.objects.filter(user=self.buyer).count(), 1)
+        # 无权访问的会话返回 404
+        self.client.force_login(User.objects.create_user('x@example.com', 'x@example.com', 'pw'))
+        response = self.client.post(reverse('thread_read', args=['inquiry', self.inquiry.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_deleting_messages_recomputes(self):
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='a')
+        Message.objects.create(inquiry=self.inquiry, sender=self.supplier, content='b').delete()
+        self.inquiry.refresh_from_db()
+        self.assertEqual(self.inquiry.message_count, 1)
+        Message.objects.filter(inquiry=self.inquiry).delete()
+        self.inquiry.refresh_from_db()
+        self.assertEqual((self.inquiry.message_count, self.inquiry.last_message_at, self.inquiry.last_activity_at),
+                         (0, None, self.inquiry.created_at))
+
+
+class SummaryRefreshTests(TestCase):
+    """明细/附件经 QuerySet 批量写入（bulk_create / bulk_update / update / delete）后父对象汇总字段随之刷新"""
+
+    def setUp(self):
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         name='Buyer', email='buyer@example.com', approval_status='approved')
+        self.order = Order.objects.create(order_number='ORD-S1', contact=contact)
+        self.other = Order.objects.create(order_number='ORD-S2', contact=contact)
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-S1', contact=contact)
+
+    def summary(self, obj):
+        obj.refresh_from_db()
+        return obj.item_count, obj.total_amount
+
+    def add_items(self, count=3):
+        OrderItem.objects.bulk_create([
+            OrderItem(order=self.order, product_name=f'Part {i}', material_name='SS', quantity=i + 1, unit_price=10)
+            for i in range(count)
+        ])
+        return list(self.order.items.order_by('id'))
+
+    def test_bulk_create(self):
+        self.add_items()
+        self.assertEqual(self.summary(self.order), (3, Decimal('60.00')))
+        InquiryItem.objects.bulk_create([
+            InquiryItem(inquiry=self.inquiry, product_name='Flange', material_name='SS', quantity=2),
+            InquiryItem(inquiry=self.inquiry, product_name='Elbow', material_name='SS', quantity=3,
+                        quoted_price=Decimal('1.50')),
+        ])
+        self.assertEqual(self.summary(self.inquiry), (2, Decimal('4.50')))
+
+    def test_bulk_update(self):
+        items = self.add_items()
+        updated_at = Order.objects.get(pk=self.order.pk).updated_at
+        for item in items:
+            item.unit_price = Decimal('2.25')
+        OrderItem.objects.bulk_update(items, ['unit_price'], batch_size=2)
+        self.assertEqual(self.summary(self.order), (3, Decimal('13.50')))
+        self.assertGreater(self.order.updated_at, updated_at)
+
+    def test_update(self):
+        self.add_items()
+        self.order.items.update(quantity=F('quantity') * 2)
+        self.assertEqual(self.summary(self.order), (3, Decimal('120.00')))
+        # 移到另一张订单：原订单与新订单都刷新
+        OrderItem.objects.filter(order=self.order, product_name='Part 2').update(order=self.other)
+        self.assertEqual((self.summary(self.order), self.summary(self.other)),
+                         ((2, Decimal('60.00')), (1, Decimal('60.00'))))
+
+    def test_delete(self):
+        self.add_items()
+        OrderItem.objects.filter(order=self.order, quantity__gt=1).delete()
+        self.assertEqual(self.summary(self.order), (1, Decimal('10.00')))
+
+    def test_parent_save_keeps_concurrent_summaries(self):
+        """详情页/后台在请求开始时加载询单/订单，期间写入的明细与消息不会被 save() 用旧值覆盖"""
+        user = User.objects.create_user('staff@example.com', 'staff@example.com', 'pw', is_staff=True)
+        stale_order = Order.objects.get(pk=self.order.pk)
+        stale_inquiry = Inquiry.objects.get(pk=self.inquiry.pk)
+        self.add_items()
+        message = Message.objects.create(order=self.order, sender=user, content='concurrent')
+        InquiryItem.objects.create(inquiry=self.inquiry, product_name='Flange', material_name='SS', quantity=2,
+                                   quoted_price=3)
+        Message.objects.create(inquiry=self.inquiry, sender=user, content='concurrent')
+
+        stale_order.status = 'confirmed'
+        stale_order.save()
+        request = RequestFactory().post('/admin/')
+        request.user = user
+        stale_inquiry.status = 'quoted'
+        InquiryAdmin(Inquiry, admin.site).save_model(request, stale_inquiry, None, True)
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.item_count, self.order.total_amount,
+                          self.order.message_count, self.order.last_message_at),
+                         ('confirmed', 3, Decimal('60.00'), 1, message.created_at))
+        self.inquiry.refresh_from_db()
+        self.assertEqual((self.inquiry.status, self.inquiry.quoted_by, self.inquiry.item_count,
+                          self.inquiry.total_amount, self.inquiry.message_count),
+                         ('quoted', user, 1, Decimal('6.00'), 1))
+        call_command('rebuild_summaries', '--verify', stdout=io.StringIO())
+
+    def test_writes_outside_the_queryset_need_rebuild(self):
+        self.add_items()
+        OrderItem._base_manager.filter(order=self.order).update(unit_price=1)
+        self.assertEqual(self.summary(self.order), (3, Decimal('60.00')))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_summaries', '--verify', stdout=io.StringIO())
+        call_command('rebuild_summaries', stdout=io.StringIO())
+        self.assertEqual(self.summary(self.order), (3, Decimal('6.00')))
+        call_command('rebuild_summaries', '--verify', stdout=io.StringIO())
+
+
+class ThumbnailTests(TestCase):
+    """缩略图：同目录同名不同扩展名的文件各有自己的缩略图；事务回滚不会留下“进行中”的文件名"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.storage = FileSystemStorage(location=media_root)
+
+    def image(self, name, color):
+        out = io.BytesIO()
+        Image.new('RGB', (640, 480), color).save(out, 'PNG' if name.endswith('.png') else 'JPEG')
+        return self.storage.save(name, ContentFile(out.getvalue()))
+
+    def test_names(self):
+        png, pdf = thumbnails.thumbnail_name('drawings/a/part.png'), thumbnails.thumbnail_name('drawings/a/part.pdf')
+        self.assertNotEqual(png, pdf)
+        self.assertTrue(png.startswith('drawings/a/part.png.thumb.'))
+        digest = '0123456789abcdef' * 4
+        self.assertTrue(thumbnails.thumbnail_name(f'cas/01/{digest}.png').startswith(f'cas/01/{digest}.thumb.'))
+        self.assertIsNone(thumbnails.thumbnail_name('drawings/a/part.dwg'))
+
+    def test_same_stem_gets_separate_thumbnails(self):
+        png, jpg = self.image('drawings/part.png', 'red'), self.image('drawings/part.jpg', 'blue')
+        thumbs = [thumbnails.ensure_thumbnail(name, self.storage) for name in (png, jpg)]
+        self.assertEqual(len(set(thumbs)), 2)
+        colors = []
+        for thumb in thumbs:
+            with self.storage.open(thumb, 'rb') as fp, Image.open(fp) as im:
+                colors.append(im.convert('RGB').getpixel((0, 0)))
+        self.assertGreater(colors[0][0], colors[0][2])
+        self.assertGreater(colors[1][2], colors[1][0])
+
+    @override_settings(THUMBNAIL_WORKERS=2)
+    def test_rollback_does_not_leave_names_in_flight(self):
+        name = 'drawings/rolled-back.png'
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    thumbnails.schedule_thumbnails([name])
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertNotIn(name, thumbnails._in_flight)
+
+
+def start_standin(testcase, **options):
+    """启动 Storage 替身服务器，返回 (server, SupabaseStorage 的 STORAGES 配置)"""
+    server = StorageStandinServer()
+    server.start()
+    testcase.addCleanup(server.stop)
+    storages = {
+        'default': {
+            'BACKEND': 'trade_project.storage_backends.SupabaseStorage',
+            'OPTIONS': {'url': server.base_url, 'key': 'service-key', 'bucket': 'media', **options},
+        },
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    }
+    return server, storages
+
+
+class DirectUploadTests(TestCase):
+    """浏览器直传：申请会话 → PUT → finalize；大小/摘要不符、过期与重复确认都被拒绝"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-U', contact=contact)
+        self.client.force_login(self.buyer)
+        self.data = b'%PDF-1.4 drawing ' * 64
+
+    def session(self, data, sha256=None, name='part.pdf'):
+        response = self.client.post(
+            reverse('upload_session_create', args=['inquiry', self.inquiry.pk]),
+            json.dumps({'purpose': 'message', 'files': [{
+                'name': name, 'size': len(data), 'content_type': 'application/pdf',
+                'sha256': sha256 or hashlib.sha256(data).hexdigest(),
+            }]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['files'][0]
+
+    def put_local(self, entry, data):
+        return self.client.generic('PUT', urlsplit(entry['upload']['url']).path, data,
+                                   content_type='application/pdf')
+
+    def finalize(self, *tokens):
+        return self.client.post(reverse('upload_finalize'), json.dumps({'tokens': list(tokens), 'content': 'drawing'}),
+                                content_type='application/json')
+
+    def test_upload_finalize_and_replay(self):
+        entry = self.session(self.data)
+        self.assertEqual(self.put_local(entry, self.data).status_code, 200)
+        response = self.finalize(entry['token'])
+        self.assertEqual(response.status_code, 200)
+        attachment = MessageAttachment.objects.get()
+        self.assertEqual(attachment.message.content, 'drawing')
+        with attachment.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+        replay = self.finalize(entry['token'])
+        self.assertEqual(replay.status_code, 400)
+        self.assertEqual((Message.objects.count(), MessageAttachment.objects.count()), (1, 1))
+        self.assertEqual(UsedUploadToken.objects.count(), 1)
+
+    def test_size_and_digest_mismatch(self):
+        entry = self.session(self.data)
+        self.assertEqual(self.put_local(entry, self.data + b'x').status_code, 400)
+        self.assertEqual(self.finalize(entry['token']).status_code, 400)
+
+        entry = self.session(self.data)
+        forged = b'X' * len(self.data)
+        self.assertEqual(self.put_local(entry, forged).status_code, 200)
+        self.assertEqual(self.finalize(entry['token']).status_code, 400)
+        self.assertFalse(MessageAttachment._meta.get_field('file').storage.exists(entry['key']))
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(UsedUploadToken.objects.exists())
+
+    def test_expired_token(self):
+        entry = self.session(self.data)
+        with override_settings(DIRECT_UPLOAD_TTL=-1):
+            response = self.put_local(entry, self.data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('过期', response.json()['error'])
+        self.assertEqual(self.put_local(entry, self.data).status_code, 200)
+        with override_settings(DIRECT_UPLOAD_TTL=-1):
+            self.assertEqual(self.finalize(entry['token']).status_code, 400)
+        self.assertFalse(MessageAttachment.objects.exists())
+
+    def test_content_addressed_requires_upload(self):
+        """内容寻址存储：声明已有对象的摘要不能直接引用，必须上传内容一致的文件"""
+        server, storages = start_standin(self, content_addressed=True)
+        put = lambda entry, data: get_http_client().put(  # noqa: E731
+            entry['upload']['url'], content=data, headers=entry['upload']['headers'])
+        with override_settings(STORAGES=storages):
+            storage = MessageAttachment._meta.get_field('file').storage
+            secret = b'%PDF-1.4 other customer ' * 64
+            cas = storage.save('other.pdf', ContentFile(secret))
+            self.assertEqual(cas, content_key(hashlib.sha256(secret).hexdigest(), 'other.pdf'))
+
+            # 只声明摘要、不上传：无法确认
+            entry = self.session(secret)
+            self.assertTrue(entry['key'].startswith('uploads/'))
+            self.assertIsNotNone(entry['upload'])
+            self.assertEqual(self.finalize(entry['token']).status_code, 400)
+            # 上传内容与摘要不符：暂存对象被删除，已有对象不受影响
+            entry = self.session(secret)
+            self.assertEqual(put(entry, b'X' * len(secret)).status_code, 200)
+            self.assertEqual(self.finalize(entry['token']).status_code, 400)
+            self.assertNotIn(f"media/{entry['key']}", server.objects)
+            self.assertEqual(server.objects[f'media/{cas}'][0], secret)
+            self.assertFalse(MessageAttachment.objects.exists())
+
+            # 确实持有文件：引用已有对象，暂存对象删除
+            entry = self.session(secret)
+            self.assertEqual(put(entry, secret).status_code, 200)
+            self.assertEqual(self.finalize(entry['token']).status_code, 200)
+            self.assertEqual(MessageAttachment.objects.get().file.name, cas)
+            # 新内容：暂存对象移入 cas/
+            entry = self.session(self.data)
+            self.assertEqual(put(entry, self.data).status_code, 200)
+            self.assertEqual(self.finalize(entry['token']).status_code, 200)
+            key = content_key(hashlib.sha256(self.data).hexdigest(), 'part.pdf')
+            self.assertEqual(server.objects[f'media/{key}'][0], self.data)
+            self.assertFalse([k for k in server.objects if k.startswith('media/uploads/')])
+
+
+class StandinStorageMixin:
+    """每个测试启动一个 Storage 替身服务器；make_storage() 返回指向它的存储（默认不做内容寻址）"""
+
+    def setUp(self):
+        super().setUp()
+        self.server, self.storages = start_standin(self)
+
+    def make_storage(self, storage_class=SupabaseStorage, **options):
+        options = {**self.storages['default']['OPTIONS'], 'content_addressed': False, **options}
+        return storage_class(**options)
+
+
+class PooledClientTests(StandinStorageMixin, SimpleTestCase):
+    """共享连接池：所有 storage 实例共用一个客户端，连续请求复用同一个 TCP 连接"""
+
+    def test_requests_reuse_connection(self):
+        first, second = self.make_storage(), self.make_storage()
+        self.assertIs(first.client, second.client)
+        for i in range(5):
+            name = first.save(f'pool/{i}.txt', ContentFile(b'pooled'))
+            self.assertTrue(second.exists(name))
+        self.assertEqual(len(self.server.objects), 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_closed_client_is_recreated(self):
+        storage = self.make_storage()
+        client = storage.client
+        close_http_client()
+        self.assertTrue(client.is_closed)
+        self.assertIsNot(storage.client, client)
+        self.assertTrue(storage.exists(storage.save('pool/after-close.txt', ContentFile(b'x'))))
+
+
+class StreamingUploadTests(StandinStorageMixin, SimpleTestCase):
+    """流式上传按块读取文件；超过阈值走 TUS 分块续传，单块失败后从服务器记录的偏移量继续"""
+
+    class RecordingFile(io.BytesIO):
+        def __init__(self, data):
+            super().__init__(data)
+            self.reads = []
+
+        def read(self, size=-1):
+            self.reads.append(size)
+            return super().read(size)
+
+    @mock.patch.dict('os.environ', {'SUPABASE_UPLOAD_CHUNK_SIZE': '4096'})
+    def test_streaming_reads_in_chunks(self):
+        data = bytes(range(256)) * 256
+        source = self.RecordingFile(data)
+        name = self.make_storage().save('stream/big.bin', File(source, name='big.bin'))
+        self.assertEqual(self.server.objects[f'media/{name}'][0], data)
+        self.assertEqual(self.server.uploads_received, 1)
+        self.assertTrue(source.reads)
+        self.assertTrue(all(0 < size <= 4096 for size in source.reads))
+
+    @mock.patch('trade_project.storage_backends.TUS_CHUNK_SIZE', 1024)
+    def test_resumable_upload_in_chunks(self):
+        data = b'0123456789' * 500
+        name = self.make_storage().save('stream/tus.bin', ContentFile(data))
+        self.assertEqual(self.server.objects[f'media/{name}'][0], data)
+        self.assertEqual(self.server.uploads_received, 0)
+        self.assertEqual(self.server.max_request_body, 1024)
+
+    @mock.patch('trade_project.storage_backends.TUS_CHUNK_SIZE', 1024)
+    def test_resumable_upload_resumes_after_lost_response(self):
+        data = b'0123456789' * 500
+        client = get_http_client()
+        real_patch, calls = client.patch, []
+
+        def flaky_patch(url, **kwargs):
+            # 服务器已收到第二块，但响应丢失
+            resp = real_patch(url, **kwargs)
+            calls.append(kwargs['headers']['Upload-Offset'])
+            if len(calls) == 2:
+                raise httpx.ReadTimeout('response lost')
+            return resp
+
+        with mock.patch.object(client, 'patch', side_effect=flaky_patch):
+            name = self.make_storage().save('stream/resume.bin', ContentFile(data))
+        self.assertEqual(self.server.objects[f'media/{name}'][0], data)
+        self.assertEqual(calls, ['0', '1024', '2048', '3072', '4096'])
+
+
+class ConcurrentAttachmentTests(StandinStorageMixin, TestCase):
+    """一个请求的附件并发上传，全部成功后才写入记录；上传失败或事务回滚时删除本批次已上传的文件"""
+
+    class BrokenFile(ContentFile):
+        def read(self, *args):
+            raise OSError('disk error')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        contact = Contact.objects.create(company=Company.objects.create(company_name='Buyer Co', country='CN'),
+                                         user=self.buyer, name='Buyer', email='buyer@example.com',
+                                         approval_status='approved')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-A', contact=contact)
+        # 非内容寻址：清理时会删除已上传的文件
+        self.plain_storages = {**self.storages, 'default': {
+            **self.storages['default'],
+            'OPTIONS': {**self.storages['default']['OPTIONS'], 'content_addressed': False},
+        }}
+
+    def test_message_files_upload_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+        real_upload = attachments.UploadRef.upload
+
+        def upload(ref):
+            # 三个文件同时处于上传中才能通过，串行上传会超时报错
+            barrier.wait()
+            return real_upload(ref)
+
+        files = [SimpleUploadedFile(f'part{i}.pdf', f'%PDF part {i}'.encode(), content_type='application/pdf')
+                 for i in range(3)]
+        self.client.force_login(self.buyer)
+        with override_settings(STORAGES=self.storages, ATTACHMENT_UPLOAD_WORKERS=4), \
+                mock.patch.object(attachments.UploadRef, 'upload', upload):
+            response = self.client.post(reverse('inquiry_message_add', args=[self.inquiry.pk]),
+                                        {'content': 'drawings', 'files': files})
+        self.assertEqual(response.status_code, 302)
+        names = list(MessageAttachment.objects.values_list('file', flat=True))
+        self.assertEqual(len(names), 3)
+        self.assertEqual({f'media/{name}' for name in names}, set(self.server.objects))
+
+    def test_failed_upload_removes_uploaded_files(self):
+        with override_settings(STORAGES=self.plain_storages):
+            batch = attachments.AttachmentUploadBatch(max_workers=2)
+            batch.add(MessageAttachment, 'file', ContentFile(b'ok', name='ok.pdf'))
+            batch.add(MessageAttachment, 'file', self.BrokenFile(b'broken', name='broken.pdf'))
+            with self.assertRaises(OSError):
+                with batch:
+                    pass
+        self.assertEqual(self.server.objects, {})
+
+    def test_rollback_removes_uploaded_files(self):
+        with override_settings(STORAGES=self.plain_storages):
+            batch = attachments.AttachmentUploadBatch()
+            ref = batch.add(MessageAttachment, 'file', ContentFile(b'%PDF', name='rolled.pdf'))
+            with self.assertRaises(RuntimeError):
+                with batch, transaction.atomic():
+                    self.assertIn(f'media/{ref.name}', self.server.objects)
+                    raise RuntimeError
+        self.assertEqual(self.server.objects, {})
+        self.assertIsNone(ref.name)
+
+
+class ContentAddressedStorageTests(StandinStorageMixin, SimpleTestCase):
+    """内容寻址：相同内容只上传一次；对象已存在时服务器返回的 409 / Duplicate 视为成功"""
+
+    def test_same_content_uploaded_once(self):
+        storage = self.make_storage(content_addressed=True)
+        data = b'%PDF-1.4 shared drawing'
+        first = storage.save('drawings/a.pdf', ContentFile(data))
+        second = storage.save('other/b.pdf', ContentFile(data))
+        self.assertEqual(first, second)
+        self.assertEqual(first, content_key(hashlib.sha256(data).hexdigest(), 'a.pdf'))
+        self.assertEqual(self.server.uploads_received, 1)
+        self.assertNotEqual(storage.save('drawings/a.png', ContentFile(data)), first)
+
+    def test_duplicate_response_is_success(self):
+        """exists() 探测与上传之间被并发请求抢先写入：服务器拒绝覆盖，结果仍指向同一内容"""
+        storage = self.make_storage(content_addressed=True)
+        data = b'%PDF-1.4 raced'
+        name = storage.save('a.pdf', ContentFile(data))
+        with mock.patch.object(storage, 'exists', return_value=False):
+            self.assertEqual(storage.save('a.pdf', ContentFile(data)), name)
+        self.assertEqual(self.server.uploads_received, 1)
+        self.assertEqual(self.server.objects[f'media/{name}'][0], data)
+
+    @mock.patch('trade_project.storage_backends.TUS_CHUNK_SIZE', 1024)
+    def test_duplicate_resumable_upload_is_success(self):
+        storage = self.make_storage(content_addressed=True)
+        data = b'0123456789' * 500
+        name = storage.save('big.pdf', ContentFile(data))
+        with mock.patch.object(storage, 'exists', return_value=False), \
+                mock.patch.object(get_http_client(), 'patch') as patch:
+            self.assertEqual(storage.save('big.pdf', ContentFile(data)), name)
+        patch.assert_not_called()
+        self.assertEqual(self.server.objects[f'media/{name}'][0], data)
+
+
+class StorageUrlTests(StandinStorageMixin, SimpleTestCase):
+    """文件 URL：公开 bucket 不请求服务器；私有 bucket 一次请求批量签发，缓存到过期前"""
+
+    @mock.patch.dict('os.environ', {'SUPABASE_PRIVATE_BUCKET': 'true', 'SUPABASE_SIGNED_URL_TTL': '600',
+                                    'SUPABASE_SIGNED_URL_MARGIN': '60'})
+    def private_storage(self):
+        storage = self.make_storage()
+        for name in ('a.pdf', 'b.pdf', 'c.pdf', 'd.pdf'):
+            storage.upload_to_key(name, ContentFile(name.encode()))
+        return storage
+
+    def test_public_url_needs_no_request(self):
+        storage = self.make_storage()
+        self.assertEqual(storage.url('drawings/a.pdf'),
+                         f'{self.server.base_url}/storage/v1/object/public/media/drawings/a.pdf')
+        self.assertFalse(storage.signs_urls)
+        self.assertEqual(self.server.connections, 0)
+
+    def test_batch_signing_and_cache(self):
+        storage = self.private_storage()
+        urls = storage.signed_urls(['a.pdf', 'b.pdf', 'c.pdf', 'a.pdf', ''])
+        self.assertEqual(set(urls), {'a.pdf', 'b.pdf', 'c.pdf'})
+        self.assertEqual(self.server.sign_requests, 1)
+        self.assertEqual(get_http_client().get(urls['b.pdf']).content, b'b.pdf')
+
+        self.assertEqual(storage.url('b.pdf'), urls['b.pdf'])
+        storage.prefetch_urls(['a.pdf', 'd.pdf'])
+        self.assertEqual(self.server.sign_requests, 2)
+        self.assertEqual(storage.url('a.pdf'), urls['a.pdf'])
+        storage.url('d.pdf')
+        self.assertEqual(self.server.sign_requests, 2)
+
+    def test_expired_url_is_signed_again(self):
+        storage = self.private_storage()
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            url = storage.url('a.pdf')
+        # 有效期 600 秒，提前 60 秒视为过期
+        with mock.patch('time.time', return_value=now + 530):
+            self.assertEqual(storage.url('a.pdf'), url)
+        self.assertEqual(self.server.sign_requests, 1)
+        with mock.patch('time.time', return_value=now + 550):
+            self.assertNotEqual(storage.url('a.pdf'), url)
+        self.assertEqual(self.server.sign_requests, 2)
+
+
+class StorageApiTests(StandinStorageMixin, SimpleTestCase):
+    """open() 按需发 Range 请求读取，size / 修改时间走 HEAD；delete / delete_many / listdir 对应 Storage API"""
+
+    def setUp(self):
+        super().setUp()
+        self.storage = self.make_storage()
+        self.data = bytes(range(256)) * 64
+
+    @mock.patch.dict('os.environ', {'SUPABASE_READ_BUFFER_SIZE': '1024'})
+    def test_open_reads_ranges(self):
+        name = self.storage.save('docs/big.bin', ContentFile(self.data))
+        with self.storage.open(name) as f:
+            self.assertEqual(f.size, len(self.data))
+            f.seek(5000)
+            self.assertEqual(f.read(10), self.data[5000:5010])
+            self.assertEqual(self.server.range_requests, 1)
+            f.seek(-16, io.SEEK_END)
+            self.assertEqual(f.read(), self.data[-16:])
+        self.assertEqual(self.server.range_requests, 2)
+        with self.storage.open(name) as f:
+            self.assertEqual(b''.join(f.chunks(4096)), self.data)
+        with self.assertRaises(ValueError):
+            self.storage.open(name, 'wb')
+
+    def test_size_and_modified_time(self):
+        name = self.storage.save('docs/a.bin', ContentFile(self.data))
+        self.assertEqual(self.storage.size(name), len(self.data))
+        modified = self.storage.get_modified_time(name)
+        self.assertLess(abs((timezone.now() - modified).total_seconds()), 60)
+        with self.assertRaises(FileNotFoundError):
+            self.storage.size('docs/missing.bin')
+
+    def test_delete(self):
+        names = [self.storage.save(f'docs/{i}.bin', ContentFile(b'x')) for i in range(4)]
+        self.storage.delete(names[0])
+        self.assertFalse(self.storage.exists(names[0]))
+        self.storage.delete(names[0])
+        self.assertEqual(self.storage.delete_many(names + ['docs/missing.bin'], batch_size=2), 3)
+        self.assertEqual(self.server.objects, {})
+
+    def test_listdir_pages(self):
+        for name in ('docs/a.pdf', 'docs/b.pdf', 'docs/c.pdf', 'docs/sub/d.pdf', 'docs/sub2/e.pdf', 'other/f.pdf'):
+            self.storage.upload_to_key(name, ContentFile(b'x'))
+        self.assertEqual(self.storage.listdir('docs', page_size=2),
+                         (['sub', 'sub2'], ['a.pdf', 'b.pdf', 'c.pdf']))
+        self.assertEqual(self.storage.listdir('', page_size=2), (['docs', 'other'], []))
+
+
+def closing_async_client(test):
+    """异步测试结束时关闭当前事件循环的共享 AsyncClient"""
+    @functools.wraps(test)
+    async def wrapper(self):
+        try:
+            await test(self)
+        finally:
+            await aclose_http_client()
+    return wrapper
+
+
+class AsyncStorageTests(StandinStorageMixin, SimpleTestCase):
+    """异步存储：asave / aexists / aurl / aopen / asize / asave_many / asigned_urls 与同步接口结果一致"""
+
+    @closing_async_client
+    async def test_save_and_read(self):
+        storage = self.make_storage(AsyncSupabaseStorage)
+        data = bytes(range(256)) * 16
+        name = await storage.asave('async/a.bin', ContentFile(data))
+        self.assertEqual(self.server.objects[f'media/{name}'][0], data)
+        self.assertTrue(await storage.aexists(name))
+        self.assertFalse(await storage.aexists('async/missing.bin'))
+        self.assertEqual(await storage.aurl(name), storage.url(name))
+        self.assertEqual(await storage.asize(name), len(data))
+        reader = await storage.aopen(name)
+        reader.seek(100)
+        self.assertEqual(await reader.read(10), data[100:110])
+        self.assertEqual(b''.join([chunk async for chunk in reader.chunks(1000)]), data)
+
+    @closing_async_client
+    async def test_save_many_concurrently(self):
+        storage = self.make_storage(AsyncSupabaseStorage, content_addressed=True)
+        items = [(f'async/{i}.pdf', ContentFile(f'%PDF {i}'.encode())) for i in range(4)]
+        items.append(('async/copy.pdf', ContentFile(b'%PDF 0')))
+        names = await storage.asave_many(items)
+        self.assertEqual(names[0], names[4])
+        self.assertEqual(len(set(names)), 4)
+        self.assertEqual({f'media/{name}' for name in names}, set(self.server.objects))
+        # 同时发出的请求各占一个连接
+        self.assertGreater(self.server.connections, 1)
+
+    @mock.patch('trade_project.storage_backends.TUS_CHUNK_SIZE', 1024)
+    @closing_async_client
+    async def test_resumable_save(self):
+        storage = self.make_storage(AsyncSupabaseStorage)
+        data = b'0123456789' * 500
+        name = await storage.asave('async/big.bin', ContentFile(data))
+        self.assertEqual(self.server.objects[f'media/{name}'][0], data)
+        self.assertEqual(self.server.uploads_received, 0)
+
+    @closing_async_client
+    async def test_signed_urls(self):
+        with mock.patch.dict('os.environ', {'SUPABASE_PRIVATE_BUCKET': 'true'}):
+            storage = self.make_storage(AsyncSupabaseStorage)
+        urls = await storage.asigned_urls(['a.pdf', 'b.pdf'])
+        self.assertEqual(set(urls), {'a.pdf', 'b.pdf'})
+        self.assertEqual(await storage.aurl('a.pdf'), urls['a.pdf'])
+        self.assertEqual(self.server.sign_requests, 1)
+
+
+class MediaMigrationTests(StandinStorageMixin, TestCase):
+    """migrate_media_to_supabase：清单记录进度，失败后重跑只补传未完成的文件；远端内容一致的文件跳过"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        env = mock.patch.dict('os.environ', {'SUPABASE_URL': self.server.base_url, 'SUPABASE_SERVICE_KEY': 'key',
+                                             'SUPABASE_BUCKET': 'media'})
+        env.start()
+        self.addCleanup(env.stop)
+        company = Company.objects.create(company_name='Buyer Co', country='CN')
+        contact = Contact.objects.create(company=company, name='Buyer', email='buyer@example.com')
+        inquiry = Inquiry.objects.create(inquiry_number='INQ-M', contact=contact)
+        local = FileSystemStorage(location=self.media_root)
+        self.files = {}
+        for i in range(3):
+            name = f'attachments/inquiries/part{i}.pdf'
+            self.files[name] = f'%PDF drawing {i}'.encode()
+            local.save(name, ContentFile(self.files[name]))
+        InquiryAttachment.objects.bulk_create([
+            InquiryAttachment(inquiry=inquiry, file=name, file_name=os.path.basename(name))
+            for name in [*self.files, 'attachments/inquiries/missing.pdf']
+        ])
+        self.manifest = os.path.join(self.media_root, '.supabase_migration.jsonl')
+
+    def migrate(self):
+        out = io.StringIO()
+        call_command('migrate_media_to_supabase', workers=2, stdout=out)
+        return out.getvalue()
+
+    def manifest_entries(self):
+        with open(self.manifest, encoding='utf-8') as f:
+            return {entry['path']: entry['status'] for entry in map(json.loads, f)}
+
+    def test_manifest_and_resume(self):
+        real_upload = SupabaseStorage.upload_to_key
+
+        def flaky_upload(storage, name, *args, **kwargs):
+            if name.endswith('part1.pdf'):
+                raise OSError('connection reset')
+            return real_upload(storage, name, *args, **kwargs)
+
+        with mock.patch.object(SupabaseStorage, 'upload_to_key', flaky_upload):
+            with self.assertRaisesMessage(CommandError, '1 files failed'):
+                self.migrate()
+        self.assertEqual(self.manifest_entries(), {
+            'attachments/inquiries/part0.pdf': 'uploaded', 'attachments/inquiries/part2.pdf': 'uploaded'})
+
+        output = self.migrate()
+        self.assertIn('1 files', output)
+        self.assertIn('2 already in manifest, 1 missing locally', output)
+        self.assertEqual(self.server.uploads_received, 3)
+        self.assertEqual({key: obj[0] for key, obj in self.server.objects.items()},
+                         {f'media/{name}': data for name, data in self.files.items()})
+
+        self.assertIn('0 files', self.migrate())
+        self.assertEqual(self.server.uploads_received, 3)
+
+    def test_matching_remote_objects_are_skipped(self):
+        self.migrate()
+        os.remove(self.manifest)
+        changed = 'attachments/inquiries/part2.pdf'
+        with open(os.path.join(self.media_root, changed), 'wb') as f:
+            f.write(b'X' * len(self.files[changed]))
+        output = self.migrate()
+        self.assertIn('Uploaded 1, skipped 2', output)
+        self.assertEqual(self.server.uploads_received, 4)
+        self.assertEqual(self.server.objects[f'media/{changed}'][0], b'X' * len(self.files[changed]))
+
+
+class DashboardStatsTests(TestCase):
+    """仪表板统计：一条查询得到各状态数量；新建、删除、状态变化（含价格表 bulk_update）后缓存失效"""
+
+    def setUp(self):
+        cache.clear()
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.company = Company.objects.create(company_name='Buyer Co', country='CN')
+        self.contact = Contact.objects.create(company=self.company, name='Buyer', email='buyer@example.com')
+        other = Contact.objects.create(company=Company.objects.create(company_name='Other Co', country='CN'),
+                                       name='Other', email='other@example.com')
+        self.inquiry = Inquiry.objects.create(inquiry_number='INQ-D1', contact=self.contact)
+        InquiryItem.objects.create(inquiry=self.inquiry, product_name='Flange', material_name='SS', quantity=1)
+        Inquiry.objects.create(inquiry_number='INQ-D2', contact=self.contact, status='quoted')
+        Inquiry.objects.create(inquiry_number='INQ-D3', contact=other)
+        self.order = Order.objects.create(order_number='ORD-D1', contact=self.contact)
+        Order.objects.create(order_number='ORD-D2', contact=other)
+
+    def cached(self, company_id=None):
+        scope = dashboard.GLOBAL_SCOPE if company_id is None else dashboard.company_scope(company_id)
+        return cache.get(dashboard.cache_key(scope))
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            stats = dashboard.compute_stats()
+        self.assertEqual((stats['inquiry_count'], stats['order_count']), (3, 2))
+        self.assertEqual((stats['pending_inquiries'], stats['inquiry_status']['quoted']), (2, 1))
+        with self.assertNumQueries(1):
+            stats = dashboard.dashboard_stats(self.company.pk)
+        self.assertEqual((stats['inquiry_count'], stats['order_count'], stats['pending_inquiries']), (2, 1, 1))
+        with self.assertNumQueries(0):
+            self.assertEqual(dashboard.dashboard_stats(self.company.pk), stats)
+
+    def test_invalidated_on_status_change_create_and_delete(self):
+        def primed():
+            cache.clear()
+            dashboard.dashboard_stats()
+            dashboard.dashboard_stats(self.company.pk)
+
+        primed()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.inquiry.customer_notes = 'no status change'
+            self.inquiry.save()
+        self.assertIsNotNone(self.cached(self.company.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.inquiry.status = 'cancelled'
+            self.inquiry.save()
+        self.assertIsNone(self.cached())
+        self.assertIsNone(self.cached(self.company.pk))
+        self.assertEqual(dashboard.dashboard_stats(self.company.pk)['inquiry_status']['cancelled'], 1)
+
+        primed()
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(order_number='ORD-D3', contact=self.contact)
+        self.assertIsNone(self.cached(self.company.pk))
+        self.assertEqual(dashboard.dashboard_stats(self.company.pk)['order_count'], 2)
+
+        primed()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.delete()
+        self.assertIsNone(self.cached(self.company.pk))
+        self.assertEqual(dashboard.dashboard_stats()['order_count'], 2)
+
+    def test_invalidated_by_price_sheet_bulk_update(self):
+        dashboard.dashboard_stats()
+        dashboard.dashboard_stats(self.company.pk)
+        self.client.force_login(self.supplier)
+        with self.captureOnCommitCallbacks(execute=True):
+            sheet = SimpleUploadedFile('sheet.csv', '询单号,行号,报价单价(USD)\nINQ-D1,1,10.00\n'.encode('utf-8-sig'),
+                                       content_type='text/csv')
+            response = self.client.post(reverse('supplier_quote_import'), {'sheet': sheet})
+        self.assertEqual(response.context['report'].quoted, [('INQ-D1', 1)])
+        self.assertIsNone(self.cached())
+        self.assertIsNone(self.cached(self.company.pk))
+        self.assertEqual(dashboard.dashboard_stats(self.company.pk)['inquiry_status']['quoted'], 2)
+
+
+class ContactAccessTests(TestCase):
+    """联系人解析：角色校验只读 session 中的联系人信息，联系人保存/删除后失效；没有联系人时返回首页"""
+
+    def setUp(self):
+        cache.clear()
+        company = Company.objects.create(company_name='Buyer Co', country='CN')
+        self.buyer = User.objects.create_user('buyer@example.com', 'buyer@example.com', 'pw')
+        self.contact = Contact.objects.create(company=company, user=self.buyer, name='Buyer',
+                                              email='buyer@example.com', approval_status='approved')
+        self.supplier = User.objects.create_user('supplier@example.com', 'supplier@example.com', 'pw')
+        Contact.objects.create(company=Company.objects.create(company_name='Supplier Co', country='CN'),
+                               user=self.supplier, name='Supplier', email='supplier@example.com',
+                               role='supplier', approval_status='approved')
+        self.session = SessionStore()
+
+    def request(self, user):
+        request = RequestFactory().get('/')
+        request.user, request.session = user, self.session
+        return request
+
+    def test_role_gate(self):
+        self.client.force_login(self.buyer)
+        self.assertRedirects(self.client.get(reverse('supplier_inquiry_list')), reverse('home'),
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('inquiry_list')).status_code, 200)
+        self.client.force_login(self.supplier)
+        self.assertEqual(self.client.get(reverse('supplier_inquiry_list')).status_code, 200)
+
+    def test_missing_contact_redirects_home(self):
+        nobody = User.objects.create_user('nobody@example.com', 'nobody@example.com', 'pw')
+        self.client.force_login(nobody)
+        self.assertRedirects(self.client.get(reverse('inquiry_list')), reverse('home'),
+                             fetch_redirect_response=False)
+
+        # 联系人被解绑但未触发信号：session 中的信息仍在，加载联系人时发现不存在
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(reverse('inquiry_list')).status_code, 200)
+        Contact.objects.filter(pk=self.contact.pk).update(user=None)
+        self.assertRedirects(self.client.get(reverse('inquiry_list')), reverse('home'),
+                             fetch_redirect_response=False)
+
+    def test_info_cached_in_session_until_contact_saved(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_contact_info(self.request(self.buyer))['role'], 'buyer')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_contact_info(self.request(self.buyer))['id'], self.contact.pk)
+
+        self.contact.role = 'supplier'
+        self.contact.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_contact_info(self.request(self.buyer))['role'], 'supplier')
+
+        self.contact.delete()
+        self.assertEqual(get_contact_info(self.request(self.buyer)), {})
+
+    @override_settings(CONTACT_INFO_TTL=-1)
+    def test_info_reloaded_after_ttl(self):
+        get_contact_info(self.request(self.buyer))
+        with self.assertNumQueries(1):
+            get_contact_info(self.request(self.buyer))
+
+    def test_middleware_loads_contact_lazily(self):
+        middleware = ContactMiddleware(lambda request: request)
+        with self.assertNumQueries(0):
+            request = middleware(self.request(self.buyer))
+        with self.assertNumQueries(1):
+            self.assertEqual(request.contact.company.company_name, 'Buyer Co')
+            self.assertEqual(request.contact_info['id'], self.contact.pk)
@@ -0,0 +1,173 @@
+"""
+图纸 / 图片缩略图
+
+- 图片（png/jpg/jpeg）用 Pillow 生成缩略图；PDF 渲染第一页（需要 pypdfium2 或系统 pdftoppm，二者都没有时跳过）。
+- 缩略图与原文件放在一起：内容寻址文件为 cas/xx/<摘要>.thumb.webp，按内容摘要命名，
+  同一份文件无论被引用多少次只生成一次；旧路径文件为 <原路径>.thumb.webp（保留原扩展名）。
+- 生成在后台线程中进行（事务提交之后），不占用请求时间；已存在的缩略图不会重新生成。
+  历史文件可用 `python manage.py generate_thumbnails` 补齐。
+"""
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from trade_project.storage_backends import CAS_PREFIX, digest_from_key
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+PDF_EXTENSIONS = {'.pdf'}
+THUMBNAIL_SIZE = (320, 320)
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = set()
+
+
+def _thumbnail_format():
+    from PIL import features
+    return ('WEBP', '.webp') if features.check('webp') else ('PNG', '.png')
+
+
+def supports_thumbnail(name):
+    ext = os.path.splitext(name or '')[1].lower()
+    return ext in IMAGE_EXTENSIONS or ext in PDF_EXTENSIONS
+
+
+def thumbnail_name(name):
+    """原文件对应的缩略图路径；不支持的类型返回 None"""
+    if not name or not supports_thumbnail(name):
+        return None
+    suffix = _thumbnail_format()[1]
+    digest = digest_from_key(name)
+    if digest:
+        return f'{CAS_PREFIX}/{digest[:2]}/{digest}.thumb{suffix}'
+    # 保留完整文件名：同目录下的 part.pdf 与 part.png 各有自己的缩略图
+    return f'{name}.thumb{suffix}'
+
+
+def _render_pdf_first_page(path):
+    """PDF 第一页渲染为 PIL.Image；没有可用的渲染器时返回 None"""
+    try:
+        import pypdfium2
+    except ImportError:
+        pypdfium2 = None
+    if pypdfium2 is not None:
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            page = pdf[0]
+            scale = max(THUMBNAIL_SIZE) / max(page.get_size())
+            return page.render(scale=scale).to_pil()
+        finally:
+            pdf.close()
+    if shutil.which('pdftoppm'):
+        from PIL import Image
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'page')
+            subprocess.run(
+                ['pdftoppm', '-f', '1', '-l', '1', '-png', '-singlefile',
+                 '-scale-to', str(max(THUMBNAIL_SIZE)), path, out],
+                check=True, capture_output=True, timeout=60,
+            )
+            with Image.open(out + '.png') as im:
+                im.load()
+                return im.copy()
+    return None
+
+
+def render_thumbnail(source, ext):
+    """把文件对象渲染为缩略图字节；无法渲染时返回 None"""
+    from PIL import Image, ImageOps
+    if ext in PDF_EXTENSIONS:
+        # PDF 渲染器需要本地路径：分块写入临时文件
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                tmp.write(chunk)
+            tmp.flush()
+            image = _render_pdf_first_page(tmp.name)
+        if image is None:
+            return None
+    else:
+        image = Image.open(source)
+        # draft() 让 JPEG 解码时直接缩小，避免把大图完整解码进内存
+        image.draft('RGB', THUMBNAIL_SIZE)
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail(THUMBNAIL_SIZE)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    fmt = _thumbnail_format()[0]
+    out = io.BytesIO()
+    image.save(out, fmt, quality=80) if fmt == 'WEBP' else image.save(out, fmt, optimize=True)
+    return out.getvalue()
+
+
+def ensure_thumbnail(name, storage=None):
+    """生成并保存缩略图（已存在则跳过）；返回缩略图路径或 None"""
+    storage = storage or default_storage
+    thumb = thumbnail_name(name)
+    if not thumb:
+        return None
+    if storage.exists(thumb):
+        return thumb
+    with storage.open(name, 'rb') as source:
+        data = render_thumbnail(source, os.path.splitext(name)[1].lower())
+    if data is None:
+        return None
+    content = ContentFile(data, name=os.path.basename(thumb))
+    if hasattr(storage, 'upload_to_key'):
+        # 内容寻址存储按摘要重命名；缩略图需要保存在固定路径
+        storage.upload_to_key(thumb, content, content_type='image/' + thumb.rsplit('.', 1)[1])
+    else:
+        storage.save(thumb, content)
+    return thumb
+
+
+def _generate(names):
+    for name in names:
+        try:
+            ensure_thumbnail(name)
+        except Exception:
+            logger.warning("thumbnail generation failed for %s", name, exc_info=True)
+        finally:
+            with _executor_lock:
+                _in_flight.discard(name)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def schedule_thumbnails(names):
+    """事务提交后在后台线程中生成缩略图；THUMBNAIL_WORKERS=0 时不生成（改用管理命令补齐）"""
+    if not getattr(settings, 'THUMBNAIL_WORKERS', 2):
+        return
+    names = [n for n in names if n and supports_thumbnail(n)]
+    if not names:
+        return
+
+    def submit():
+        # 提交之后才登记为进行中：事务回滚时 on_commit 不执行，不会留下永远“进行中”的名字
+        with _executor_lock:
+            pending = [n for n in names if n not in _in_flight]
+            _in_flight.update(pending)
+        if pending:
+            _get_executor().submit(_generate, pending)
+
+    transaction.on_commit(submit)
@@ -1,30 +1,72 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.template.loader import render_to_string
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils.translation import gettext as _
 from django.db import transaction
 from django.utils import timezone
-from django.utils.crypto import get_random_string
 from django.contrib.auth.models import User
-from django.db.models import Q
-from django.http import JsonResponse
+from django.db.models import Prefetch, Q, prefetch_related_objects
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_http_methods
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.db.utils import OperationalError
 from django.db import connection
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
+import json
 import os
 
+from . import activity, direct_uploads, notifications, realtime
 from .models import Company, Contact, Inquiry, InquiryItem, InquiryAttachment, Order, OrderItem, OrderAttachment, Message, MessageAttachment
+from .attachments import AttachmentUploadBatch, prefetch_thread_file_urls
+from .conditional import conditional_detail, own_contact, own_user
+from .dashboard import dashboard_stats, invalidate_stats
+from .exports import apply_list_filters, export_response
+from .decorators import contact_required
+from .middleware import get_contact, get_contact_info, remember_contact
+from .numbering import next_inquiry_number, next_order_number
+from .pagination import KeysetPage, RankedPage
+from .quotes import QUOTABLE_STATUSES, collect_item_prices, import_price_sheet, price_sheet_response, save_item_prices
+from .search import search_ids
 from .forms import (
+    BomImportForm,
     BuyerRegistrationForm, 
     InquiryForm, 
     InquiryItemFormSet, 
     OrderForm, 
     OrderItemFormSet,
+    PriceSheetForm,
     SupplierRegistrationForm
 )
 
+# ==================== 详情页数据 ====================
+# 详情页一次取出询单/订单及联系人、公司、负责人；渲染前再按固定条数的查询预取明细、附件与消息，
+# 查询数与消息条数无关
+INQUIRY_DETAIL = Inquiry.objects.select_related('contact__user', 'contact__company', 'quoted_by')
+ORDER_DETAIL = Order.objects.select_related('contact__user', 'contact__company', 'confirmed_by', 'inquiry')
+
+def message_page(obj, request, params=None):
+    """沟通消息的一页（按 (created_at, id) 倒序）：发送人随查询取出，只为本页预取消息附件"""
+    return KeysetPage(obj.messages.select_related('sender'), request,
+                      per_page=getattr(settings, 'MESSAGE_PAGE_SIZE', 30), prefetch=('attachments',), params=params)
+
+
+def load_thread(obj, request):
+    """预取详情页用到的明细、附件、最新一页消息及文件 URL，标记会话已读，返回消息页"""
+    # 明细按创建顺序排列，页面上的行号与价格表中的行号一致
+    items = Prefetch('items', queryset=obj.items.model.objects.order_by('id'))
+    prefetch_related_objects([obj], items, 'attachments')
+    activity.mark_read(request.user.id, obj._meta.model_name, obj.pk)
+    thread = message_page(obj, request, params={})
+    prefetch_thread_file_urls(obj, thread.object_list)
+    return thread
+
+
 # ==================== 获取或创建供应商公司 ====================
 def get_supplier_company():
     """获取或创建供应商公司（宝鸡蕴杰金属制品有限公司）"""
@@ -104,6 +146,7 @@ def supplier_login(request):
                 return redirect('supplier_login')
             
             login(request, user)
+            remember_contact(request, contact)
             messages.success(request, f'欢迎回来，{contact.name}！')
             return redirect('supplier_dashboard')
         else:
@@ -114,32 +157,25 @@ def supplier_login(request):
 
 # ==================== Supplier 仪表板 ====================
 @login_required
+@contact_required('supplier')
 def supplier_dashboard(request):
     """Supplier 仪表板 - 显示所有询单和订单"""
-    try:
-        contact = Contact.objects.get(user=request.user, role='supplier')
-    except Contact.DoesNotExist:
-        messages.error(request, _('您不是供应商账号。'))
-        return redirect('home')
-    
-    # 供应商可以看到所有询单和订单
-    inquiries = Inquiry.objects.all()
-    orders = Order.objects.all()
+    contact = request.contact
     
+    # 供应商可以看到所有询单和订单；计数来自缓存的全局统计
     context = {
         'contact': contact,
-        'inquiry_count': inquiries.count(),
-        'order_count': orders.count(),
-        'pending_inquiries': inquiries.filter(status='pending').count(),
-        'pending_orders': orders.filter(status='pending').count(),
-        'recent_inquiries': inquiries[:10],
-        'recent_orders': orders[:10],
+        **dashboard_stats(),
+        # 最近有动态的询单/订单，附带当前用户的未读数
+        'recent_inquiries': activity.recent(Inquiry.objects.select_related('contact__company'), 'inquiry', request.user.id, 10),
+        'recent_orders': activity.recent(Order.objects.select_related('contact__company'), 'order', request.user.id, 10),
     }
     
     return render(request, 'orders/supplier_dashboard.html', context)
 
 # =====================获取询单详细信息=========================================
 @login_required
+@conditional_detail(Inquiry, 'inquiry_id', scope=own_user)
 def get_inquiry_details(request, inquiry_id):
     """获取询单详细信息的API端点"""
     try:
@@ -174,32 +210,32 @@ def get_inquiry_details(request, inquiry_id):
         return JsonResponse({'success': False, 'error': str(e)})
 # ==================== Supplier 查看所有询单 ====================
 @login_required
+@contact_required('supplier')
 def supplier_inquiry_list(request):
     """供应商查看所有询单列表"""
-    try:
-        contact = Contact.objects.get(user=request.user, role='supplier')
-    except Contact.DoesNotExist:
-        messages.error(request, _('您不是供应商账号。'))
-        return redirect('home')
+    contact = request.contact
     
-    inquiries = Inquiry.objects.all().prefetch_related('items', 'attachments').order_by('-created_at')
+    inquiries = Inquiry.objects.select_related('contact__company', 'quoted_by')
     
     # 筛选功能
     status = request.GET.get('status')
     if status:
         inquiries = inquiries.filter(status=status)
 
-    # 检索：询单号、产品名称
+    # 全文检索：单号、公司、联系人、产品/材料/规格、备注（按相关度排序）
+    # 未读数来自会话消息数与已读状态；可按最近活动排序
+    inquiries = activity.with_unread(inquiries, 'inquiry', request.user.id)
+    sort, order_field = activity.sort_field(request)
     q = (request.GET.get('q') or '').strip()
     if q:
-        inquiries = inquiries.filter(
-            Q(inquiry_number__icontains=q) |
-            Q(items__product_name__icontains=q)
-        ).distinct()
-    
+        page = RankedPage(inquiries, search_ids('inquiry', q, scope=inquiries), request)
+    else:
+        page = KeysetPage(inquiries, request, order_field=order_field)
     return render(request, 'orders/supplier_inquiry_list.html', {
         'contact': contact,
-        'inquiries': inquiries,
+        'inquiries': page.object_list,
+        'page': page,
+        'sort': sort,
         'q': q,
         'status': status or ''
     })
@@ -207,18 +243,22 @@ def supplier_inquiry_list(request):
 
 # ==================== Supplier 查看询单详情并报价 ====================
 @login_required
+@contact_required('supplier')
+@conditional_detail(Inquiry, 'inquiry_id')
 def supplier_inquiry_detail(request, inquiry_id):
     """供应商查看询单详情并进行报价"""
-    try:
-        contact = Contact.objects.get(user=request.user, role='supplier')
-    except Contact.DoesNotExist:
-        messages.error(request, _('您不是供应商账号。'))
-        return redirect('home')
+    contact = request.contact
     
-    inquiry = get_object_or_404(Inquiry, id=inquiry_id)
+    inquiry = get_object_or_404(INQUIRY_DETAIL, id=inquiry_id)
     
     # POST 请求：提交报价
     if request.method == 'POST':
+        # 先校验全部明细单价，有任何错误都不写库
+        items = list(inquiry.items.order_by('id'))
+        prices, price_errors = collect_item_prices(items, request.POST)
+        if price_errors:
+            messages.error(request, _('报价失败：%(error)s') % {'error': '；'.join(price_errors)})
+            return redirect('supplier_inquiry_detail', inquiry_id=inquiry.id)
         try:
             with transaction.atomic():
                 # 销售锁定规则：一旦已有 quoted_by，则仅允许该销售继续操作
@@ -236,53 +276,52 @@ def supplier_inquiry_detail(request, inquiry_id):
                     inquiry.quoted_by = request.user
                 inquiry.save()
                 
-                # 更新每个产品的报价
-                for item in inquiry.items.all():
-                    quoted_price = request.POST.get(f'item_{item.id}_price')
-                    if quoted_price:
-                        item.quoted_price = quoted_price
-                        item.save()
+                # 更新明细报价（一次批量写入）
+                save_item_prices(prices)
+                notifications.inquiries_quoted([inquiry])
                 
             messages.success(request, _('询单 %(inquiry_number)s 报价成功！') % {'inquiry_number': inquiry.inquiry_number})
             return redirect('supplier_inquiry_detail', inquiry_id=inquiry.id)
         except Exception as e:
             messages.error(request, _('报价失败：%(error)s') % {'error': str(e)})
     
+    thread = load_thread(inquiry, request)
     return render(request, 'orders/supplier_inquiry_detail.html', {
         'contact': contact,
-        'inquiry': inquiry
+        'inquiry': inquiry,
+        'thread': thread,
+        'live': realtime.live_options(request),
     })
 
 
 # ==================== Supplier 查看所有订单 ====================
 @login_required
+@contact_required('supplier')
 def supplier_order_list(request):
     """供应商查看所有订单列表"""
-    try:
-        contact = Contact.objects.get(user=request.user, role='supplier')
-    except Contact.DoesNotExist:
-        messages.error(request, _('您不是供应商账号。'))
-        return redirect('home')
+    contact = request.contact
     
-    orders = Order.objects.all().prefetch_related('items', 'attachments').order_by('-created_at')
+    orders = Order.objects.select_related('contact__company', 'confirmed_by', 'inquiry__quoted_by')
     
     # 筛选功能
     status = request.GET.get('status')
     if status:
         orders = orders.filter(status=status)
 
-    # 检索：订单号、产品名称、客户订单号
+    # 全文检索：单号、公司、联系人、产品/材料/规格、备注（按相关度排序）
+    # 未读数来自会话消息数与已读状态；可按最近活动排序
+    orders = activity.with_unread(orders, 'order', request.user.id)
+    sort, order_field = activity.sort_field(request)
     q = (request.GET.get('q') or '').strip()
     if q:
-        orders = orders.filter(
-            Q(order_number__icontains=q) |
-            Q(items__product_name__icontains=q) |
-            Q(customer_order_number__icontains=q)
-        ).distinct()
-    
+        page = RankedPage(orders, search_ids('order', q, scope=orders), request)
+    else:
+        page = KeysetPage(orders, request, order_field=order_field)
     return render(request, 'orders/supplier_order_list.html', {
         'contact': contact,
-        'orders': orders,
+        'orders': page.object_list,
+        'page': page,
+        'sort': sort,
         'q': q,
         'status': status or ''
     })
@@ -290,15 +329,13 @@ def supplier_order_list(request):
 
 # ==================== Supplier 查看订单详情并更新状态 ====================
 @login_required
+@contact_required('supplier')
+@conditional_detail(Order, 'order_id')
 def supplier_order_detail(request, order_id):
     """供应商查看订单详情并更新状态"""
-    try:
-        contact = Contact.objects.get(user=request.user, role='supplier')
-    except Contact.DoesNotExist:
-        messages.error(request, _('您不是供应商账号。'))
-        return redirect('home')
+    contact = request.contact
     
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(ORDER_DETAIL, id=order_id)
     
     # POST 请求：更新订单状态
     if request.method == 'POST':
@@ -352,33 +389,35 @@ def supplier_order_detail(request, order_id):
                 order.supplier_notes = request.POST.get('supplier_notes', '')
                 messages.success(request, _('备注已更新！'))
             
-            order.save()
+            with transaction.atomic():
+                order.save()
+                # 状态变化通知买家（与订单在同一事务中写入发件箱）
+                notifications.order_status(order, action)
             return redirect('supplier_order_detail', order_id=order.id)
         except Exception as e:
             messages.error(request, _('操作失败：%(error)s') % {'error': str(e)})
     
+    thread = load_thread(order, request)
     return render(request, 'orders/supplier_order_detail.html', {
         'contact': contact,
-        'order': order
+        'order': order,
+        'thread': thread,
+        'live': realtime.live_options(request),
     })
 
 # ==================== 首页 ====================
 # 修改原有的 home 视图，支持供应商跳转
 def home(request):
     """首页 - 显示欢迎页面"""
-    contact = None
-    if request.user.is_authenticated:
-        try:
-            contact = Contact.objects.get(user=request.user)
-            if contact.approval_status == 'approved':
-                if contact.role == 'buyer':
-                    return redirect('buyer_dashboard')
-                elif contact.role == 'supplier':
-                    return redirect('supplier_dashboard')
-        except Contact.DoesNotExist:
-            pass
+    # 跳转判断只用 session 中的联系人信息，不查询数据库
+    info = get_contact_info(request)
+    if info.get('approval_status') == 'approved':
+        if info['role'] == 'buyer':
+            return redirect('buyer_dashboard')
+        elif info['role'] == 'supplier':
+            return redirect('supplier_dashboard')
     
-    return render(request, 'orders/home.html', {'contact': contact})
+    return render(request, 'orders/home.html', {'contact': get_contact(request)})
 
 
 # ==================== Buyer 注册 ====================
@@ -449,6 +488,7 @@ def buyer_login(request):
                     messages.error(request, _('该账号不是有效的买家账号。'))
                     return redirect('buyer_login')
                 login(request, user)
+                remember_contact(request, contact)
                 messages.success(request, _('欢迎回来，%(name)s！') % {'name': contact.name})
                 return redirect('buyer_dashboard')
             else:
@@ -470,26 +510,17 @@ def buyer_logout(request):
 
 # ==================== Buyer 仪表板 ====================
 @login_required
+@contact_required()
 def buyer_dashboard(request):
     """Buyer 仪表板 - 显示概览信息"""
-    try:
-        contact = Contact.objects.get(user=request.user)
-    except Contact.DoesNotExist:
-        messages.error(request, _('未找到联系人信息。'))
-        return redirect('home')
-    
-    # 统计数据
-    inquiries = Inquiry.objects.filter(contact=contact)
-    orders = Order.objects.filter(contact=contact)
+    contact = request.contact
     
+    # 统计数据：与询单/订单列表一致，按公司统计（缓存）
     context = {
         'contact': contact,
-        'inquiry_count': inquiries.count(),
-        'order_count': orders.count(),
-        'pending_inquiries': inquiries.filter(status='pending').count(),
-        'pending_orders': orders.filter(status='pending').count(),
-        'recent_inquiries': inquiries[:5],
-        'recent_orders': orders[:5],
+        **dashboard_stats(contact.company_id),
+        'recent_inquiries': activity.recent(Inquiry.objects.filter(contact__company_id=contact.company_id), 'inquiry', request.user.id, 5),
+        'recent_orders': activity.recent(Order.objects.filter(contact__company_id=contact.company_id), 'order', request.user.id, 5),
     }
     
     return render(request, 'orders/buyer_dashboard.html', context)
@@ -528,69 +559,78 @@ def health_version(request):
 
 # ==================== 我的询单列表 ====================
 @login_required
+@contact_required()
 def inquiry_list(request):
     """我的询单列表"""
-    try:
-        contact = Contact.objects.get(user=request.user)
-    except Contact.DoesNotExist:
-        messages.error(request, _('未找到联系人信息。'))
-        return redirect('home')
+    contact = request.contact
     # 买家可见范围：同公司内的所有询单
-    inquiries = Inquiry.objects.filter(contact__company=contact.company).prefetch_related('items', 'attachments').order_by('-created_at')
+    inquiries = Inquiry.objects.filter(contact__company=contact.company)
 
-    # 检索：询单号、产品名称
+    # 全文检索：单号、公司、联系人、产品/材料/规格、备注（按相关度排序）
+    # 未读数来自会话消息数与已读状态；可按最近活动排序
+    inquiries = activity.with_unread(inquiries, 'inquiry', request.user.id)
+    sort, order_field = activity.sort_field(request)
     q = (request.GET.get('q') or '').strip()
     if q:
-        inquiries = inquiries.filter(
-            Q(inquiry_number__icontains=q) |
-            Q(items__product_name__icontains=q)
-        ).distinct()
-
+        page = RankedPage(inquiries, search_ids('inquiry', q, scope=inquiries), request)
+    else:
+        page = KeysetPage(inquiries, request, order_field=order_field)
     return render(request, 'orders/inquiry_list.html', {
         'contact': contact,
-        'inquiries': inquiries,
+        'inquiries': page.object_list,
+        'page': page,
+        'sort': sort,
         'q': q
     })
 
 
 # ==================== 询单详情 ====================
 @login_required
+@contact_required()
+@conditional_detail(Inquiry, 'inquiry_id', scope=own_contact)
 def inquiry_detail(request, inquiry_id):
     """询单详情页面"""
-    try:
-        contact = Contact.objects.get(user=request.user)
-    except Contact.DoesNotExist:
-        messages.error(request, _('未找到联系人信息。'))
-        return redirect('home')
+    contact = request.contact
     
-    inquiry = get_object_or_404(Inquiry, id=inquiry_id, contact=contact)
+    inquiry = get_object_or_404(INQUIRY_DETAIL, id=inquiry_id, contact=contact)
     
+    thread = load_thread(inquiry, request)
     return render(request, 'orders/inquiry_detail.html', {
         'contact': contact,
-        'inquiry': inquiry
+        'inquiry': inquiry,
+        'thread': thread,
+        'live': realtime.live_options(request),
     })
 
 
 # ==================== 创建询单 ====================
 @login_required
+@contact_required()
 def inquiry_create(request):
     """创建询单页面"""
-    try:
-        contact = Contact.objects.get(user=request.user)
-    except Contact.DoesNotExist:
-        messages.error(request, _('未找到联系人信息。'))
-        return redirect('home')
+    contact = request.contact
     
     if request.method == 'POST':
         form = InquiryForm(request.POST)
         formset = InquiryItemFormSet(request.POST, request.FILES)
+        bom_form = BomImportForm(request.POST, request.FILES)
         
-        if form.is_valid() and formset.is_valid():
+        if form.is_valid() and formset.is_valid() and bom_form.is_valid():
+            # 明细图纸与询单附件先并发上传，全部成功后再写库
+            uploads = AttachmentUploadBatch()
+            item_rows = []
+            for item_form in formset:
+                if item_form.cleaned_data and not item_form.cleaned_data.get('DELETE', False):
+                    drawing = item_form.cleaned_data.get('drawing_file')
+                    drawing_ref = uploads.add(InquiryItem, 'drawing_file', drawing) if drawing else None
+                    item_rows.append((item_form.cleaned_data, drawing_ref))
+            # BOM 导入的明细（已整体校验通过）接在手工填写的明细之后
+            item_rows.extend((data, None) for data in bom_form.cleaned_data['items'])
+            attachment_refs = [uploads.add(InquiryAttachment, 'file', f) for f in request.FILES.getlist('attachments')]
             try:
-                with transaction.atomic():
-                    # 生成询单号
-                    inquiry_number = f"INQ-{timezone.now().strftime('%Y%m%d%H%M%S')}"
-                    
+                # 在创建事务之外分配询单号（计数器原子递增，并发提交不会重号）
+                inquiry_number = next_inquiry_number()
+                with uploads, transaction.atomic():
                     # 创建询单
                     inquiry = Inquiry.objects.create(
                         inquiry_number=inquiry_number,
@@ -600,30 +640,26 @@ def inquiry_create(request):
                         status='pending'
                     )
                     
-                    # 保存询单明细
-                    for item_form in formset:
-                        if item_form.cleaned_data and not item_form.cleaned_data.get('DELETE', False):
-                            InquiryItem.objects.create(
-                                inquiry=inquiry,
-                                product_name=item_form.cleaned_data['product_name'],
-                                material_name=item_form.cleaned_data['material_name'],
-                                material_grade=item_form.cleaned_data.get('material_grade', ''),
-                                quantity=item_form.cleaned_data['quantity'],
-                                unit=item_form.cleaned_data.get('unit', '件'),
-                                specifications=item_form.cleaned_data.get('specifications', ''),
-                                drawing_file=item_form.cleaned_data.get('drawing_file')
-                            )
-                    
-                    # 第 604-611 行
-                    # 处理附件上传
-                    files = request.FILES.getlist('attachments')
-                    for file in files:
-                        InquiryAttachment.objects.create(
+                    # 保存询单明细（一次写入，汇总字段随之刷新）
+                    InquiryItem.objects.bulk_create([
+                        InquiryItem(
                             inquiry=inquiry,
-                            file=file,
-                            file_name=file.name,  # 添加 file_name
-                            uploaded_by=request.user
+                            product_name=data['product_name'],
+                            material_name=data['material_name'],
+                            material_grade=data.get('material_grade', ''),
+                            quantity=data['quantity'],
+                            unit=data.get('unit', '件'),
+                            specifications=data.get('specifications', ''),
+                            drawing_file=drawing_ref.name if drawing_ref else None
                         )
+                        for data, drawing_ref in item_rows
+                    ])
+                    
+                    # 处理附件上传（文件已在上面并发上传完成）
+                    InquiryAttachment.objects.bulk_create([
+                        InquiryAttachment(inquiry=inquiry, uploaded_by=request.user, **ref.field_values())
+                        for ref in attachment_refs
+                    ])
 
                     messages.success(request, _('询单 %(inquiry_number)s 创建成功！') % {'inquiry_number': inquiry_number})
                     return redirect('inquiry_detail', inquiry_id=inquiry.id)
@@ -632,53 +668,52 @@ def inquiry_create(request):
     else:
         form = InquiryForm()
         formset = InquiryItemFormSet()
+        bom_form = BomImportForm()
     
     return render(request, 'orders/inquiry_create.html', {
         'contact': contact,
         'form': form,
-        'formset': formset
+        'formset': formset,
+        'bom_form': bom_form
     })
 
 
 # ==================== 我的订单列表 ====================
 @login_required
+@contact_required()
 def order_list(request):
     """我的订单列表"""
-    try:
-        contact = Contact.objects.get(user=request.user)
-    except Contact.DoesNotExist:
-        messages.error(request, _('未找到联系人信息。'))
-        return redirect('home')
+    contact = request.contact
     # 买家可见范围：同公司内的所有订单
-    orders = Order.objects.filter(contact__company=contact.company).prefetch_related('items', 'attachments').order_by('-created_at')
+    orders = Order.objects.filter(contact__company=contact.company)
 
-    # 检索：订单号、产品名称、客户订单号
+    # 全文检索：单号、公司、联系人、产品/材料/规格、备注（按相关度排序）
+    # 未读数来自会话消息数与已读状态；可按最近活动排序
+    orders = activity.with_unread(orders, 'order', request.user.id)
+    sort, order_field = activity.sort_field(request)
     q = (request.GET.get('q') or '').strip()
     if q:
-        orders = orders.filter(
-            Q(order_number__icontains=q) |
-            Q(items__product_name__icontains=q) |
-            Q(customer_order_number__icontains=q)
-        ).distinct()
-
+        page = RankedPage(orders, search_ids('order', q, scope=orders), request)
+    else:
+        page = KeysetPage(orders, request, order_field=order_field)
     return render(request, 'orders/order_list.html', {
         'contact': contact,
-        'orders': orders,
+        'orders': page.object_list,
+        'page': page,
+        'sort': sort,
         'q': q
     })
 
 
 # ==================== 订单详情 ====================
 @login_required
+@contact_required()
+@conditional_detail(Order, 'order_id', scope=own_contact)
 def order_detail(request, order_id):
     """订单详情页面"""
-    try:
-        contact = Contact.objects.get(user=request.user)
-    except Contact.DoesNotExist:
-        messages.error(request, _('未找到联系人信息。'))
-        return redirect('home')
+    contact = request.contact
     
-    order = get_object_or_404(Order, id=order_id, contact=contact)
+    order = get_object_or_404(ORDER_DETAIL, id=order_id, contact=contact)
     
     # 买家上传付款凭证（可选）
     if request.method == 'POST':
@@ -701,28 +736,112 @@ def order_detail(request, order_id):
                 messages.error(request, _('上传失败：%(error)s') % {'error': str(e)})
             return redirect('order_detail', order_id=order.id)
     
+    thread = load_thread(order, request)
     return render(request, 'orders/order_detail.html', {
         'contact': contact,
-        'order': order
+        'order': order,
+        'thread': thread,
+        'live': realtime.live_options(request),
+    })
+
+
+# ==================== 导出 ====================
+# 筛选条件与对应列表页相同；?format=csv|xlsx
+@login_required
+@contact_required()
+def inquiry_export(request):
+    """买家导出本公司询单（含明细）"""
+    queryset = Inquiry.objects.filter(contact__company_id=request.contact.company_id)
+    return export_response('inquiry', apply_list_filters('inquiry', queryset, request), request.GET.get('format'))
+
+
+@login_required
+@contact_required()
+def order_export(request):
+    """买家导出本公司订单（含明细）"""
+    queryset = Order.objects.filter(contact__company_id=request.contact.company_id)
+    return export_response('order', apply_list_filters('order', queryset, request), request.GET.get('format'))
+
+
+@login_required
+@contact_required('supplier')
+def supplier_inquiry_export(request):
+    """供应商导出全部询单（含明细）"""
+    queryset = apply_list_filters('inquiry', Inquiry.objects.all(), request)
+    return export_response('inquiry', queryset, request.GET.get('format'))
+
+
+@login_required
+@contact_required('supplier')
+def supplier_order_export(request):
+    """供应商导出全部订单（含明细）"""
+    queryset = apply_list_filters('order', Order.objects.all(), request)
+    return export_response('order', queryset, request.GET.get('format'))
+
+
+# ==================== 批量报价 ====================
+def quotable_inquiries(request):
+    """当前销售可以报价的询单：待报价/已报价，且未由其他销售负责"""
+    queryset = Inquiry.objects.filter(status__in=QUOTABLE_STATUSES).filter(
+        Q(quoted_by__isnull=True) | Q(quoted_by=request.user))
+    return apply_list_filters('inquiry', queryset, request)
+
+
+@login_required
+@contact_required('supplier')
+def supplier_price_sheet(request):
+    """下载价格表模板：可报价询单的全部明细，填写单价后上传"""
+    return price_sheet_response(quotable_inquiries(request), request.GET.get('format'))
+
+
+@login_required
+@contact_required('supplier')
+def supplier_quote_import(request):
+    """上传价格表，一次为多份询单报价"""
+    contact = request.contact
+    report = None
+    if request.method == 'POST':
+        form = PriceSheetForm(request.POST, request.FILES)
+        if form.is_valid():
+            report = import_price_sheet(request.user, uploaded=form.cleaned_data['sheet'])
+            if report.quoted:
+                messages.success(request, _('已为 %(inquiries)s 份询单报价，更新 %(lines)s 行单价。') % {
+                    'inquiries': len(report.quoted), 'lines': report.line_count})
+    else:
+        form = PriceSheetForm()
+    return render(request, 'orders/supplier_quote_import.html', {
+        'contact': contact,
+        'form': form,
+        'report': report
     })
 
 
 # ==================== 询单消息发送 ====================
 @login_required
 def inquiry_message_add(request, inquiry_id):
-    contact = get_object_or_404(Contact, user=request.user)
+    info = get_contact_info(request)
+    if not info:
+        raise Http404
     inquiry = get_object_or_404(Inquiry, id=inquiry_id)
     if request.method == 'POST':
         content = (request.POST.get('content') or '').strip()
         try:
-            with transaction.atomic():
+            uploads = AttachmentUploadBatch()
+            refs = [uploads.add(MessageAttachment, 'file', f) for f in request.FILES.getlist('files')]
+            with uploads, transaction.atomic():
                 msg = Message.objects.create(inquiry=inquiry, sender=request.user, content=content)
-                for f in request.FILES.getlist('files'):
-                    MessageAttachment.objects.create(message=msg, file=f, file_name=getattr(f, 'name', ''))
+                MessageAttachment.objects.bulk_create([
+                    MessageAttachment(message=msg, **ref.field_values()) for ref in refs
+                ])
+            if wants_json(request):
+                # 详情页异步发送：返回消息内容，页面直接追加，不再整页刷新
+                return JsonResponse({'success': True, 'message': realtime.message_data(msg.id)[2]})
             messages.success(request, _('消息已发送'))
         except Exception as e:
+            if wants_json(request):
+                return JsonResponse({'success': False, 'error': str(e)}, status=400)
             messages.error(request, _('发送失败：%(error)s') % {'error': str(e)})
-    if contact.role == 'supplier':
+    if info['role'] == 'supplier':
         return redirect('supplier_inquiry_detail', inquiry_id=inquiry.id)
     return redirect('inquiry_detail', inquiry_id=inquiry.id)
 
@@ -730,32 +849,180 @@ def inquiry_message_add(request, inquiry_id):
 # ==================== 订单消息发送 ====================
 @login_required
 def order_message_add(request, order_id):
-    contact = get_object_or_404(Contact, user=request.user)
+    info = get_contact_info(request)
+    if not info:
+        raise Http404
     order = get_object_or_404(Order, id=order_id)
     if request.method == 'POST':
         content = (request.POST.get('content') or '').strip()
         try:
-            with transaction.atomic():
+            uploads = AttachmentUploadBatch()
+            refs = [uploads.add(MessageAttachment, 'file', f) for f in request.FILES.getlist('files')]
+            with uploads, transaction.atomic():
                 msg = Message.objects.create(order=order, sender=request.user, content=content)
-                for f in request.FILES.getlist('files'):
-                    MessageAttachment.objects.create(message=msg, file=f, file_name=getattr(f, 'name', ''))
+                MessageAttachment.objects.bulk_create([
+                    MessageAttachment(message=msg, **ref.field_values()) for ref in refs
+                ])
+            if wants_json(request):
+                # 详情页异步发送：返回消息内容，页面直接追加，不再整页刷新
+                return JsonResponse({'success': True, 'message': realtime.message_data(msg.id)[2]})
             messages.success(request, _('消息已发送'))
         except Exception as e:
+            if wants_json(request):
+                return JsonResponse({'success': False, 'error': str(e)}, status=400)
             messages.error(request, _('发送失败：%(error)s') % {'error': str(e)})
-    if contact.role == 'supplier':
+    if info['role'] == 'supplier':
         return redirect('supplier_order_detail', order_id=order.id)
     return redirect('order_detail', order_id=order.id)
 
 
+# ==================== 消息实时推送 ====================
+def wants_json(request):
+    return request.headers.get('x-requested-with') == 'XMLHttpRequest' or \
+        'application/json' in request.headers.get('accept', '')
+
+
+def _thread_info(request, kind, pk):
+    """当前用户可访问的会话：返回联系人信息，否则抛出 Http404"""
+    info = get_contact_info(request)
+    if not info or not realtime.thread_visible(kind, pk, info.get('id'), info.get('role')):
+        raise Http404
+    return info
+
+
+def _after_id(value):
+    try:
+        return max(0, int(value or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+@login_required
+def thread_messages(request, kind, pk):
+    """增量消息：?after=<消息id> 之后的消息（按 id 升序）"""
+    _thread_info(request, kind, pk)
+    msgs = realtime.messages_since(kind, pk, _after_id(request.GET.get('after')))
+    return JsonResponse({
+        'success': True,
+        'messages': msgs,
+        'last_id': msgs[-1]['id'] if msgs else _after_id(request.GET.get('after')),
+    })
+
+
+@login_required
+def thread_history(request, kind, pk):
+    """更早的消息：?after=<游标> 返回下一页的 HTML 片段与下一页游标（没有更多时为空）"""
+    _thread_info(request, kind, pk)
+    obj = get_object_or_404(activity.THREADS[kind].objects.select_related('contact'), pk=pk)
+    page = message_page(obj, request)
+    prefetch_thread_file_urls(obj, page.object_list)
+    html = render_to_string('orders/message_items.html', {
+        'thread_messages': page.object_list,
+        'buyer_id': obj.contact.user_id,
+    }, request=request)
+    return JsonResponse({'success': True, 'html': html, 'next': page.next_cursor})
+
+
+@login_required
+@require_POST
+def thread_read(request, kind, pk):
+    """详情页收到实时推送的新消息后，把会话标记为已读"""
+    _thread_info(request, kind, pk)
+    activity.mark_read(request.user.id, kind, pk)
+    return JsonResponse({'success': True})
+
+
+@login_required
+def thread_events(request, kind, pk):
+    """SSE 事件流（WebSocket 不可用时的回退，仅 ASGI；WSGI 下页面轮询 thread_messages）"""
+    _thread_info(request, kind, pk)
+    if not realtime.push_available(request):
+        return JsonResponse({'success': False, 'error': _('实时推送需以 ASGI 方式运行')}, status=404)
+    after = _after_id(request.headers.get('last-event-id') or request.GET.get('after'))
+    response = StreamingHttpResponse(realtime.sse_stream(kind, pk, after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ==================== 浏览器直传 ====================
+def _json_body(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        raise ValidationError(_('请求格式错误'))
+
+
+def _error_message(e):
+    return '; '.join(e.messages) if isinstance(e, ValidationError) else str(e)
+
+
+@login_required
+@require_POST
+def upload_session_create(request, target, object_id):
+    """申请直传会话：返回每个文件的 token 与上传地址"""
+    contact = get_contact(request)
+    try:
+        obj = direct_uploads.get_target(contact, target, object_id)
+        body = _json_body(request)
+        files = direct_uploads.create_session(
+            request, target, obj, body.get('purpose', 'attachment'), body.get('files') or [])
+    except PermissionDenied:
+        return JsonResponse({'success': False, 'error': _('无权访问')}, status=403)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': _error_message(e)}, status=400)
+    return JsonResponse({
+        'success': True,
+        'files': files,
+        'finalize_url': reverse('upload_finalize'),
+    })
+
+
+@login_required
+@require_POST
+def upload_finalize(request):
+    """直传完成：校验文件并写入附件记录"""
+    contact = get_contact(request)
+    try:
+        body = _json_body(request)
+        created = direct_uploads.finalize(
+            request, contact, body.get('tokens'), (body.get('content') or '').strip())
+    except PermissionDenied:
+        return JsonResponse({'success': False, 'error': _('无权访问')}, status=403)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': _error_message(e)}, status=400)
+    data = {
+        'success': True,
+        'attachments': [
+            {'id': att.id, 'file_name': att.file_name, 'file_size': att.file_size, 'url': att.file.url}
+            for att in created
+        ],
+    }
+    message_id = getattr(created[0], 'message_id', None)
+    if message_id:
+        # 附带完整消息，详情页直接追加（推送到达时按 id 去重）
+        data['message'] = realtime.message_data(message_id)[2]
+    return JsonResponse(data)
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+def upload_local_put(request, token):
+    """本地存储的直传接口（存储不支持签发上传 URL 时使用），凭 token 写入"""
+    try:
+        payload = direct_uploads.load_token(token)
+        direct_uploads.save_local_upload(payload, request)
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'error': _error_message(e)}, status=400)
+    return JsonResponse({'success': True, 'key': payload['k']})
+
+
 # ==================== 创建订单 ====================
 @login_required
+@contact_required()
 def order_create(request):
     """创建订单"""
-    try:
-        contact = Contact.objects.get(user=request.user)
-    except Contact.DoesNotExist:
-        messages.error(request, _('未找到联系人信息。'))
-        return redirect('home')
+    contact = request.contact
     
     # 获取可选的询单列表（已报价的询单）
     available_inquiries = Inquiry.objects.filter(
@@ -765,17 +1032,13 @@ def order_create(request):
     
     if request.method == 'POST':
         inquiry_id = request.POST.get('inquiry_id')
+        uploads = AttachmentUploadBatch()
+        attachment_refs = [uploads.add(OrderAttachment, 'file', f) for f in request.FILES.getlist('attachments')]
         
         try:
-            with transaction.atomic():
-                # 生成唯一订单号（时间戳+随机数，确保唯一）
-                base_ts = timezone.now().strftime('%Y%m%d%H%M%S')
-                while True:
-                    order_number_candidate = f"ORD-{base_ts}{get_random_string(4, '0123456789')}"
-                    if not Order.objects.filter(order_number=order_number_candidate).exists():
-                        order_number = order_number_candidate
-                        break
-                
+            # 在创建事务之外分配订单号（计数器原子递增，无需查重）
+            order_number = next_order_number()
+            with uploads, transaction.atomic():
                 # 创建订单
                 # 合并备注：若提供了交货期（天），与客户备注合并保存
                 delivery_days = (request.POST.get('delivery_requirement', '') or '').strip()
@@ -806,34 +1069,32 @@ def order_create(request):
                                 items_data[index] = {}
                             items_data[index][field] = value
                 
-                # 创建订单明细项
-                for index, item_data in items_data.items():
-                    if item_data.get('product_name'):  # 确保有产品名称
-                        OrderItem.objects.create(
-                            order=order,
-                            product_name=item_data.get('product_name', ''),
-                            material_name=item_data.get('material_name', ''),
-                            material_grade=item_data.get('material_grade', ''),
-                            quantity=item_data.get('quantity', 0),
-                            unit=item_data.get('unit', 'PCS'),
-                            unit_price=item_data.get('unit_price', 0),
-                            specifications=item_data.get('specifications', '')
-                        )
-                
-                # 处理订单附件（可选，多文件）
-                files = request.FILES.getlist('attachments')
-                for f in files:
-                    OrderAttachment.objects.create(
+                # 创建订单明细项（一次写入，汇总字段随之刷新）
+                OrderItem.objects.bulk_create([
+                    OrderItem(
                         order=order,
-                        file=f,
-                        file_name=getattr(f, 'name', ''),
-                        description='订单附件',
-                        uploaded_by=request.user
+                        product_name=item_data.get('product_name', ''),
+                        material_name=item_data.get('material_name', ''),
+                        material_grade=item_data.get('material_grade', ''),
+                        quantity=item_data.get('quantity', 0),
+                        unit=item_data.get('unit', 'PCS'),
+                        unit_price=item_data.get('unit_price', 0),
+                        specifications=item_data.get('specifications', '')
                     )
+                    for index, item_data in items_data.items()
+                    if item_data.get('product_name')  # 确保有产品名称
+                ])
+                
+                # 处理订单附件（可选，多文件；文件已在进入事务前并发上传）
+                OrderAttachment.objects.bulk_create([
+                    OrderAttachment(order=order, description='订单附件', uploaded_by=request.user, **ref.field_values())
+                    for ref in attachment_refs
+                ])
                 
                 # 如果基于询单创建，更新询单状态
                 if inquiry_id:
-                    Inquiry.objects.filter(id=inquiry_id).update(status='ordered')
+                    Inquiry.objects.filter(id=inquiry_id).update(status='ordered', updated_at=timezone.now())
+                    invalidate_stats([contact.company_id])
                 
                 messages.success(request, _('订单 %(order_number)s 创建成功！') % {'order_number': order_number})
                 return redirect('order_detail', order_id=order.id)
@@ -3,6 +3,15 @@ ASGI config for trade_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+When Supabase storage is configured, ``default_storage`` is an
+``AsyncSupabaseStorage``: async views can ``await default_storage.asave(...)``,
+``aexists``, ``aurl`` and ``aopen`` without blocking the event loop.
+
+WebSocket connections to ``/ws/threads/<inquiry|order>/<id>/`` are served by
+``orders.realtime.websocket_application`` (live message threads); every other
+scope goes to Django. Run under an ASGI server with WebSocket support, e.g.
+``uvicorn trade_project.asgi:application`` (uses the ``websockets`` package).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +22,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trade_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 在 Django 初始化之后导入（依赖模型）
+from orders.realtime import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'orders.middleware.ContactMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,6 +98,11 @@ if DATABASE_URL:
         'keepalives_count': 5,
     })
 
+    # 经 PgBouncer/Supabase 连接池（事务模式，端口 6543）连接时需关闭服务端游标（影响导出的分块读取）
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = (
+        os.environ.get('DB_DISABLE_SERVER_SIDE_CURSORS', 'false').lower() == 'true'
+    )
+
 elif os.environ.get('VERCEL'):
     # Vercel 环境但没有 DATABASE_URL 时，退回临时 SQLite
     DATABASES = {
@@ -111,6 +117,16 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # 以下只影响本地 SQLite（生产使用 PostgreSQL，不受影响），且对整个项目生效而不是只对某个测试：
+            # 默认的 DEFERRED 事务先读后写时需要把读锁升级为写锁，升级冲突时 SQLite 不会按 timeout 等待，
+            # 而是立即报 "database is locked"；runserver 的多线程请求（如同时提交询单）同样会遇到。
+            # IMMEDIATE 在事务开始时即获取写锁，其余写入者最多等待 timeout 秒。代价是 atomic() 内的只读事务
+            # 也会互相排队，本地开发可以接受。
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+            # 测试库用文件（测试结束后删除，已加入 .gitignore）：默认的内存库（共享缓存）遇到锁冲突时
+            # 同样立即报错而不等待，NumberAllocatorLoadTests 的多线程并发写入需要真实的文件锁。
+            # 测试库在测试开始前创建，无法用 override_settings 只对单个测试生效。
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 
@@ -160,6 +176,86 @@ if os.environ.get('VERCEL'):
     except Exception:
         pass
 
+# 一个请求内附件并发上传的线程数
+ATTACHMENT_UPLOAD_WORKERS = int(os.environ.get('ATTACHMENT_UPLOAD_WORKERS', '4'))
+
+# 缩略图后台生成线程数；0 表示不在请求进程内生成（使用 generate_thumbnails 命令补齐）
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', '2'))
+
+# 询单/订单列表每页条数（游标分页）
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', '25'))
+
+# 缓存：配置 REDIS_URL 时多个进程共享（需安装 redis），否则为进程内缓存
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+# 仪表板统计缓存时间（秒）；数据变化时按信号失效，此值只是兜底
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', '300'))
+
+# session 中缓存的联系人信息（角色、公司、审批状态）最长有效期（秒）
+CONTACT_INFO_TTL = int(os.environ.get('CONTACT_INFO_TTL', '300'))
+
+# 导出时每次从数据库读取的行数（PostgreSQL 上为服务端游标的每批行数）
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
+
+# 价格表批量报价：每个事务处理的询单数
+QUOTE_BATCH_SIZE = int(os.environ.get('QUOTE_BATCH_SIZE', '50'))
+
+# BOM 导入的最大明细行数（超出的行不再读取）
+BOM_MAX_ROWS = int(os.environ.get('BOM_MAX_ROWS', '5000'))
+# 上传的 XLSX（BOM、价格表）中工作表 XML 解压后的最大字节数（默认 50MB）
+XLSX_MAX_XML_SIZE = int(os.environ.get('XLSX_MAX_XML_SIZE', '52428800'))
+
+# 询单号/订单号每个进程一次预留的序号数（1 = 严格按创建顺序连续编号）
+NUMBER_BLOCK_SIZE = int(os.environ.get('NUMBER_BLOCK_SIZE', '1'))
+
+# 列表检索最多返回的结果数（按相关度排序）
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', '500'))
+
+# 浏览器直传：上传会话 token 的有效期（秒）
+DIRECT_UPLOAD_TTL = int(os.environ.get('DIRECT_UPLOAD_TTL', '3600'))
+
+# 详情页每次加载的沟通消息条数（首屏最新一页，其余按「加载更早的消息」分页）
+MESSAGE_PAGE_SIZE = int(os.environ.get('MESSAGE_PAGE_SIZE', '30'))
+
+# 沟通消息实时推送：进程内广播器（多进程部署时各进程另按 REALTIME_RECHECK_SECONDS 查库补齐）
+REALTIME_BROKER = os.environ.get('REALTIME_BROKER', 'orders.realtime.InProcessBroker')
+# 连接空闲时查库补齐新消息并发送心跳的间隔（秒）
+REALTIME_RECHECK_SECONDS = int(os.environ.get('REALTIME_RECHECK_SECONDS', '15'))
+# WSGI 下没有长连接推送，详情页轮询新消息的间隔（秒）
+REALTIME_POLL_SECONDS = int(os.environ.get('REALTIME_POLL_SECONDS', '5'))
+# 连接建立或重连时最多补发的消息数
+REALTIME_CATCHUP_LIMIT = int(os.environ.get('REALTIME_CATCHUP_LIMIT', '100'))
+
+# 邮件：配置 EMAIL_HOST 时通过 SMTP 发送，否则输出到控制台（本地可用 smtp_sink 命令接收）
+EMAIL_HOST = os.environ.get('EMAIL_HOST', '')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', '587'))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'true').lower() == 'true'
+EMAIL_TIMEOUT = int(os.environ.get('EMAIL_TIMEOUT', '30'))
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'webmaster@localhost')
+EMAIL_BACKEND = ('django.core.mail.backends.smtp.EmailBackend' if EMAIL_HOST
+                 else 'django.core.mail.backends.console.EmailBackend')
+
+# 邮件通知：同一收件人在此时间（秒）内的通知合并为一封摘要邮件
+NOTIFICATION_DIGEST_WINDOW = int(os.environ.get('NOTIFICATION_DIGEST_WINDOW', '300'))
+# 发送进程每批领取的收件人数
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', '100'))
+# 发送进程保持的 SMTP 连接数（并发发送线程数）
+NOTIFICATION_SMTP_CONNECTIONS = int(os.environ.get('NOTIFICATION_SMTP_CONNECTIONS', '2'))
+# 发送失败的最多尝试次数，之后标记为发送失败
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', '5'))
+# 已发送通知的保留天数（0 = 不清理）
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', '30'))
+# 邮件中链接的站点地址，如 https://trade.example.com
+NOTIFICATION_SITE_URL = os.environ.get('NOTIFICATION_SITE_URL', '')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -233,7 +329,8 @@ LOGGING = {
 if os.environ.get('SUPABASE_SERVICE_KEY') and os.environ.get('SUPABASE_URL'):
     STORAGES = {
         'default': {
-            'BACKEND': 'trade_project.storage_backends.SupabaseStorage'
+            # 异步子类：同步接口不变，另提供 asave/aexists/aurl/aopen 供异步视图使用
+            'BACKEND': 'trade_project.storage_backends.AsyncSupabaseStorage'
         },
         'staticfiles': {
             'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -1,65 +1,846 @@
 import os
+import io
+import asyncio
+import atexit
+import base64
+import hashlib
+import json
+import threading
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from datetime import timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import File
 from django.core.files.storage import Storage
 import httpx
 from urllib.parse import quote
 import re
 import time
 
+
+# ==================== 共享 HTTP 客户端（连接池 + HTTP/2） ====================
+# 整个进程复用同一个 httpx.Client：避免每次上传 / exists 探测都重新做 TLS 握手。
+# 连接池参数可通过环境变量调整：
+#   SUPABASE_HTTP2               是否启用 HTTP/2（默认 true，需安装 httpx[http2]）
+#   SUPABASE_MAX_CONNECTIONS     最大连接数（默认 20）
+#   SUPABASE_MAX_KEEPALIVE       最大保活连接数（默认 10）
+#   SUPABASE_KEEPALIVE_EXPIRY    保活连接空闲过期秒数（默认 30）
+#   SUPABASE_TIMEOUT             请求超时秒数（默认 30）
+_client = None
+_client_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _http2_enabled():
+    if os.environ.get('SUPABASE_HTTP2', 'true').lower() != 'true':
+        return False
+    try:
+        import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    except ImportError:
+        return False
+    return True
+
+
+def _client_options():
+    return {
+        'http2': _http2_enabled(),
+        'limits': httpx.Limits(
+            max_connections=_env_int('SUPABASE_MAX_CONNECTIONS', 20),
+            max_keepalive_connections=_env_int('SUPABASE_MAX_KEEPALIVE', 10),
+            keepalive_expiry=_env_float('SUPABASE_KEEPALIVE_EXPIRY', 30),
+        ),
+        'timeout': _env_float('SUPABASE_TIMEOUT', 30),
+    }
+
+
+def get_http_client():
+    """获取进程级共享的 httpx.Client（首次调用时创建）"""
+    global _client
+    if _client is None or _client.is_closed:
+        with _client_lock:
+            if _client is None or _client.is_closed:
+                _client = httpx.Client(**_client_options())
+    return _client
+
+
+def close_http_client():
+    """关闭共享客户端，释放连接池（进程退出时自动调用）"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+atexit.register(close_http_client)
+
+
+# ==================== 流式上传参数 ====================
+# 普通上传按块流式读取，内存占用只与块大小有关，与文件大小无关。
+# 超过阈值的文件走 Supabase 的 TUS 断点续传接口（每块固定 6MB，Supabase 要求）。
+#   SUPABASE_UPLOAD_CHUNK_SIZE      普通上传读取块大小（默认 256KB）
+#   SUPABASE_RESUMABLE_THRESHOLD    超过该字节数走断点续传（默认 6MB，设为 0 表示关闭）
+#   SUPABASE_RESUMABLE_RETRIES      单块上传失败后的重试次数（默认 3）
+TUS_CHUNK_SIZE = 6 * 1024 * 1024
+
+
+def iter_chunks(content, chunk_size):
+    """按固定块大小读取文件对象，不把整个文件读入内存"""
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    while True:
+        chunk = content.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def content_size(content):
+    """尽量不读取内容地获得文件大小；无法获得时返回 None"""
+    size = getattr(content, 'size', None)
+    if size is not None:
+        return size
+    if hasattr(content, 'seek') and hasattr(content, 'tell'):
+        pos = content.tell()
+        content.seek(0, os.SEEK_END)
+        size = content.tell()
+        content.seek(pos)
+        return size
+    return None
+
+
+def sanitize_key(name: str) -> str:
+    """把任意文件名转换为 Supabase 可接受的对象 key（仅保留 ASCII 安全字符）"""
+    name = name.lstrip('/')
+    if '/' in name:
+        dir_part, base = name.rsplit('/', 1)
+    else:
+        dir_part, base = '', name
+    root, ext = os.path.splitext(base)
+    safe_root = re.sub(r'[^A-Za-z0-9._-]', '_', root).strip('_')
+    if not safe_root:
+        # 纯中文/日文文件名：用原名的摘要代替，保证不同文件名得到不同 key
+        safe_root = 'file_' + hashlib.sha1(root.encode('utf-8')).hexdigest()[:12]
+    safe_base = safe_root + ext.lower()
+    return f'{dir_part}/{safe_base}' if dir_part else safe_base
+
+
+# ==================== URL 缓存 ====================
+# 公开 bucket：URL 只由 (base, bucket, name) 决定，用有界 LRU 记忆化，避免每次渲染都做正则与 quote。
+# 私有 bucket（SUPABASE_PRIVATE_BUCKET=true）：签发限时 URL，一次 API 调用批量签发一页附件，
+# 并缓存到过期前 SUPABASE_SIGNED_URL_MARGIN 秒。
+#   SUPABASE_URL_CACHE_SIZE         URL 缓存条目上限（默认 4096）
+#   SUPABASE_SIGNED_URL_TTL         签名 URL 有效期秒数（默认 3600）
+#   SUPABASE_SIGNED_URL_MARGIN      提前多少秒视为过期并重新签发（默认 300）
+URL_CACHE_SIZE = _env_int('SUPABASE_URL_CACHE_SIZE', 4096)
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def public_url(base, bucket, name):
+    encoded = quote(sanitize_key(name), safe='/')
+    return f"{base}/storage/v1/object/public/{bucket}/{encoded}"
+
+
+class TTLCache:
+    """线程安全的有界 LRU，条目带过期时间"""
+
+    def __init__(self, maxsize=URL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        now = now or time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# ==================== 按需分段读取 ====================
+# open() 返回的文件对象不下载整个文件：每次读取通过 HTTP Range 请求所需区间，
+# 外面套一层 BufferedReader 做预读。
+#   SUPABASE_READ_BUFFER_SIZE       每次 Range 请求的预读字节数（默认 1MB）
+#   SUPABASE_META_CACHE_TTL         HEAD 元数据（大小、修改时间）缓存秒数（默认 60）
+class RangeReader(io.RawIOBase):
+    """基于 HTTP Range 的只读、可 seek 原始流"""
+
+    def __init__(self, client, url, headers, size):
+        self._client = client
+        self._url = url
+        self._headers = headers
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if pos < 0:
+            raise ValueError("negative seek position")
+        self._pos = pos
+        return self._pos
+
+    def readinto(self, buffer):
+        if self._pos >= self._size or len(buffer) == 0:
+            return 0
+        end = min(self._pos + len(buffer), self._size) - 1
+        headers = dict(self._headers)
+        headers['Range'] = f'bytes={self._pos}-{end}'
+        resp = self._client.get(self._url, headers=headers)
+        if resp.status_code not in (200, 206):
+            raise OSError(f"read error {resp.status_code}: {resp.text}")
+        data = resp.content
+        if resp.status_code == 200:
+            # 服务端忽略了 Range：截取需要的区间
+            data = data[self._pos:end + 1]
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+    def readall(self):
+        # read() 不带参数时一次请求剩余全部内容，而不是按 8KB 逐段请求
+        if self._pos >= self._size:
+            return b''
+        buffer = bytearray(self._size - self._pos)
+        n = self.readinto(buffer)
+        return bytes(buffer[:n])
+
+
+class SupabaseFile(File):
+    """SupabaseStorage.open() 返回的文件对象（只读、可 seek、按需下载）"""
+
+    def __init__(self, raw, name, buffer_size):
+        self._raw = raw
+        super().__init__(io.BufferedReader(raw, buffer_size=buffer_size), name)
+        self.mode = 'rb'
+
+    @property
+    def size(self):
+        return self._raw._size
+
+
+# ==================== 内容寻址存储 ====================
+# 开启后（SUPABASE_CONTENT_ADDRESSED，默认 true）文件按 SHA-256 存放在 cas/<前两位>/<摘要><扩展名>：
+# 同一份图纸无论被哪个模型引用多少次，只上传、只存储一次；原始文件名作为对象元数据保存，
+# 业务上的显示名仍以各附件模型的 file_name 字段为准。
+CAS_PREFIX = 'cas'
+
+
+def file_digest(content, chunk_size=256 * 1024):
+    """分块计算文件的 SHA-256（结果缓存在文件对象上，同一对象只计算一次）"""
+    digest = getattr(content, '_sha256_digest', None)
+    if digest:
+        return digest
+    h = hashlib.sha256()
+    for chunk in iter_chunks(content, chunk_size):
+        h.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    digest = h.hexdigest()
+    try:
+        content._sha256_digest = digest
+    except AttributeError:
+        pass
+    return digest
+
+
+def content_key(digest, name):
+    """由内容摘要与原文件扩展名得到存储 key"""
+    ext = re.sub(r'[^a-z0-9.]', '', os.path.splitext(name)[1].lower())
+    return f'{CAS_PREFIX}/{digest[:2]}/{digest}{ext}'
+
+
+def digest_from_key(name):
+    """从内容寻址 key 中取回摘要；非内容寻址的旧路径返回 None"""
+    match = re.match(rf'^{CAS_PREFIX}/[0-9a-f]{{2}}/([0-9a-f]{{64}})', (name or '').lstrip('/'))
+    return match.group(1) if match else None
+
+
 class SupabaseStorage(Storage):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._url = os.environ.get('SUPABASE_URL')
-        self._key = os.environ.get('SUPABASE_SERVICE_KEY')
-        self._bucket = os.environ.get('SUPABASE_BUCKET', 'media')
+    def __init__(self, url=None, key=None, bucket=None, content_addressed=None, **kwargs):
+        super().__init__(**kwargs)
+        self._url = url or os.environ.get('SUPABASE_URL')
+        self._key = key or os.environ.get('SUPABASE_SERVICE_KEY')
+        self._bucket = bucket or os.environ.get('SUPABASE_BUCKET', 'media')
         self._base = (self._url or '').rstrip('/')
+        if content_addressed is None:
+            content_addressed = os.environ.get('SUPABASE_CONTENT_ADDRESSED', 'true').lower() == 'true'
+        self._content_addressed = content_addressed
+        self._private = os.environ.get('SUPABASE_PRIVATE_BUCKET', 'false').lower() == 'true'
+        self._signed_ttl = _env_int('SUPABASE_SIGNED_URL_TTL', 3600)
+        self._signed_margin = _env_int('SUPABASE_SIGNED_URL_MARGIN', 300)
+        self._signed_urls = TTLCache()
+        self._meta_cache = TTLCache(maxsize=1024)
+
+    @property
+    def signs_urls(self):
+        """是否为私有 bucket（URL 需要签发，适合按页批量预取）"""
+        return self._private
+
+    @property
+    def client(self):
+        return get_http_client()
 
     def _normalize_path(self, name: str) -> str:
         name = name.lstrip('/')
         return name
 
     def _sanitize_key(self, name: str) -> str:
-        name = self._normalize_path(name)
-        if '/' in name:
-            dir_part, base = name.rsplit('/', 1)
-        else:
-            dir_part, base = '', name
-        root, ext = os.path.splitext(base)
-        safe_root = re.sub(r'[^A-Za-z0-9._-]', '_', root).strip('_')
-        if not safe_root:
-            safe_root = f'file_{int(time.time())}'
-        safe_base = safe_root + ext.lower()
-        return f'{dir_part}/{safe_base}' if dir_part else safe_base
+        return sanitize_key(name)
 
-    def _save(self, name, content):
-        name = self._sanitize_key(name)
-        if hasattr(content, 'seek'):
-            content.seek(0)
-        data = content.read()
-        headers = {
+    def _auth_headers(self):
+        return {
             'Authorization': f'Bearer {self._key}',
             'apikey': self._key,
-            'Content-Type': getattr(content, 'content_type', 'application/octet-stream'),
-            'x-upsert': 'true',
         }
+
+    def get_available_name(self, name, max_length=None):
+        if self._content_addressed:
+            # 实际 key 由内容摘要决定，无需 exists() 探测去重名
+            return name
+        return super().get_available_name(name, max_length=max_length)
+
+    def _upload_plan(self, name, content):
+        """确定上传参数：key、大小、类型、是否覆盖、元数据，以及是否走断点续传"""
+        size = content_size(content)
+        plan = {
+            'size': size,
+            'content_type': getattr(content, 'content_type', None) or 'application/octet-stream',
+        }
+        if self._content_addressed:
+            original_name = os.path.basename(getattr(content, 'name', None) or name)
+            plan.update(name=content_key(file_digest(content), name), upsert=False,
+                        metadata={'originalName': original_name})
+        else:
+            plan.update(name=self._sanitize_key(name), upsert=True, metadata=None)
+        threshold = _env_int('SUPABASE_RESUMABLE_THRESHOLD', TUS_CHUNK_SIZE)
+        plan['resumable'] = bool(threshold and size is not None and size > threshold)
+        return plan
+
+    def _save(self, name, content):
+        plan = self._upload_plan(name, content)
+        name = plan['name']
+        if self._content_addressed and self.exists(name):
+            return name
+        self._meta_cache.pop(name)
+        args = (name, content, plan['size'], plan['content_type'], plan['upsert'], plan['metadata'])
+        if plan['resumable']:
+            self._save_resumable(*args)
+        else:
+            self._save_streaming(*args)
+        return name
+
+    def upload_to_key(self, name, content, content_type=None):
+        """按指定 key 上传（覆盖），不做内容寻址；用于迁移已有路径的文件。返回实际 key"""
+        name = self._sanitize_key(name)
+        size = content_size(content)
+        content_type = content_type or getattr(content, 'content_type', None) or 'application/octet-stream'
+        self._meta_cache.pop(name)
+        threshold = _env_int('SUPABASE_RESUMABLE_THRESHOLD', TUS_CHUNK_SIZE)
+        if threshold and size is not None and size > threshold:
+            self._save_resumable(name, content, size, content_type)
+        else:
+            self._save_streaming(name, content, size, content_type)
+        return name
+
+    def create_upload_url(self, name, upsert=False):
+        """签发浏览器直传用的上传 URL（PUT 到该 URL 无需服务密钥，Supabase 有效期 2 小时）。返回 (key, url)"""
+        name = self._sanitize_key(name)
+        headers = self._auth_headers()
+        if upsert:
+            headers['x-upsert'] = 'true'
+        resp = self.client.post(
+            f"{self._base}/storage/v1/object/upload/sign/{self._bucket}/{quote(name, safe='/')}",
+            headers=headers,
+        )
+        if resp.status_code >= 400:
+            raise Exception(f"sign upload error {resp.status_code}: {resp.text}")
+        signed = resp.json()['url']
+        self._meta_cache.pop(name)
+        return name, signed if signed.startswith('http') else f"{self._base}/storage/v1{signed}"
+
+    def move(self, source, destination):
+        """在 bucket 内移动对象（服务端完成，不经本机传输）。目标已存在时返回 False，源对象保留"""
+        source, destination = self._sanitize_key(source), self._sanitize_key(destination)
+        resp = self.client.post(
+            f"{self._base}/storage/v1/object/move",
+            headers=self._auth_headers(),
+            json={'bucketId': self._bucket, 'sourceKey': source, 'destinationKey': destination},
+        )
+        self._meta_cache.pop(source)
+        self._meta_cache.pop(destination)
+        if self._is_duplicate(resp):
+            return False
+        if resp.status_code >= 400:
+            raise Exception(f"move error {resp.status_code}: {resp.text}")
+        return True
+
+    def _is_duplicate(self, resp):
+        """不覆盖模式下对象已存在：内容相同（key 即摘要），视为成功"""
+        return resp.status_code == 409 or (resp.status_code == 400 and 'Duplicate' in resp.text)
+
+    def _check_upload(self, resp, upsert):
+        if resp.status_code >= 400 and not (not upsert and self._is_duplicate(resp)):
+            raise Exception(f"upload error {resp.status_code}: {resp.text}")
+
+    def _streaming_request(self, name, size, content_type, upsert=True, metadata=None):
+        """单次上传请求的 URL 与请求头"""
+        headers = self._auth_headers()
+        headers.update({
+            'Content-Type': content_type,
+            'x-upsert': 'true' if upsert else 'false',
+        })
+        if metadata:
+            headers['x-metadata'] = base64.b64encode(json.dumps(metadata).encode('utf-8')).decode('ascii')
+        if size is not None:
+            # 给出 Content-Length 时 httpx 不使用 chunked 编码
+            headers['Content-Length'] = str(size)
         encoded = quote(name, safe='/')
-        url = f"{self._base}/storage/v1/object/{self._bucket}/{encoded}?upsert=true"
-        with httpx.Client(timeout=30) as client:
-            resp = client.post(url, headers=headers, content=data)
+        url = f"{self._base}/storage/v1/object/{self._bucket}/{encoded}"
+        if upsert:
+            url += '?upsert=true'
+        return url, headers
+
+    def _save_streaming(self, name, content, size, content_type, upsert=True, metadata=None):
+        """单次请求上传，请求体按块流式发送"""
+        url, headers = self._streaming_request(name, size, content_type, upsert, metadata)
+        chunk_size = _env_int('SUPABASE_UPLOAD_CHUNK_SIZE', 256 * 1024)
+        resp = self.client.post(url, headers=headers, content=iter_chunks(content, chunk_size))
+        self._check_upload(resp, upsert)
+
+    def _save_resumable(self, name, content, size, content_type, upsert=True, metadata=None):
+        """TUS 断点续传：先创建上传会话，再逐块 PATCH，失败时按服务器记录的偏移量续传"""
+        def b64(value):
+            return base64.b64encode(value.encode('utf-8')).decode('ascii')
+
+        headers = self._auth_headers()
+        upload_metadata = [
+            f'bucketName {b64(self._bucket)}',
+            f'objectName {b64(name)}',
+            f'contentType {b64(content_type)}',
+        ]
+        if metadata:
+            upload_metadata.append(f'metadata {b64(json.dumps(metadata))}')
+        headers.update({
+            'Tus-Resumable': '1.0.0',
+            'Upload-Length': str(size),
+            'Upload-Metadata': ','.join(upload_metadata),
+            'x-upsert': 'true' if upsert else 'false',
+        })
+        resp = self.client.post(f"{self._base}/storage/v1/upload/resumable", headers=headers)
+        if not upsert and self._is_duplicate(resp):
+            return
+        if resp.status_code >= 400:
+            raise Exception(f"upload error {resp.status_code}: {resp.text}")
+        location = resp.headers.get('Location')
+        if not location:
+            raise Exception("upload error: resumable session has no Location")
+        if location.startswith('/'):
+            location = self._base + location
+
+        retries = _env_int('SUPABASE_RESUMABLE_RETRIES', 3)
+        offset = 0
+        failures = 0
+        while offset < size:
+            content.seek(offset)
+            chunk = content.read(TUS_CHUNK_SIZE)
+            patch_headers = self._auth_headers()
+            patch_headers.update({
+                'Tus-Resumable': '1.0.0',
+                'Upload-Offset': str(offset),
+                'Content-Type': 'application/offset+octet-stream',
+            })
+            try:
+                r = self.client.patch(location, headers=patch_headers, content=chunk)
+                if r.status_code >= 400:
+                    raise Exception(f"upload error {r.status_code}: {r.text}")
+                offset = int(r.headers.get('Upload-Offset', offset + len(chunk)))
+                failures = 0
+            except Exception:
+                failures += 1
+                if failures > retries:
+                    raise
+                # 询问服务器已接收的偏移量，从断点继续
+                head_headers = self._auth_headers()
+                head_headers['Tus-Resumable'] = '1.0.0'
+                h = self.client.head(location, headers=head_headers)
+                if h.status_code >= 400 or 'Upload-Offset' not in h.headers:
+                    raise
+                offset = int(h.headers['Upload-Offset'])
+
+    def _object_url(self, name, authenticated=False):
+        encoded = quote(self._sanitize_key(name), safe='/')
+        if authenticated:
+            return f"{self._base}/storage/v1/object/authenticated/{self._bucket}/{encoded}"
+        return f"{self._base}/storage/v1/object/{self._bucket}/{encoded}"
+
+    def _head(self, name):
+        """HEAD 取对象元数据（size / modified），短时缓存；对象不存在时抛 FileNotFoundError"""
+        name = self._sanitize_key(name)
+        meta = self._meta_cache.get(name)
+        if meta is not None:
+            return meta
+        r = self.client.head(self._object_url(name, authenticated=True), headers=self._auth_headers())
+        return self._cache_head(name, r)
+
+    def _cache_head(self, name, r):
+        if r.status_code == 404 or r.status_code == 400:
+            raise FileNotFoundError(name)
+        if r.status_code >= 400:
+            raise Exception(f"head error {r.status_code}")
+        modified = r.headers.get('Last-Modified')
+        meta = {
+            'size': int(r.headers.get('Content-Length') or 0),
+            'modified': parsedate_to_datetime(modified) if modified else None,
+            'content_type': r.headers.get('Content-Type'),
+            'etag': (r.headers.get('ETag') or '').strip('"'),
+        }
+        self._meta_cache.set(name, meta, time.time() + _env_int('SUPABASE_META_CACHE_TTL', 60))
+        return meta
+
+    def size(self, name):
+        return self._head(name)['size']
+
+    def get_modified_time(self, name):
+        modified = self._head(name)['modified']
+        if modified is None:
+            raise NotImplementedError("storage did not return Last-Modified")
+        if settings.USE_TZ:
+            return modified
+        return modified.astimezone().replace(tzinfo=None)
+
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError("SupabaseStorage files are read-only; use save() to write")
+        size = self.size(name)
+        raw = RangeReader(self.client, self._object_url(name, authenticated=True), self._auth_headers(), size)
+        return SupabaseFile(raw, name, _env_int('SUPABASE_READ_BUFFER_SIZE', 1024 * 1024))
+
+    def delete(self, name):
+        name = self._sanitize_key(name)
+        resp = self.client.delete(self._object_url(name), headers=self._auth_headers())
+        self._meta_cache.pop(name)
+        if resp.status_code >= 400 and resp.status_code != 404:
+            raise Exception(f"delete error {resp.status_code}: {resp.text}")
+
+    def delete_many(self, names, batch_size=1000):
+        """批量删除，每批一次 API 调用；返回实际删除的数量"""
+        keys = [self._sanitize_key(n) for n in names if n]
+        deleted = 0
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            resp = self.client.request(
+                'DELETE', f"{self._base}/storage/v1/object/{self._bucket}",
+                headers=self._auth_headers(), json={'prefixes': batch},
+            )
             if resp.status_code >= 400:
-                raise Exception(f"upload error {resp.status_code}: {resp.text}")
-        return name
+                raise Exception(f"delete error {resp.status_code}: {resp.text}")
+            deleted += len(resp.json() or [])
+            for key in batch:
+                self._meta_cache.pop(key)
+        return deleted
+
+    def listdir(self, path, page_size=1000):
+        """分页列出目录：返回 (子目录列表, 文件列表)"""
+        prefix = self._normalize_path(path or '').rstrip('/')
+        directories, files = [], []
+        offset = 0
+        while True:
+            resp = self.client.post(
+                f"{self._base}/storage/v1/object/list/{self._bucket}",
+                headers=self._auth_headers(),
+                json={'prefix': prefix, 'limit': page_size, 'offset': offset,
+                      'sortBy': {'column': 'name', 'order': 'asc'}},
+            )
+            if resp.status_code >= 400:
+                raise Exception(f"list error {resp.status_code}: {resp.text}")
+            page = resp.json() or []
+            for item in page:
+                # Supabase 中“目录”条目没有 id
+                if item.get('id') is None:
+                    directories.append(item['name'])
+                else:
+                    files.append(item['name'])
+            if len(page) < page_size:
+                break
+            offset += page_size
+        return directories, files
+
+    def _exists_request(self, name):
+        """exists() 用的 HEAD 请求：私有 bucket 走鉴权接口，公开 bucket 直接探测公开 URL"""
+        name = self._normalize_path(name)
+        if self._private:
+            return self._object_url(name), self._auth_headers()
+        return public_url(self._base, self._bucket, name), {}
 
     def exists(self, name):
         try:
-            name = self._normalize_path(name)
-            url = self.url(name)
-            with httpx.Client(timeout=10) as client:
-                r = client.head(url)
+            url, headers = self._exists_request(name)
+            r = self.client.head(url, headers=headers, timeout=10)
             return r.status_code == 200
         except Exception:
             return False
 
     def url(self, name):
-        name = self._sanitize_key(name)
-        encoded = quote(name, safe='/')
-        return f"{self._base}/storage/v1/object/public/{self._bucket}/{encoded}"
\ No newline at end of file
+        if self._private:
+            return self.signed_urls([name])[name]
+        return public_url(self._base, self._bucket, name)
+
+    def _cached_signed_urls(self, names, now):
+        """拆分为缓存命中 {name: url} 与待签发 {key: name}"""
+        result = {}
+        missing = {}
+        for name in names:
+            if not name or name in result:
+                continue
+            cached = self._signed_urls.get(name, now)
+            if cached:
+                result[name] = cached
+            else:
+                missing.setdefault(self._sanitize_key(name), name)
+        return result, missing
+
+    def _sign_request(self, missing):
+        return {
+            'url': f"{self._base}/storage/v1/object/sign/{self._bucket}",
+            'headers': self._auth_headers(),
+            'json': {'expiresIn': self._signed_ttl, 'paths': list(missing)},
+        }
+
+    def _collect_signed(self, resp, missing, now, result):
+        if resp.status_code >= 400:
+            raise Exception(f"sign error {resp.status_code}: {resp.text}")
+        expires_at = now + max(self._signed_ttl - self._signed_margin, 1)
+        for item in resp.json():
+            name = missing.get(item.get('path'))
+            signed = item.get('signedURL') or item.get('signedUrl')
+            if name is None or not signed:
+                continue
+            url = signed if signed.startswith('http') else f"{self._base}/storage/v1{signed}"
+            self._signed_urls.set(name, url, expires_at)
+            result[name] = url
+        return result
+
+    def signed_urls(self, names):
+        """批量获取签名 URL：命中缓存的直接返回，其余一次 API 调用签发。返回 {name: url}"""
+        now = time.time()
+        result, missing = self._cached_signed_urls(names, now)
+        if missing:
+            resp = self.client.post(**self._sign_request(missing))
+            self._collect_signed(resp, missing, now, result)
+        return result
+
+    def prefetch_urls(self, names):
+        """渲染前预取一页文件的 URL；公开 bucket 下无需预取"""
+        if self._private:
+            self.signed_urls(list(names))
+
+
+# ==================== 异步存储（ASGI） ====================
+# httpx.AsyncClient 的连接绑定在创建它的事件循环上，因此按事件循环各保留一个共享客户端。
+# ASGI 部署下只有一个事件循环，即整个进程共用一个连接池。
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_http_client():
+    """获取当前事件循环共享的 httpx.AsyncClient"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(**_client_options())
+        _async_clients[loop] = client
+    return client
+
+
+async def aclose_http_client():
+    """关闭当前事件循环的共享 AsyncClient（ASGI 服务器关闭时调用）"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+class AsyncRangeReader:
+    """open() 的异步版本：按需通过 HTTP Range 读取，支持 seek"""
+
+    def __init__(self, storage, name, url, headers, size):
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self._url = url
+        self._headers = headers
+        self._pos = 0
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence]
+        if base + offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = base + offset
+        return self._pos
+
+    async def read(self, size=-1):
+        if self._pos >= self.size:
+            return b''
+        end = self.size if size is None or size < 0 else min(self._pos + size, self.size)
+        headers = dict(self._headers)
+        headers['Range'] = f'bytes={self._pos}-{end - 1}'
+        resp = await get_async_http_client().get(self._url, headers=headers)
+        if resp.status_code not in (200, 206):
+            raise OSError(f"read error {resp.status_code}: {resp.text}")
+        data = resp.content
+        if resp.status_code == 200:
+            data = data[self._pos:end]
+        self._pos += len(data)
+        return data
+
+    async def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or _env_int('SUPABASE_READ_BUFFER_SIZE', 1024 * 1024)
+        self._pos = 0
+        while True:
+            data = await self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+class AsyncSupabaseStorage(SupabaseStorage):
+    """在同步 Storage 接口之外提供可 await 的 asave / aexists / aurl / aopen
+
+    同步方法（admin、表单、FieldFile）行为不变；异步视图可直接 await 异步方法，
+    单个 worker 即可同时等待多个存储请求。
+    """
+
+    @property
+    def aclient(self):
+        return get_async_http_client()
+
+    async def aexists(self, name):
+        try:
+            url, headers = self._exists_request(name)
+            r = await self.aclient.head(url, headers=headers, timeout=10)
+            return r.status_code == 200
+        except Exception:
+            return False
+
+    async def aget_available_name(self, name, max_length=None):
+        if self._content_addressed:
+            return name
+        dir_name, file_name = os.path.split(name)
+        file_root, file_ext = os.path.splitext(file_name)
+        while await self.aexists(self._sanitize_key(name)):
+            name = os.path.join(dir_name, self.get_alternative_name(file_root, file_ext))
+        return name
+
+    async def asave(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = await self.aget_available_name(name, max_length=max_length)
+        # 计算摘要是纯 CPU + 本地读取，放到线程里避免阻塞事件循环
+        plan = await sync_to_async(self._upload_plan, thread_sensitive=False)(name, content)
+        name = plan['name']
+        if self._content_addressed and await self.aexists(name):
+            return name
+        self._meta_cache.pop(name)
+        if plan['resumable']:
+            # 大文件分块续传仍使用同步实现（在线程中运行），保证内存占用恒定
+            await sync_to_async(self._save_resumable, thread_sensitive=False)(
+                name, content, plan['size'], plan['content_type'], plan['upsert'], plan['metadata'])
+            return name
+        url, headers = self._streaming_request(name, plan['size'], plan['content_type'],
+                                               plan['upsert'], plan['metadata'])
+        chunk_size = _env_int('SUPABASE_UPLOAD_CHUNK_SIZE', 256 * 1024)
+
+        async def body():
+            for chunk in iter_chunks(content, chunk_size):
+                yield chunk
+
+        resp = await self.aclient.post(url, headers=headers, content=body())
+        self._check_upload(resp, plan['upsert'])
+        return name
+
+    async def asave_many(self, items):
+        """并发保存多个文件：items 为 (name, content) 列表，返回保存后的名称列表"""
+        return await asyncio.gather(*(self.asave(name, content) for name, content in items))
+
+    async def asigned_urls(self, names):
+        now = time.time()
+        result, missing = self._cached_signed_urls(names, now)
+        if missing:
+            resp = await self.aclient.post(**self._sign_request(missing))
+            self._collect_signed(resp, missing, now, result)
+        return result
+
+    async def aurl(self, name):
+        if self._private:
+            return (await self.asigned_urls([name]))[name]
+        return public_url(self._base, self._bucket, name)
+
+    async def asize(self, name):
+        key = self._sanitize_key(name)
+        meta = self._meta_cache.get(key)
+        if meta is None:
+            r = await self.aclient.head(self._object_url(key, authenticated=True), headers=self._auth_headers())
+            meta = self._cache_head(key, r)
+        return meta['size']
+
+    async def aopen(self, name):
+        size = await self.asize(name)
+        return AsyncRangeReader(self, name, self._object_url(name, authenticated=True),
+                                self._auth_headers(), size)
@@ -0,0 +1,316 @@
+"""
+本地 Supabase Storage 替身服务器（仅用于基准测试与离线调试）
+
+实现了 SupabaseStorage 用到的最小子集：
+- POST/PUT /storage/v1/object/<bucket>/<key>         上传对象
+- HEAD/GET /storage/v1/object/public/<bucket>/<key>  读取公开对象
+- HEAD/GET /storage/v1/object/authenticated/<bucket>/<key>  读取对象（支持 Range）
+- POST /storage/v1/object/list/<bucket>              分页列目录
+- DELETE /storage/v1/object/<bucket>                  批量删除（JSON: {"prefixes": [...]}）
+- DELETE /storage/v1/object/<bucket>/<key>           删除对象
+- POST /storage/v1/object/sign/<bucket>              批量签发 URL（GET /storage/v1/object/sign/... 读取）
+- POST /storage/v1/object/move                        移动对象（JSON: {"bucketId", "sourceKey", "destinationKey"}）
+- POST /storage/v1/object/upload/sign/<bucket>/<key> 签发直传 URL（PUT 同一路径 ?token=... 上传，无需密钥）
+- POST /storage/v1/upload/resumable                   创建 TUS 断点续传会话
+- PATCH/HEAD /storage/v1/upload/resumable/<id>        追加分块 / 查询已接收偏移量
+
+对象保存在内存字典中。`handshake_delay` 用于在每个新建 TCP 连接上模拟 TLS 握手耗时，
+方便对比“每次新建连接”与“连接池复用”的差异。
+"""
+import base64
+import hashlib
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+
+TUS_PREFIX = '/storage/v1/upload/resumable'
+SIGN_PREFIX = '/storage/v1/object/sign/'
+LIST_PREFIX = '/storage/v1/object/list/'
+UPLOAD_SIGN_PREFIX = '/storage/v1/object/upload/sign/'
+MOVE_PATH = '/storage/v1/object/move'
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        delay = self.server.handshake_delay
+        if delay:
+            time.sleep(delay)
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _object_key(self, public=False):
+        path = unquote(urlsplit(self.path).path)
+        if public:
+            prefixes = ['/storage/v1/object/public/', '/storage/v1/object/sign/',
+                        '/storage/v1/object/authenticated/', '/storage/v1/object/']
+        else:
+            prefixes = ['/storage/v1/object/']
+        for prefix in prefixes:
+            if path.startswith(prefix):
+                return path[len(prefix):]
+        return None
+
+    def _sign(self):
+        bucket = unquote(urlsplit(self.path).path)[len(SIGN_PREFIX):]
+        body = json.loads(self._read_body() or b'{}')
+        self.server.sign_requests += 1
+        signed = [
+            {'path': p, 'signedURL': f"/object/sign/{bucket}/{quote(p)}?token={uuid.uuid4().hex}", 'error': None}
+            for p in body.get('paths', [])
+        ]
+        self._reply(200, json.dumps(signed).encode('utf-8'))
+
+    def _create_upload_url(self):
+        key = unquote(urlsplit(self.path).path)[len(UPLOAD_SIGN_PREFIX):]
+        if not self.headers.get('Authorization'):
+            return self._reply(401, b'{"error":"unauthorized"}')
+        token = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.upload_tokens[token] = key
+        bucket, name = key.split('/', 1)
+        body = {'url': f"/object/upload/sign/{bucket}/{quote(name)}?token={token}", 'token': token}
+        self._reply(200, json.dumps(body).encode('utf-8'))
+
+    def _signed_upload(self):
+        key = unquote(urlsplit(self.path).path)[len(UPLOAD_SIGN_PREFIX):]
+        token = parse_qs(urlsplit(self.path).query).get('token', [''])[0]
+        data = self._read_body()
+        if data is None:
+            return self._reply(400, b'{"error":"incomplete body"}')
+        with self.server.lock:
+            if self.server.upload_tokens.get(token) != key:
+                return self._reply(400, b'{"statusCode":"403","error":"InvalidSignature","message":"invalid token"}')
+            if key in self.server.objects and self.headers.get('x-upsert', 'false').lower() != 'true':
+                return self._reply(400, b'{"statusCode":"409","error":"Duplicate","message":"The resource already exists"}')
+            self.server.objects[key] = (data, self.headers.get('Content-Type', 'application/octet-stream'), time.time())
+            self.server.signed_uploads += 1
+        self._reply(200, json.dumps({'Key': key}).encode('utf-8'))
+
+    def _move(self):
+        body = json.loads(self._read_body() or b'{}')
+        source = f"{body.get('bucketId', '')}/{body.get('sourceKey', '')}"
+        destination = f"{body.get('bucketId', '')}/{body.get('destinationKey', '')}"
+        with self.server.lock:
+            if source not in self.server.objects:
+                return self._reply(404, b'{"statusCode":"404","error":"not_found","message":"Object not found"}')
+            if destination in self.server.objects:
+                return self._reply(400, b'{"statusCode":"409","error":"Duplicate","message":"The resource already exists"}')
+            self.server.objects[destination] = self.server.objects.pop(source)
+        self._reply(200, b'{"message":"Successfully moved"}')
+
+    def _reply(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _read_body(self):
+        """读取请求体；客户端中途断开（实际长度不足 Content-Length）时返回 None"""
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            data = self.rfile.read(length)
+            return data if len(data) == length else None
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip() or b'0', 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        return b''
+
+    def do_POST(self):
+        if urlsplit(self.path).path == TUS_PREFIX:
+            return self._tus_create()
+        if urlsplit(self.path).path == MOVE_PATH:
+            return self._move()
+        if urlsplit(self.path).path.startswith(SIGN_PREFIX):
+            return self._sign()
+        if urlsplit(self.path).path.startswith(LIST_PREFIX):
+            return self._list()
+        if urlsplit(self.path).path.startswith(UPLOAD_SIGN_PREFIX):
+            return self._signed_upload() if self.command == 'PUT' else self._create_upload_url()
+        key = self._object_key()
+        if key is None:
+            return self._reply(404, b'{"error":"not found"}')
+        data = self._read_body()
+        if data is None:
+            return self._reply(400, b'{"error":"incomplete body"}')
+        with self.server.lock:
+            if key in self.server.objects and self.headers.get('x-upsert', 'false').lower() != 'true':
+                return self._reply(400, b'{"statusCode":"409","error":"Duplicate","message":"The resource already exists"}')
+            self.server.objects[key] = (data, self.headers.get('Content-Type', 'application/octet-stream'), time.time())
+            self.server.uploads_received += 1
+        self._reply(200, ('{"Key":"%s"}' % key).encode('utf-8'))
+
+    do_PUT = do_POST
+
+    def do_DELETE(self):
+        key = self._object_key()
+        if key is not None and '/' not in key:
+            # 批量删除：key 只有 bucket 名
+            prefixes = json.loads(self._read_body() or b'{}').get('prefixes', [])
+            deleted = []
+            with self.server.lock:
+                for p in prefixes:
+                    if self.server.objects.pop(f'{key}/{p}', None) is not None:
+                        deleted.append({'name': p})
+            return self._reply(200, json.dumps(deleted).encode('utf-8'))
+        with self.server.lock:
+            found = self.server.objects.pop(key, None) if key is not None else None
+        if found is None:
+            return self._reply(404, b'{"error":"not found"}')
+        self._reply(200, b'{"message":"deleted"}')
+
+    # ---------- TUS 断点续传 ----------
+    def _tus_create(self):
+        meta = {}
+        for pair in (self.headers.get('Upload-Metadata') or '').split(','):
+            if ' ' in pair:
+                k, v = pair.strip().split(' ', 1)
+                meta[k] = base64.b64decode(v).decode('utf-8')
+        key = f"{meta.get('bucketName', '')}/{meta.get('objectName', '')}"
+        upload_id = uuid.uuid4().hex
+        with self.server.lock:
+            if key in self.server.objects and self.headers.get('x-upsert', 'false').lower() != 'true':
+                return self._reply(409, b'{"error":"Duplicate","message":"The resource already exists"}')
+            self.server.uploads[upload_id] = {
+                'key': key,
+                'length': int(self.headers.get('Upload-Length') or 0),
+                'content_type': meta.get('contentType', 'application/octet-stream'),
+                'data': bytearray(),
+            }
+        self._reply(201, headers={'Location': f'{TUS_PREFIX}/{upload_id}', 'Tus-Resumable': '1.0.0'})
+
+    def _tus_upload(self):
+        path = urlsplit(self.path).path
+        if not path.startswith(TUS_PREFIX + '/'):
+            return None
+        return self.server.uploads.get(path[len(TUS_PREFIX) + 1:])
+
+    def do_PATCH(self):
+        upload = self._tus_upload()
+        if upload is None:
+            return self._reply(404, b'{"error":"not found"}')
+        data = self._read_body()
+        if data is None:
+            return self._reply(400, b'{"error":"incomplete body"}')
+        offset = int(self.headers.get('Upload-Offset') or 0)
+        with self.server.lock:
+            if offset != len(upload['data']):
+                return self._reply(409, b'{"error":"offset mismatch"}')
+            upload['data'].extend(data)
+            self.server.max_request_body = max(self.server.max_request_body, len(data))
+            if len(upload['data']) >= upload['length']:
+                self.server.objects[upload['key']] = (bytes(upload['data']), upload['content_type'], time.time())
+        self._reply(204, headers={'Upload-Offset': str(len(upload['data'])), 'Tus-Resumable': '1.0.0'})
+
+    def do_GET(self):
+        if self.command == 'HEAD':
+            upload = self._tus_upload()
+            if upload is not None:
+                return self._reply(200, headers={
+                    'Upload-Offset': str(len(upload['data'])),
+                    'Upload-Length': str(upload['length']),
+                    'Tus-Resumable': '1.0.0',
+                })
+        key = self._object_key(public=True)
+        obj = self.server.objects.get(key) if key is not None else None
+        if obj is None:
+            return self._reply(404, b'{"error":"not found"}')
+        data, content_type, mtime = obj
+        headers = {
+            'Last-Modified': formatdate(mtime, usegmt=True),
+            'Accept-Ranges': 'bytes',
+            'ETag': '"%s"' % hashlib.md5(data).hexdigest(),
+        }
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                return self._reply(416, headers={'Content-Range': f'bytes */{len(data)}'})
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+            self.server.range_requests += 1
+            return self._reply(206, data[start:end + 1], content_type=content_type, headers=headers)
+        self._reply(200, data, content_type=content_type, headers=headers)
+
+    def _list(self):
+        bucket = unquote(urlsplit(self.path).path)[len(LIST_PREFIX):]
+        body = json.loads(self._read_body() or b'{}')
+        prefix = body.get('prefix', '').strip('/')
+        base = f'{bucket}/{prefix}/' if prefix else f'{bucket}/'
+        entries = {}
+        with self.server.lock:
+            for key, (data, content_type, mtime) in self.server.objects.items():
+                if not key.startswith(base):
+                    continue
+                rest = key[len(base):]
+                if '/' in rest:
+                    entries.setdefault(rest.split('/', 1)[0], {'name': rest.split('/', 1)[0], 'id': None, 'metadata': None})
+                else:
+                    entries[rest] = {'name': rest, 'id': rest, 'metadata': {'size': len(data), 'mimetype': content_type}}
+        items = [entries[k] for k in sorted(entries)]
+        offset, limit = int(body.get('offset', 0)), int(body.get('limit', 100))
+        self._reply(200, json.dumps(items[offset:offset + limit]).encode('utf-8'))
+
+    do_HEAD = do_GET
+
+
+class StorageStandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), handshake_delay=0.0):
+        super().__init__(address, StandinHandler)
+        self.handshake_delay = handshake_delay
+        self.objects = {}
+        self.uploads = {}
+        self.max_request_body = 0
+        self.uploads_received = 0
+        self.upload_tokens = {}
+        self.signed_uploads = 0
+        self.sign_requests = 0
+        self.range_requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # 客户端中途断开（上传被取消）属正常情况，不打印堆栈
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
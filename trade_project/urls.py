@@ -23,12 +23,14 @@ urlpatterns = [
     # Buyer 询单管理
     path('buyer/inquiries/', views.inquiry_list, name='inquiry_list'),
     path('buyer/inquiries/create/', views.inquiry_create, name='inquiry_create'),
+    path('buyer/inquiries/export/', views.inquiry_export, name='inquiry_export'),
     path('buyer/inquiries/<int:inquiry_id>/', views.inquiry_detail, name='inquiry_detail'),
     path('buyer/inquiries/<int:inquiry_id>/message/', views.inquiry_message_add, name='inquiry_message_add'),
     
     # Buyer 订单管理
     path('buyer/orders/', views.order_list, name='order_list'),
     path('buyer/orders/create/', views.order_create, name='order_create'),
+    path('buyer/orders/export/', views.order_export, name='order_export'),
     path('buyer/orders/<int:order_id>/', views.order_detail, name='order_detail'),
     path('buyer/orders/<int:order_id>/message/', views.order_message_add, name='order_message_add'),
     
@@ -41,15 +43,28 @@ urlpatterns = [
     
     # Supplier 询单管理
     path('supplier/inquiries/', views.supplier_inquiry_list, name='supplier_inquiry_list'),
+    path('supplier/inquiries/export/', views.supplier_inquiry_export, name='supplier_inquiry_export'),
+    path('supplier/inquiries/quotes/', views.supplier_quote_import, name='supplier_quote_import'),
+    path('supplier/inquiries/quotes/sheet/', views.supplier_price_sheet, name='supplier_price_sheet'),
     path('supplier/inquiries/<int:inquiry_id>/', views.supplier_inquiry_detail, name='supplier_inquiry_detail'),
     
     # Supplier 订单管理
     path('supplier/orders/', views.supplier_order_list, name='supplier_order_list'),
+    path('supplier/orders/export/', views.supplier_order_export, name='supplier_order_export'),
     path('supplier/orders/<int:order_id>/', views.supplier_order_detail, name='supplier_order_detail'),
 
 
     # ... 其他路由
     path('api/inquiry/<int:inquiry_id>/details/', views.get_inquiry_details, name='get_inquiry_details'),
+    # 沟通消息：增量拉取、SSE 推送、更早消息分页与已读标记（WebSocket 见 asgi.py：/ws/threads/<kind>/<id>/）
+    path('api/threads/<str:kind>/<int:pk>/messages/', views.thread_messages, name='thread_messages'),
+    path('api/threads/<str:kind>/<int:pk>/events/', views.thread_events, name='thread_events'),
+    path('api/threads/<str:kind>/<int:pk>/history/', views.thread_history, name='thread_history'),
+    path('api/threads/<str:kind>/<int:pk>/read/', views.thread_read, name='thread_read'),
+    # 浏览器直传
+    path('api/uploads/<str:target>/<int:object_id>/sessions/', views.upload_session_create, name='upload_session_create'),
+    path('api/uploads/finalize/', views.upload_finalize, name='upload_finalize'),
+    path('api/uploads/local/<str:token>/', views.upload_local_put, name='upload_local_put'),
     path('healthz/db', views.health_db, name='health_db'),
     path('healthz/storage', views.health_storage, name='health_storage'),
     path('healthz/version', views.health_version, name='health_version'),